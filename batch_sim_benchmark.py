@@ -0,0 +1,31 @@
+### Batch simulator benchmark ###
+# Runs the nine_bar profile on n simulated machines at once with
+# batchShotSimulator, puck resistance spread log-normally around the
+# fakeEspressoMachine value of 5, and reports shots simulated per second.
+# The one machine case at resistance 5 is checked against shotSimulator
+# running nineBarProfile on a fakeEspressoMachine, to within the 20% two
+# shots' times can differ by from the noise alone (32 machines at resistance
+# 5 span 26.7-31.5 s; batch_sim_test checks it properly).
+
+from espressoSim import *
+
+single = shotSimulator('Nine Bar - Profile', seed = 0)
+t1 = time.perf_counter()
+single.run()
+t2 = time.perf_counter()
+single_time = single.steps*single.period
+print('shotSimulator, 1 machine:         shot time %6.2f s   %7.2f s to run   %8.1f shots/s'%(single_time, t2 - t1, 1/(t2 - t1)))
+
+for n in (1, 100, 1000):
+    np.random.seed(1)
+    resistance = 5.0*np.exp(.3*np.random.standard_normal(n)) if n > 1 else 5.0
+    sim = batchShotSimulator(nine_bar_profile, n, resistance)
+    t1 = time.perf_counter()
+    results = sim.run()
+    t2 = time.perf_counter()
+    shot_time = results['shot_time']
+    print('batchShotSimulator, %4d machines: shot time %6.2f s (%5.2f - %5.2f)   %7.2f s to run   %8.1f shots/s   done: %d'%(
+        n, np.nanmedian(shot_time), np.nanmin(shot_time), np.nanmax(shot_time), t2 - t1, n/(t2 - t1), np.sum(results['done'])))
+    if(n == 1):
+        assert abs(shot_time[0] - single_time) < .2*single_time, 'batch model differs from fakeEspressoMachine'
+print('ok')
@@ -0,0 +1,36 @@
+### Batch simulator test ###
+# Runs nineBarProfile on one fakeEspressoMachine with shotSimulator, and the
+# same profile on 32 machines at the same puck resistance with
+# batchShotSimulator, and checks the batch machines finish like the single
+# one: same shot time and peak pressure, and final weight taken when the
+# shot finished.  The machines differ only by their noise, so the single
+# machine's results have to fall within the spread of the batch's.
+# The first machines to finish, which wait in the batch for the others, are
+# rerun one at a time (each machine has its own noise, so they see the same
+# noise) to check their final weights weren't taken later.
+
+from espressoSim import *
+import contextlib
+import io
+
+with contextlib.redirect_stdout(io.StringIO()):
+    single = shotSimulator('Nine Bar - Profile', seed = 0)
+    single.run()
+single_time = single.steps*single.period
+single_weight = single.machine.state.weight()
+
+sim = batchShotSimulator(nine_bar_profile, 32, 5.0)
+results = sim.run()
+shot_time = results['shot_time']
+final_weight = results['final_weight']
+print('shot time     single: %6.3f s   batch: %6.3f s (%6.3f - %6.3f)'%(single_time, np.median(shot_time), np.min(shot_time), np.max(shot_time)))
+print('final weight  single: %6.2f g   batch: %6.2f g (%6.2f - %6.2f)'%(single_weight, np.median(final_weight), np.min(final_weight), np.max(final_weight)))
+assert np.all(results['done'])
+assert np.min(shot_time) - .05 <= single_time <= np.max(shot_time) + .05, 'shot time differs from shotSimulator'
+assert np.min(final_weight) - .5 <= single_weight <= np.max(final_weight) + .5, 'final weight differs from shotSimulator'
+for i in np.argsort(shot_time)[0:2]:
+    alone = batchShotSimulator(nine_bar_profile, 1, 5.0, seeds = [i]).run()
+    print('machine %2d    alone:  %6.3f s  %6.2f g   in batch: %6.3f s  %6.2f g'%(i, alone['shot_time'][0], alone['final_weight'][0], shot_time[i], final_weight[i]))
+    assert alone['shot_time'][0] == shot_time[i]
+    assert alone['final_weight'][0] == final_weight[i], 'final weight not taken when the shot finished'
+print('ok')
@@ -0,0 +1,251 @@
+### Benchmark suite ###
+# Times the machine, FSM and GUI hot paths on the simulated machine and
+# writes the results to a JSON file, so runs from different versions can be
+# compared.  Runs headless (Qt's offscreen platform).
+#   - io_step: ioStep() back to back on a simulated clock, with and without
+#     logging: per sample cost and the samples/s it allows
+#   - io_loop: the real IO thread at fake_io_rate for a few seconds: the
+#     sample rate actually achieved
+#   - log_state: logState() cost with the log already at each length
+#   - update_graphics: MainWindow.updateLabels() and updateGraphics() until
+#     the plot worker's frame is drawn, plus the repaint, with the log at
+#     each length and frame_rows new rows per frame
+#   - gui_idle: CPU used by the GUI's own timers with the log unchanged, as
+#     a fraction of one core
+#   - fsm_latency: sample to published commands, with the FSM thread running
+#     flushMode on the IO thread's samples
+# The logs are copies of a simulated nine bar shot, repeated to length.
+# Usage:
+#   python benchmark_suite.py [-o results.json] [-c previous.json]
+# Results go to benchmarks/<time>-<version>.json (ignored by git) unless -o
+# is given.  -c prints each result next to the one in an earlier results file.
+
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from espressoSim import *
+import json
+import contextlib
+import platform
+import subprocess
+
+log_lengths = [0, 10000, 100000, 1000000]
+gui_log_lengths = [1000, 10000, 100000, 1000000]
+frame_rows = 20         # new log rows per frame: 1 kHz sampling, 50 Hz frames
+
+def timeCalls(f, n):
+    # Per call times (s) of n calls of f #
+    times = np.zeros(n)
+    for i in range(n):
+        t1 = time.perf_counter()
+        f()
+        times[i] = time.perf_counter() - t1
+    return times
+
+def timeSummary(times):
+    return {
+        'mean_us': 1e6*np.mean(times),
+        'p50_us': 1e6*np.percentile(times, 50),
+        'p99_us': 1e6*np.percentile(times, 99),
+        }
+
+def shotRows(n):
+    # n log rows: a simulated nine bar shot, repeated with time running on #
+    sim = shotSimulator('Nine Bar - Profile', seed = 0, log_all = True)
+    sim.run()
+    shot = np.array(sim.machine.log)
+    shot[:, 6] -= shot[0, 6]
+    duration = shot[-1, 6] + sim.period
+    reps = -(-n//len(shot))
+    rows = np.tile(shot, (reps, 1))[0:n]
+    rows[:, 6] += np.repeat(np.arange(reps)*duration, len(shot))[0:n]
+    return rows
+
+def fillLog(machine, rows, n):
+    machine.log_buffer.clear()
+    if(n > 0):
+        machine.log_buffer.appendRows(rows[0:n])
+
+def benchIoStep(n = 20000):
+    results = {}
+    for logging in (False, True):
+        clock = simClock()
+        machine = fakeEspressoMachine(clock = clock)
+        machine.log_enabled = logging
+        def step():
+            clock.advance(1.0/fake_io_rate)
+            machine.ioStep()
+        step()
+        times = timeCalls(step, n)
+        r = timeSummary(times)
+        r['samples_per_s'] = 1.0/np.mean(times)
+        results['logging' if logging else 'no_logging'] = r
+    return results
+
+def benchIoLoop(duration = 3.0):
+    machine = fakeEspressoMachine()
+    machine.startIO()
+    time.sleep(.5)
+    count = machine.sample_count
+    t1 = time.perf_counter()
+    time.sleep(duration)
+    samples = machine.sample_count - count
+    t2 = time.perf_counter()
+    machine.stopIO()
+    return {'rate': fake_io_rate, 'samples_per_s': samples/(t2 - t1)}
+
+def benchLogState(rows, n = 20000):
+    clock = simClock()
+    machine = fakeEspressoMachine(clock = clock)
+    clock.advance(1.0/fake_io_rate)
+    machine.ioStep()
+    results = {}
+    for length in log_lengths:
+        fillLog(machine, rows, length)
+        results[str(length)] = timeSummary(timeCalls(machine.logState, n))
+    return results
+
+def benchGraphics(rows, frames = 30):
+    from espressoGui import MainWindow, QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    machine = fakeEspressoMachine()
+    gui = MainWindow(machine)
+    gui.runTimer.stop()             # frames are drawn by the benchmark instead
+    gui.labelTimer.stop()
+    machine.stopIO()                # and the log only changes between lengths
+    gui.mw.show()
+    app.processEvents()
+    n = [0]
+    def frame():
+        machine.log_buffer.appendRows(rows[n[0]:n[0] + frame_rows])
+        n[0] += frame_rows
+        drawn = gui.frames_drawn
+        gui.updateLabels()
+        gui.updateGraphics()
+        t_end = time.perf_counter() + 5.0
+        while((gui.frames_drawn == drawn) and (time.perf_counter() < t_end)):
+            app.processEvents()     # until the worker's frame is drawn
+        app.processEvents()         # repaint
+    results = {}
+    for length in gui_log_lengths:
+        fillLog(machine, rows, length)
+        n[0] = length
+        frame()
+        times = timeCalls(frame, frames)
+        r = timeSummary(times)
+        r['fps'] = 1.0/np.mean(times)
+        results[str(length)] = r
+    gui.close()
+    gui.mw.close()
+    return results
+
+def benchGuiIdle(rows, duration = 3.0):
+    from espressoGui import MainWindow, QtWidgets, QtCore
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    machine = fakeEspressoMachine()
+    gui = MainWindow(machine)
+    machine.stopIO()
+    fillLog(machine, rows, 10000)
+    gui.mw.show()
+    t_end = time.perf_counter() + 1.0       # first frame drawn
+    while(time.perf_counter() < t_end):
+        app.processEvents()
+        time.sleep(.001)
+    cpu = time.process_time()
+    t1 = time.perf_counter()
+    QtCore.QTimer.singleShot(int(1000*duration), app.quit)
+    app.exec_()
+    t2 = time.perf_counter()
+    cpu = time.process_time() - cpu
+    gui.close()
+    gui.mw.close()
+    return {'cpu': cpu/(t2 - t1), 'frames_drawn': gui.frames_drawn}
+
+def benchFsmLatency(duration = 3.0):
+    machine = fakeEspressoMachine()
+    fsm = espressoFSM(machine)
+    machine.startIO()
+    fsm.start()
+    fsm.transition(machine, flushMode)
+    fsm.mode_running = True
+    time.sleep(duration)
+    fsm.mode_running = False
+    fsm.stop()
+    machine.stopIO()
+    stats = fsm.stats()
+    return {
+        'runs': stats['runs'],
+        'p50_us': 1e6*stats['latency_p50'],
+        'p99_us': 1e6*stats['latency_p99'],
+        'max_us': 1e6*stats['latency_max'],
+        }
+
+def gitVersion():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+def flatten(results, prefix = ''):
+    # {'a': {'b': 1}} -> {'a.b': 1} #
+    flat = {}
+    for name, value in results.items():
+        if(isinstance(value, dict)):
+            flat.update(flatten(value, prefix + name + '.'))
+        else:
+            flat[prefix + name] = value
+    return flat
+
+def compare(results, previous):
+    old = flatten(previous['results'])
+    print('%-50s %12s %12s %8s'%('', previous.get('version'), results['version'], 'ratio'))
+    for name, value in flatten(results['results']).items():
+        if((name in old) and old[name]):
+            print('%-50s %12.2f %12.2f %8.2f'%(name, old[name], value, value/old[name]))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the machine, FSM and GUI hot paths')
+    parser.add_argument('-o', '--output', default = None, help = 'results JSON (default: in benchmarks/)')
+    parser.add_argument('-c', '--compare', default = None, help = 'earlier results JSON to compare with')
+    args = parser.parse_args()
+
+    benchmarks = [
+        ('io_step', benchIoStep),
+        ('io_loop', benchIoLoop),
+        ('log_state', lambda: benchLogState(rows)),
+        ('update_graphics', lambda: benchGraphics(rows)),
+        ('gui_idle', lambda: benchGuiIdle(rows)),
+        ('fsm_latency', benchFsmLatency),
+        ]
+    results = {
+        'version': gitVersion(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': {},
+        }
+    with contextlib.redirect_stdout(sys.stderr):        # modes and the FSM print progress
+        rows = shotRows(max(log_lengths + gui_log_lengths) + 100*frame_rows)
+        for name, bench in benchmarks:
+            t1 = time.perf_counter()
+            results['results'][name] = bench()
+            print('%s: %.1f s'%(name, time.perf_counter() - t1))
+    for name, value in flatten(results['results']).items():
+        print('%-50s %12.2f'%(name, value))
+    output = args.output
+    if(output is None):
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+        os.makedirs(directory, exist_ok = True)
+        output = os.path.join(directory, '%s-%s.json'%(time.strftime('%Y%m%d-%H%M%S'), results['version'] or 'unknown'))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print('results: %s'%output)
+    if(args.compare is not None):
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
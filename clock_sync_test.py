@@ -0,0 +1,38 @@
+### Clock sync test ###
+# Feeds clockSync a simulated device clock running 50 ppm fast, sampled at
+# 1 kHz, with host arrival times delayed by USB batching: packets come in
+# bursts of up to 8, plus random scheduling delay.  Checks the estimated
+# skew, and that the mapped sample times are much closer to the true sample
+# times than the arrival times are.
+
+from espressoClock import *
+
+rate = 1000.0
+skew = 50e-6
+n = 20000
+np.random.seed(0)
+
+t_true = 1000.0 + np.arange(n)/rate                          # host monotonic time of each sample
+t_device = 870.0 + (t_true - t_true[0])*(1 + skew)          # firmware clock
+t_device = t_device.astype(np.float32).astype(np.float64)   # sent as float32
+burst = 8/rate*np.ceil((np.arange(n) + 1)/8) - (np.arange(n) + 1)/rate
+t_arrival = t_true + burst + np.random.exponential(5e-4, n)
+
+clock = clockSync()
+t_mapped = np.array([clock.update(d, h) for d, h in zip(t_device, t_arrival)]) - clock.epoch_offset
+
+stats = clock.stats()
+settled = slice(n//2, n)
+mapped_error = t_mapped[settled] - t_true[settled]
+arrival_error = t_arrival[settled] - t_true[settled]
+print(stats)
+print('arrival time error: std %.1f us   mapped time error: std %.1f us'%(
+    1e6*np.std(arrival_error), 1e6*np.std(mapped_error)))
+assert abs(stats['skew_ppm'] + 1e6*skew/(1 + skew)) < 5, 'skew estimate off'
+assert np.std(mapped_error) < np.std(arrival_error)/10, 'mapped times still jittery'
+assert np.all(np.diff(t_mapped[settled]) > 0)
+
+# Firmware reset: device time jumps back, the fit starts over #
+clock.update(0.0, t_arrival[-1] + 1e-3)
+assert clock.pairs == 1
+print('ok')
@@ -0,0 +1,80 @@
+### USB decode benchmark ###
+# Compares the original read path (struct.unpack to a list, then a fresh
+# np.array per sample) with espressoComm's in-place decode, against a fake
+# USB device so no hardware is needed.  Reports samples/sec and the bytes
+# allocated per sample (tracemalloc peak over one call, averaged).  The new
+# path also maps each packet's device time onto the host clock and times its
+# read and decode stages, which the original did neither of.
+
+import usb.core
+from espressoComm import *
+import struct
+import time
+import tracemalloc
+
+n_samples = 200000
+
+class fakeUsbDevice():
+    # Stands in for a pyusb device: every read returns the same packet #
+    def __init__(self):
+        self.packet = struct.pack('20f', *range(20))
+        self.views = {}
+    def set_configuration(self):
+        pass
+    def read(self, endpoint, size_or_buffer, timeout = None):
+        if(isinstance(size_or_buffer, int)):
+            return array.array('B', self.packet[0:size_or_buffer])
+        if(id(size_or_buffer) not in self.views):
+            self.views[id(size_or_buffer)] = memoryview(size_or_buffer)[0:len(self.packet)]
+        self.views[id(size_or_buffer)][:] = self.packet
+        return len(self.packet)
+    def write(self, endpoint, data):
+        return len(data)
+
+def fakeComm():
+    find = usb.core.find
+    usb.core.find = lambda **kwargs: fakeUsbDevice()
+    comm = espressoComm(0, 0)
+    comm.usb_state_cols = np.r_[0:12, device_time_col]
+    usb.core.find = find
+    return comm
+
+state_vec = np.zeros(13)        # the machine's state_vec, for the new paths
+
+def oldSample(comm):
+    # Original espressoComm.read + espressoMachine.sample, a new state array each time #
+    comm.input_buff = comm.dev.read(0x81, 80)
+    comm.in_floats = list(struct.unpack('20f', comm.input_buff))
+    comm.in_floats[0] = time.time()
+    return np.array(comm.in_floats[0:12])
+
+def newSample(comm):
+    # espressoMachine.sample with usb_block = 1 #
+    comm.read()
+    comm.rows[0].take(comm.usb_state_cols, out = state_vec)
+
+def newBlockSample(comm):
+    # espressoMachine.sample with usb_block = 8 #
+    n = comm.readBlock(8)
+    comm.rows[n-1].take(comm.usb_state_cols, out = state_vec)
+
+def bench(name, fn, rows_per_call = 1):
+    comm = fakeComm()
+    calls = n_samples//rows_per_call
+    t1 = time.perf_counter()
+    for i in range(calls):
+        fn(comm)
+    t2 = time.perf_counter()
+    tracemalloc.start()
+    total = 0
+    for i in range(1000):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(comm)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    print('%-28s %10.0f samples/s   %6.2f us/sample   %6.1f bytes allocated/sample'%(name, calls*rows_per_call/(t2-t1), 1e6*(t2-t1)/(calls*rows_per_call), total/1000.0/rows_per_call))
+
+bench('struct.unpack (original)', oldSample)
+bench('frombuffer, one packet', newSample)
+bench('frombuffer, 8 packet block', newBlockSample, 8)
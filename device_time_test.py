@@ -0,0 +1,47 @@
+### Device time test ###
+# Runs espressoMachine's sample and log path on a fake pyusb device, no
+# hardware needed, and checks the firmware timestamp of each packet reaches
+# the state, the in-memory log, a saved .eslog file and the shot catalog.
+
+import usb.core
+from espressoCatalog import *
+import struct
+import tempfile
+
+class fakeUsbDevice():
+    # Packets with the firmware clock counting from 100 s in 1 ms steps #
+    def __init__(self):
+        self.sent = 0
+    def set_configuration(self):
+        pass
+    def read(self, endpoint, buffer, timeout = None):
+        memoryview(buffer)[0:packet_bytes] = struct.pack('20f', 100 + .001*self.sent, *range(19))
+        self.sent += 1
+        return packet_bytes
+    def write(self, endpoint, data):
+        return len(data)
+
+find = usb.core.find
+usb.core.find = lambda **kwargs: fakeUsbDevice()
+machine = espressoMachine()
+usb.core.find = find
+
+for i in range(100):
+    machine.sample()
+    machine.logState()
+assert abs(machine.state.deviceTime() - 100.099) < 1e-4
+assert machine.state.pressure() == 0 and machine.state.waterHeaterPower() == 10
+device_time = [c['name'] for c in log_columns].index('device_time')
+assert np.allclose(machine.log[:, device_time], 100 + .001*np.arange(100), atol = 1e-4), 'device time not logged'
+
+directory = tempfile.mkdtemp()
+writeLogFile(os.path.join(directory, 'shot' + log_ext), machine.log, log_columns)
+f = logFile(os.path.join(directory, 'shot' + log_ext))
+assert np.array_equal(f['device_time'], machine.log[:, device_time])
+catalog = shotCatalog(directory)
+catalog.update()
+shot = catalog.query()[0]
+print('device duration: %.4f s'%shot['device_duration'])
+assert abs(shot['device_duration'] - .099) < 1e-4
+catalog.close()
+print('ok')
@@ -0,0 +1,190 @@
+### Espresso Shot Catalog ###
+# Indexes the shot logs in logs/ into a small sqlite database of per-shot
+# summaries, so the library can be searched without re-reading every log.
+#   - Each log is parsed once.  update() only re-reads files that are new or
+#     have changed size/mtime since they were indexed, and forgets deleted ones
+#   - Headerless CSVs are matched to a column layout by their column count
+#     (see csv_schemas), .eslog files carry their own schema
+#
+# Usage:
+#   python espressoCatalog.py                                      list all shots
+#   python espressoCatalog.py "peak_pressure > 8 and final_weight > 30"
+
+from espressoMachine import *
+from espressoPredict import stopDelay
+import os
+import sys
+import sqlite3
+
+catalog_name = 'catalog.db'
+
+cmd_names = [c['name'] for c in cmd_columns]
+state_names = [c['name'] for c in state_columns]
+
+# Column layouts of older headerless CSV logs, by column count #
+csv_schemas = {
+    20: ('usb20', state_names[0:12] + ['raw%d'%i for i in range(12, 20)]),   # raw USB packets
+    19: ('cmd6_state13', cmd_names + state_names),                      # current cmd_vec + state_vec
+    18: ('cmd6_state12', cmd_names + state_names[0:12]),                # before the device timestamp
+    16: ('cmd6_state10', cmd_names + state_names[0:10]),                # before heater power estimates
+    10: ('cmd5_state5', cmd_names[0:5] + state_names[0:5]),             # before tare and pump state
+    }
+
+summary_columns = [
+    ('filename',        'text primary key'),
+    ('size',            'integer'),
+    ('mtime',           'real'),
+    ('schema',          'text'),
+    ('rows',            'integer'),
+    ('start_time',      'real'),
+    ('duration',        'real'),
+    ('sample_rate',     'real'),
+    ('peak_pressure',   'real'),
+    ('mean_pressure',   'real'),
+    ('peak_flow',       'real'),
+    ('mean_flow',       'real'),
+    ('final_weight',    'real'),
+    ('max_water_temp',  'real'),
+    ('mean_water_temp', 'real'),
+    ('max_group_temp',  'real'),
+    ('mean_group_temp', 'real'),
+    ('max_heater_temp', 'real'),
+    ('stop_delay',      'real'),        # see espressoPredict
+    ('device_duration', 'real'),        # duration on the firmware clock
+    ]
+
+def readLog(filename):
+    # Read any log file.  Returns (schema name, {column name: array}) #
+    if(filename.endswith(log_ext) or filename.endswith(log_ext + '.part')):
+        f = logFile(filename)
+        return 'eslog%d'%f.header['version'], {n:f[n] for n in f.names}
+    data = np.loadtxt(filename, delimiter=',', ndmin=2)
+    if(data.shape[1] == 1):
+        data = data.T       # a single (1D) log row is saved as one column
+    if(data.shape[1] not in csv_schemas):
+        return 'unknown%d'%data.shape[1], {}
+    schema, names = csv_schemas[data.shape[1]]
+    return schema, {n:data[:, i] for i, n in enumerate(names)}
+
+def summarizeLog(columns):
+    # Per-shot summary values from a {column name: array} log #
+    summary = {n:None for n, t in summary_columns}
+    t = columns.get('time')
+    if((t is None) or (len(t) == 0)):
+        summary['rows'] = 0
+        return summary
+    summary['rows'] = len(t)
+    summary['start_time'] = float(t[0])
+    summary['duration'] = float(t[-1] - t[0])
+    if(summary['duration'] > 0):
+        summary['sample_rate'] = (len(t) - 1)/summary['duration']
+    if('device_time' in columns):
+        summary['device_duration'] = float(columns['device_time'][-1] - columns['device_time'][0])
+    for name, key in (('pressure', 'pressure'), ('flow', 'flow')):
+        if(name in columns):
+            summary['peak_' + key] = float(np.max(columns[name]))
+            summary['mean_' + key] = float(np.mean(columns[name]))
+    if('weight' in columns):
+        summary['final_weight'] = float(columns['weight'][-1])
+    summary['stop_delay'] = stopDelay(columns)
+    for name in ('water_temp', 'group_temp', 'heater_temp'):
+        if(name in columns):
+            summary['max_' + name] = float(np.max(columns[name]))
+            if(('mean_' + name) in summary):
+                summary['mean_' + name] = float(np.mean(columns[name]))
+    return summary
+
+class shotCatalog():
+    def __init__(self, directory = logdir, index_name = catalog_name):
+        self.directory = directory
+        self.db = sqlite3.connect(os.path.join(directory, index_name))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('create table if not exists shots (%s)'%', '.join('%s %s'%c for c in summary_columns))
+        # Catalogs from before a column was added get it, and are re-read to fill it #
+        existing = [r['name'] for r in self.db.execute('pragma table_info(shots)')]
+        added = [(n, t) for n, t in summary_columns if n not in existing]
+        for name, col_type in added:
+            self.db.execute('alter table shots add column %s %s'%(name, col_type))
+        if(added):
+            self.db.execute('update shots set size = null')
+        self.db.commit()
+
+    def logFiles(self):
+        # Finished logs in the directory (in-progress .part files are skipped) #
+        return sorted(f for f in os.listdir(self.directory) if f.endswith('.csv') or f.endswith(log_ext))
+
+    def update(self, since = None):
+        # Index new and changed logs, drop deleted ones.  Returns number of files read #
+        # With since (a time.time()), only logs modified since then are read,
+        # and none are dropped
+        indexed = {r['filename']:(r['size'], r['mtime']) for r in self.db.execute('select filename, size, mtime from shots')}
+        files = self.logFiles()
+        n_read = 0
+        for f in files:
+            st = os.stat(os.path.join(self.directory, f))
+            if(indexed.get(f) == (st.st_size, st.st_mtime)):
+                continue
+            if((since is not None) and (st.st_mtime < since)):
+                continue
+            try:
+                schema, columns = readLog(os.path.join(self.directory, f))
+            except ValueError:
+                schema, columns = 'unreadable', {}
+            summary = summarizeLog(columns)
+            summary.update(filename = f, size = st.st_size, mtime = st.st_mtime, schema = schema)
+            names = [n for n, t in summary_columns]
+            self.db.execute('insert or replace into shots (%s) values (%s)'%(', '.join(names), ', '.join('?'*len(names))),
+                            [summary[n] for n in names])
+            n_read += 1
+        if(since is None):
+            for f in set(indexed) - set(files):
+                self.db.execute('delete from shots where filename = ?', (f,))
+        self.db.commit()
+        return n_read
+
+    def lastModified(self):
+        # Newest mtime of the indexed logs, None if there are none #
+        return self.db.execute('select max(mtime) from shots').fetchone()[0]
+
+    def query(self, where = None, params = (), order_by = 'filename'):
+        # Summary rows (as dicts) matching an SQL where clause #
+        sql = 'select * from shots'
+        if(where):
+            sql += ' where ' + where
+        sql += ' order by ' + order_by
+        return [dict(r) for r in self.db.execute(sql, params)]
+
+    def find(self, **ranges):
+        # Summary rows with each named column in a (min, max) range, None for open ended #
+        #   e.g. find(peak_pressure=(8, None), final_weight=(30, 40))
+        clauses = []
+        params = []
+        for name, (lo, hi) in ranges.items():
+            if(name not in dict(summary_columns)):
+                raise KeyError(name)
+            if(lo is not None):
+                clauses.append('%s >= ?'%name)
+                params.append(lo)
+            if(hi is not None):
+                clauses.append('%s <= ?'%name)
+                params.append(hi)
+        return self.query(' and '.join(clauses), params)
+
+    def close(self):
+        self.db.close()
+
+def main():
+    catalog = shotCatalog()
+    t1 = time.time()
+    n = catalog.update()
+    t2 = time.time()
+    shots = catalog.query(sys.argv[1] if len(sys.argv) > 1 else None)
+    t3 = time.time()
+    print('indexed %d files in %.2fs, query took %.1f ms'%(n, t2-t1, 1e3*(t3-t2)))
+    fields = ('filename', 'schema', 'duration', 'sample_rate', 'peak_pressure', 'mean_pressure', 'peak_flow', 'final_weight', 'max_water_temp', 'max_group_temp')
+    print('  '.join('%16s'%f for f in fields))
+    for s in shots:
+        print('  '.join('%16s'%s[f] if not isinstance(s[f], float) else '%16.2f'%s[f] for f in fields))
+
+if __name__ == '__main__':
+    main()
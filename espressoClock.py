@@ -0,0 +1,123 @@
+### Espresso Machine Clock Correlation ###
+# Maps the firmware's sample timestamps onto the host clock.
+#   - Pairs up each device timestamp with the host's monotonic time when the
+#     packet arrived.  Arrival is always late, by however long the USB
+#     transfer and thread wakeup took, so out of every `decimate` pairs only
+#     the least delayed one is kept
+#   - Keeps the last `window` of those, and every refit_every of them fits
+#     host = host_ref + slope*(device - device_ref) by least squares.
+#     slope - 1 is the device clock's skew (drift)
+#   - jitter is the std of how late packets arrived relative to the fit,
+#     which the mapped timestamps no longer carry
+#   - A device timestamp going backwards (firmware reset) restarts the fit
+# Note the device sends its timestamp as float32, so past ~2.3 h of uptime
+# it is only good to a millisecond, and that shows up as residual jitter.
+
+import numpy as np
+import time
+
+class clockSync():
+    def __init__(self, window = 2000, decimate = 10, refit_every = 10):
+        self.window = window
+        self.decimate = decimate
+        self.refit_every = refit_every
+        self.device = np.zeros(window)
+        self.host = np.zeros(window)
+        self.dx = np.zeros(window)          # scratch for fit(), so it doesn't allocate
+        self.dy = np.zeros(window)
+        self.epoch_offset = time.time() - time.monotonic()     # monotonic -> time.time()
+        self.reset()
+
+    def reset(self):
+        self.pairs = 0          # pairs seen
+        self.n = 0              # pairs kept
+        self.last_device = None
+        self.best_device = 0.0  # least delayed pair of the current group of decimate
+        self.best_host = 0.0
+        self.group = 0
+        self.slope = 1.0
+        self.device_ref = 0.0
+        self.host_ref = 0.0
+        self.fits = 0
+        self.fit_residual = 0.0
+        self.delay_sum = 0.0    # arrival delays relative to the fit, since the last fit
+        self.delay_sumsq = 0.0
+        self.delay_n = 0
+        self.delay = 0.0
+        self.jitter = 0.0
+
+    def update(self, device_t, host_t):
+        # Add a pair (host_t from time.monotonic()), returns device_t in epoch time #
+        if((self.last_device is not None) and (device_t < self.last_device)):
+            self.reset()
+        self.last_device = device_t
+        self.pairs += 1
+        offset = host_t - device_t
+        if((self.group == 0) or (offset < self.best_host - self.best_device)):
+            self.best_device = device_t
+            self.best_host = host_t
+        self.group += 1
+        if((self.pairs == 1) or ((self.fits == 0) and (offset < self.host_ref - self.device_ref))):
+            # No fit yet: least delayed pair so far, no skew #
+            self.device_ref = device_t
+            self.host_ref = host_t
+        delay = host_t - self.toHost(device_t)
+        self.delay_sum += delay
+        self.delay_sumsq += delay*delay
+        self.delay_n += 1
+        if(self.group == self.decimate):
+            i = self.n % self.window
+            self.device[i] = self.best_device
+            self.host[i] = self.best_host
+            self.n += 1
+            self.group = 0
+            if(self.n % self.refit_every == 0):
+                self.fit()
+        return self.toEpoch(device_t)
+
+    def fit(self):
+        m = min(self.n, self.window)
+        x = self.device[0:m]
+        y = self.host[0:m]
+        dx = self.dx[0:m]
+        dy = self.dy[0:m]
+        # Plain floats: update() runs per packet, numpy scalar math is slow #
+        x_mean = float(x.mean())
+        y_mean = float(y.mean())
+        np.subtract(x, x_mean, out = dx)
+        np.subtract(y, y_mean, out = dy)
+        sxx = float(np.dot(dx, dx))
+        if(sxx <= 0):
+            return
+        self.slope = float(np.dot(dx, dy))/sxx
+        self.device_ref = x_mean
+        self.host_ref = y_mean
+        np.multiply(dx, self.slope, out = dx)
+        np.subtract(dy, dx, out = dy)       # residuals, which have zero mean
+        self.fit_residual = (float(np.dot(dy, dy))/m)**.5
+        self.fits += 1
+        if(self.delay_n > 0):
+            self.delay = self.delay_sum/self.delay_n
+            self.jitter = max(self.delay_sumsq/self.delay_n - self.delay**2, 0.0)**.5
+        self.delay_sum = 0.0
+        self.delay_sumsq = 0.0
+        self.delay_n = 0
+
+    def toHost(self, device_t):
+        # Device time -> host monotonic time #
+        return self.host_ref + self.slope*(device_t - self.device_ref)
+
+    def toEpoch(self, device_t):
+        # Device time -> host time.time() #
+        return self.toHost(device_t) + self.epoch_offset
+
+    def stats(self):
+        return {
+            'pairs': self.pairs,
+            'fits': self.fits,
+            'skew_ppm': 1e6*(self.slope - 1.0),
+            'offset': self.host_ref - self.device_ref,      # host - device time at device_ref (s)
+            'fit_residual': self.fit_residual,              # std of the kept pairs about the fit (s)
+            'delay': self.delay,                            # mean arrival delay past the fit (s)
+            'jitter': self.jitter,                          # std of arrival delay (s)
+            }
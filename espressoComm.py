@@ -1,13 +1,37 @@
 ### Espreso Machine USB Communication Interface ###
+# Each IN packet is 20 little endian floats (80 bytes).  Packets are read
+# into a fixed buffer and decoded in place with np.frombuffer, so reading a
+# sample doesn't allocate.
+#
+# Reads are either synchronous (read/readBlock call dev.read directly), or,
+# after startReader(), come from a usbReader thread that keeps reading so
+# a slow or failed transfer never blocks the caller for long.
+#
+# Element 0 of each packet is the firmware's timestamp.  It is kept in the
+# extra last column of each decoded row (device_time_col), and element 0 is
+# replaced by that time mapped onto the host clock by a clockSync, so sample
+# times don't pick up the jitter of when USB transfers complete.
 
 import usb.core
 import usb.util
 import numpy as np
 import struct
 import time
+import array
+import threading
+import collections
+from espressoStats import *
+from espressoClock import *
+
+packet_floats = 20
+packet_bytes = 4*packet_floats
+row_floats = packet_floats + 1  # decoded row: the packet, then the device timestamp
+device_time_col = packet_floats
+drain_timeout = 1           # USB timeout (ms) for reads after the first in readBlock
+reader_timeout = 0.1        # max wait (s) for a packet from the usbReader thread
 
 class espressoComm():
-    def __init__(self, idVend, idProd):
+    def __init__(self, idVend, idProd, max_packets = 16):
         self.dev = usb.core.find(idVendor=idVend, idProduct=idProd)
         if self.dev is None:
             print('Device not found')
@@ -15,24 +39,293 @@ class espressoComm():
             self.dev.set_configuration()
         except:
             pass
-        self.input_buff = []
+        self.input_buff = array.array('B', bytes(packet_bytes))
+        self.input_floats = np.frombuffer(self.input_buff, dtype='<f4')     # view of input_buff
+        self.block = np.zeros((max_packets, row_floats))                    # decoded packets, one per row
+        self.rows = [self.block[i] for i in range(max_packets)]             # preallocated row views
+        self.in_floats = self.rows[0]
         self.output_buff = []
-        self.in_floats = []
         self.out_floats = [0, 0, 0, 0, 0, 0]
+        self.clock = clockSync()                                            # device time -> host time
+        self.reader = None
+        self.read_timer = stage_stats.stage('usb_read')
+        self.decode_timer = stage_stats.stage('usb_decode')
+
+    def startReader(self, n_buffers = 64):
+        # Read packets on a background thread from now on #
+        self.reader = usbReader(self.dev, n_buffers, clock = self.clock)
+        self.reader.start()
+
+    def stopReader(self):
+        # Back to synchronous reads, once the reader thread has finished #
+        if(self.reader is not None):
+            self.reader.stop()
+            self.reader = None
+
+    def _readPacket(self, row, timeout = None):
+        # Read one packet into row of self.block #
+        t = time.perf_counter()
+        n = self.dev.read(0x81, self.input_buff, timeout)
+        t = self.read_timer.stop(t)
+        if(n != packet_bytes):
+            raise IOError('short USB read: %d bytes'%n)
+        decodePacket(self.rows[row], self.input_floats, self.clock, time.monotonic())
+        self.decode_timer.stop(t)
 
     def read(self):
+        # Read one packet into in_floats #
+        # Returns the number of new packets read, 0 or 1
+        if(self.reader is not None):
+            # Newest packet from the reader thread #
+            return self.reader.get(self.rows, 1, reader_timeout, newest = True)
         try:
-            self.input_buff = self.dev.read(0x81, 80)
-            self.in_floats = list(struct.unpack('20f', self.input_buff))
-            self.in_floats[0] = time.time()
+            self._readPacket(0)
+        except:
+            print('USB read failed')
+            time.sleep(.1)
+            return 0
+        return 1
 
+    def readBlock(self, max_packets = None):
+        # Read one packet, then drain any packets already queued, up to max_packets #
+        # Returns the number of rows of self.block filled, oldest first
+        if(max_packets is None):
+            max_packets = self.block.shape[0]
+        if(self.reader is not None):
+            return self.reader.get(self.rows, max_packets, reader_timeout)
+        try:
+            self._readPacket(0)
         except:
             print('USB read failed')
             time.sleep(.1)
+            return 0
+        n = 1
+        while(n < max_packets):
+            try:
+                self._readPacket(n, drain_timeout)
+            except:
+                break
+            n += 1
+        return n
 
     def write(self, ):
         self.output_buff = struct.pack('%sf' % len(self.out_floats), *self.out_floats)
         try:
             self.dev.write(1, self.output_buff)
+            return True
         except:
-            print('USB write failed')
\ No newline at end of file
+            print('USB write failed')
+            return False
+
+def decodePacket(row, floats, clock, host_t):
+    # Copy a packet into row, keeping the device time and mapping it to host time #
+    row[0:packet_floats] = floats
+    device_t = float(floats[0])
+    row[device_time_col] = device_t
+    row[0] = clock.update(device_t, host_t)
+
+class usbReader():
+    # Reads IN packets on a background thread #
+    #   - Each packet is decoded into one of n_buffers preallocated rows, and
+    #     its packet number passed to the consumer through a deque (appends
+    #     and pops are atomic, so neither side takes a lock)
+    #   - A consumer more than n_buffers packets behind loses the oldest ones,
+    #     which are counted as dropped
+    #   - A packet arriving more than late_factor times the typical interval
+    #     after the one before is counted as late.  The typical interval starts
+    #     as the median of the first seed_intervals, then follows the intervals
+    #     within late_factor of it either way, so neither a stall nor the
+    #     back to back packets catching up after it move it.  When the reader
+    #     itself is held up, the packets queued meanwhile come back to back and
+    #     catch up with the typical interval's schedule, so a long interval only
+    #     counts once the next in-band one shows the packets are still behind
+    #   - Read errors back off on the reader thread, never in the consumer
+    #   - Packet times come from clock, fed with arrival times taken right
+    #     after each transfer completes
+    def __init__(self, dev, n_buffers = 64, late_factor = 2.0, timeout = 100, clock = None, seed_intervals = 32):
+        self.dev = dev
+        self.n_buffers = n_buffers
+        self.late_factor = late_factor
+        self.seed_intervals = seed_intervals
+        self.timeout = timeout                  # USB read timeout (ms)
+        self.clock = clock if clock is not None else clockSync()
+        self.buffers = np.zeros((n_buffers, row_floats))
+        self.rows = [self.buffers[i] for i in range(n_buffers)]
+        self.input_buff = array.array('B', bytes(packet_bytes))
+        self.input_floats = np.frombuffer(self.input_buff, dtype='<f4')
+        self.ready = collections.deque(maxlen = n_buffers)     # packet numbers waiting for the consumer
+        self.arrived = threading.Event()
+        self.count = 0                          # packets received
+        self.writing = -1                       # packet number last written to its buffer
+        self.next = 0                           # packet number the consumer expects next
+        self.dropped = 0
+        self.skipped = 0                        # older packets passed over by get(newest = True)
+        self.late = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.interval = latencyHistogram()      # time between packets
+        self.typical_interval = None
+        self.first_intervals = []               # until typical_interval is seeded
+        self.t_behind = None                    # time before a long interval, until it's judged
+        self.n_behind = 0                       # packets since t_behind
+        self.t_last = None
+        self.read_timer = stage_stats.stage('usb_read')
+        self.decode_timer = stage_stats.stage('usb_decode')
+        self.running = False
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self, timeout = 1.0):
+        # Ends the thread after the read it's on, which times out after self.timeout ms #
+        self.running = False
+        if(self.thread.is_alive() and (self.thread is not threading.current_thread())):
+            self.thread.join(timeout)
+
+    def run(self):
+        while(self.running):
+            t = time.perf_counter()
+            try:
+                n = self.dev.read(0x81, self.input_buff, self.timeout)
+            except usb.core.USBTimeoutError:
+                self.timeouts += 1
+                continue
+            except:
+                self.errors += 1
+                time.sleep(.1)
+                continue
+            if(n != packet_bytes):
+                self.errors += 1
+                continue
+            now = time.monotonic()
+            t = self.read_timer.stop(t)
+            self.writing = self.count
+            row = self.rows[self.count % self.n_buffers]
+            decodePacket(row, self.input_floats, self.clock, now)
+            self.decode_timer.stop(t)
+            self.ready.append(self.count)
+            self.count += 1
+            self.arrived.set()
+            self._timing(now)
+
+    def _timing(self, now):
+        if(self.t_last is not None):
+            dt = now - self.t_last
+            self.interval.record(dt)
+            if(self.typical_interval is None):
+                self.first_intervals.append(dt)
+                if(len(self.first_intervals) == self.seed_intervals):
+                    self.typical_interval = float(np.median(self.first_intervals))
+            else:
+                typical = self.typical_interval
+                long = dt > self.late_factor*typical
+                in_band = (not long) and (dt*self.late_factor > typical)
+                if(self.t_behind is not None):
+                    self.n_behind += 1
+                    if(in_band):
+                        if(now - self.t_behind - self.n_behind*typical > (self.late_factor - 1)*typical):
+                            self.late += 1
+                        self.t_behind = None
+                elif(long):
+                    self.t_behind = self.t_last
+                    self.n_behind = 1
+                if(in_band):
+                    # Only in-band intervals update it, not the burst after a stall #
+                    self.typical_interval += .01*(dt - typical)
+        self.t_last = now
+
+    def get(self, rows, max_rows, timeout, newest = False):
+        # Copy up to max_rows queued packets into rows (a list of row arrays), oldest first #
+        # Waits up to timeout (s) if none are queued.  With newest, only the newest
+        # max_rows are kept.  Returns the number of rows filled
+        if(not self.ready):
+            self.arrived.clear()
+            if(not self.ready):
+                self.arrived.wait(timeout)
+        if(newest):
+            while(len(self.ready) > max_rows):
+                self._next()
+                self.skipped += 1
+        n = 0
+        while(self.ready and (n < max_rows)):
+            i = self._next()
+            np.copyto(rows[n], self.rows[i % self.n_buffers])
+            if(self.writing - i >= self.n_buffers):
+                self.dropped += 1   # overwritten while being copied
+                continue
+            n += 1
+        return n
+
+    def _next(self):
+        # Pop the next packet number, counting any lost from the full deque #
+        i = self.ready.popleft()
+        self.dropped += i - self.next
+        self.next = i + 1
+        return i
+
+    def stats(self):
+        interval = self.interval.summary()
+        clock = self.clock.stats()
+        return {
+            'packets': self.count,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+            'late': self.late,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'interval_p50': interval['p50'],
+            'interval_p99': interval['p99'],
+            'interval_max': interval['max'],
+            'clock_skew_ppm': clock['skew_ppm'],
+            'clock_jitter': clock['jitter'],
+            }
+
+class commandChannel():
+    # Writes the command vector only when it changes #
+    #   - Unchanged commands are still resent every keepalive seconds, so the
+    #     firmware watchdog keeps seeing traffic
+    #   - Tare (element 5) is one-shot: a vector with tare set is always sent,
+    #     and the tare is not part of what later vectors are compared against
+    #   - A failed write is retried on the next call
+    def __init__(self, comm, keepalive = 0.1):
+        self.comm = comm
+        self.keepalive = keepalive
+        self.last_sent = None
+        self.t_sent = 0.0
+        self.writes = 0
+        self.writes_saved = 0
+        self.write_latency = latencyHistogram()
+        self.write_timer = stage_stats.stage('usb_write')
+
+    def send(self, cmd_vec):
+        # Send cmd_vec if needed.  Returns True if it was written #
+        now = time.perf_counter()
+        if((self.last_sent is not None) and (cmd_vec[5] == 0) and (now - self.t_sent < self.keepalive)
+           and np.array_equal(cmd_vec, self.last_sent)):
+            self.writes_saved += 1
+            return False
+        self.comm.out_floats = cmd_vec
+        ok = self.comm.write()
+        self.write_latency.record(self.write_timer.stop(now) - now)
+        if(ok):
+            if(self.last_sent is None):
+                self.last_sent = np.zeros(len(cmd_vec))
+            np.copyto(self.last_sent, cmd_vec)
+            self.last_sent[5] = 0
+            self.t_sent = now
+            self.writes += 1
+        return ok
+
+    def stats(self):
+        latency = self.write_latency.summary()
+        return {
+            'writes': self.writes,
+            'writes_saved': self.writes_saved,
+            'write_latency_p50': latency['p50'],
+            'write_latency_p99': latency['p99'],
+            'write_latency_max': latency['max'],
+            }
+
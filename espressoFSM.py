@@ -3,53 +3,137 @@
 
 import threading
 from espressoMachine import *
-from espressoModes import *
+from espressoRegistry import *
 
 
-mode_list = (idleMode, preheatMode, manualMode, preheatPlot, nineBarShot)
-custom_modes = (idleMode, preheatMode, flushMode, manualMode, preheatPlot, nineBarShot)
-
 class espressoFSM():
-    def __init__(self, machine, user_input=False):
-        self.mode_list = {
-                    idleMode().title:idleMode, 
-                    manualMode().title:manualMode, 
-                    preheatMode().title:preheatMode,
-                    flushMode().title:flushMode,
-                    nineBarShot().title:nineBarShot,
-                    preheatPlot().title:preheatPlot
-                    }
-        self.active_mode = idleMode()
-        self.mode_running = False
+    # Runs the active mode on its own thread #
+    #   - While a mode is running, its run() is called once per new sample from
+    #     the machine's IO thread, then the commands are published
+    #   - While stopped, the mode's stop() is called once, and the thread
+    #     sleeps until a mode is started or switched to
+    #   - latency records the time from the oldest sample not yet acted on
+    #     being published to the commands computed from it being published
+    #   - poll = seconds runs the original fixed period polling loop instead,
+    #     for comparison
+    def __init__(self, machine, user_input=False, poll = None, modes = None):
+        self.mode_list = modes if modes is not None else modeRegistry()    # title -> mode class
+        self.active_mode = self.mode_list['Idle']()     # imports espressoModes, the rest wait until chosen
+        self.cond = threading.Condition()   # guards active_mode and mode_running
+        self._mode_running = False
+        self.stopped = False                # the mode's stop() has been called since the last change
+        self.exiting = False                # stop() asked the thread to finish
         self.machine = machine
         self.ui = user_input
+        self.poll = poll
+        self.sample_seen = 0
+        self.runs = 0
+        self.stops = 0
+        self.latency = latencyHistogram()
+        self.run_timer = stage_stats.stage('mode_run')
 
         self.run_thread = threading.Thread(target=self.run)
         self.run_thread.daemon = True
 
+    @property
+    def mode_running(self):
+        return self._mode_running
+
+    @mode_running.setter
+    def mode_running(self, running):
+        with self.cond:
+            self._mode_running = running
+            self.stopped = False
+            self.cond.notify_all()
 
     def run(self):
-        while(True):
+        if(self.poll is not None):
+            self.runPolling()
+            return
+        while(not self.exiting):
+            with self.cond:
+                while((not self._mode_running) and self.stopped and (not self.exiting)):
+                    self.cond.wait()
+                if(self.exiting):
+                    break
+                if(not self._mode_running):
+                    self.step()
+                    continue
+            # Running: wait for a sample (with a timeout, in case IO isn't running) #
+            count = self.machine.waitSample(self.sample_seen, .1)
+            if(count == self.sample_seen):
+                continue
+            if(self.step()):
+                self.recordLatency(count)
+            self.sample_seen = count
+
+    def step(self):
+        # Run the active mode once, or stop it once if it isn't running #
+        # Returns True if the mode ran.  Also drives the FSM without its thread,
+        # e.g. from a simulation loop
+        with self.cond:
+            if(self._mode_running):
+                t = time.perf_counter()
+                self.active_mode.run(self.machine, self.ui)
+                self.run_timer.stop(t)
+                self.machine.publishCommands()
+                self.runs += 1
+                return True
+            if(not self.stopped):
+                self.active_mode.stop(self.machine)
+                self.machine.publishCommands()
+                self.stopped = True
+                self.stops += 1
+            return False
+
+    def runPolling(self):
+        while(not self.exiting):
+            count = self.machine.sample_count
             if(self.mode_running):
                 self.active_mode.run(self.machine, self.ui)
+                self.runs += 1
             else:
                 self.active_mode.stop(self.machine)
-            time.sleep(.01)
+                self.stops += 1
+            self.machine.publishCommands()
+            if(self.mode_running and (count != self.sample_seen)):
+                self.recordLatency(count)
+            self.sample_seen = count
+            time.sleep(self.poll)
 
-            #time.sleep(.1)
+    def recordLatency(self, count):
+        # Time since the first sample after the last one acted on #
+        if(count - self.sample_seen < len(self.machine.sample_times)):
+            self.latency.record(time.perf_counter() - self.machine.sampleTime(self.sample_seen + 1))
 
     def start(self):
         self.run_thread.start()
-    def stop(self):
-        self.run_thread.stop()
+    def stop(self, timeout = 1.0):
+        # End the thread, after the step it's on #
+        with self.cond:
+            self.exiting = True
+            self.cond.notify_all()
+        if(self.run_thread.is_alive()):
+            self.run_thread.join(timeout)
             
     def start_mode(self):
         self.active_mode.start()
     
     def transition(self, machine, nextMode):
         print(nextMode)
-        if((nextMode in self.mode_list.values()) and (nextMode().title != self.active_mode.title)):
-            if(self.active_mode.exit(machine)):
-                self.active_mode = nextMode()
-                print('Transitioning to: ', self.active_mode.title)
-                self.mode_running = False
\ No newline at end of file
+        with self.cond:
+            if((nextMode.title in self.mode_list) and (nextMode.title != self.active_mode.title)):
+                if(self.active_mode.exit(machine)):
+                    self.active_mode = nextMode()
+                    print('Transitioning to: ', self.active_mode.title)
+                    self.mode_running = False
+
+    def stats(self):
+        latency = self.latency.summary()
+        return {
+            'runs': self.runs,
+            'stops': self.stops,
+            'latency_p50': latency['p50'],
+            'latency_p99': latency['p99'],
+            'latency_max': latency['max'],
+            }
@@ -5,7 +5,6 @@ from PyQt5 import QtGui, QtCore
 from PyQt5.QtCore import QThread, pyqtSignal
 import pyqtgraph as pg
 import numpy as np
-import scipy.signal as signal
 import sys
 import time
 import struct
@@ -13,19 +12,43 @@ import time
 import threading
 
 from espressoMachine import *
-from espressoModes import *
 from espressoFSM import *
+from espressoPlot import *
 from theme import *
 
 logdir = 'logs/'
 
+# Log columns plotted: (column, median filtered) #
+plot_series = {
+    'time':             (6, False),
+    'pump_cmd':         (0, False),
+    'water_temp_cmd':   (1, False),
+    'group_temp_cmd':   (2, False),
+    'pump_cmd_type':    (3, True),
+    'pressure':         (7, True),
+    'flow':             (8, True),
+    'water_temp':       (9, True),
+    'heater_temp':      (10, True),
+    'group_temp':       (11, True),
+    }
+plot_sampled = ('pump_cmd_type',)     # zoomed out, taken from each bucket's first row
+plot_ranges = {
+    'pressure_flow':    (7, 9),         # plot 1's y range
+    'temps':            (9, 12),        # plot 3's
+    }
+
+# Refresh periods (ms).  Plots are only redrawn when there are new log rows #
+# or the view changed, labels only when their text changed
+plot_period = 20
+label_period = 100
+
 
 class MainWindow(Ui_EspressoGUI):
-    def __init__(self):
+    def __init__(self, machine = None):
         self.mw = QtWidgets.QMainWindow()
         self.setupUi(self.mw)
 
-        self.machine = espressoMachine()
+        self.machine = machine if machine is not None else espressoMachine()
         #self.machine = fakeEspressoMachine()
         self.machine.startIO()
         self.fsm = espressoFSM(self.machine)
@@ -90,12 +113,51 @@ class MainWindow(Ui_EspressoGUI):
         self.plot3.addItem(self.c8)
         self.plot3.addItem(self.c9)
 
-
-
-        # Main UI Timer #
+        # Plot series, updated from the new log rows and shaped for drawing by #
+        # plot_worker off the GUI thread.  drawFrame only calls setData
+        self.plot_data = plotPipeline(plot_series, plot_ranges, sampled = plot_sampled)
+        self.curves = [self.c1, self.c2, self.c3, self.c4, self.c5, self.c6, self.c7, self.c8, self.c9]
+        # Zoomed out, each curve is drawn as its bucket mins, plus its maxes in #
+        # max_curves, both with the thin envelope_lw pen
+        self.max_curves = []
+        self.pens = []
+        for curve in self.curves:
+            pen = curve.opts['pen']
+            thin = QtGui.QPen(pen)
+            thin.setWidth(envelope_lw)
+            self.pens.append((pen, thin))
+            max_curve = pg.PlotCurveItem(pen = thin)
+            (self.plot1 if curve in self.curves[0:4] else self.plot3).addItem(max_curve)
+            self.max_curves.append(max_curve)
+        self.envelope = False
+        self.plot_worker = plotWorker(self.machine, self.plot_data)
+        self.plot_worker.frame_ready.connect(self.drawFrame, QtCore.Qt.QueuedConnection)
+        self.plot_worker.start()
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.close)
+        # Plots follow the whole log until zoomed or panned, double click to go back #
+        self.plot3.setXLink(self.plot1)
+        self.plot_follow = True
+        for plot in (self.plot1, self.plot3):
+            plot.getViewBox().sigRangeChangedManually.connect(self.stopFollowing)
+            plot.scene().sigMouseClicked.connect(self.plotClicked)
+
+
+        # Frames per second and frame time overlay, top left of the plots #
+        self.fpsLabel = QtWidgets.QLabel(self.plot1)
+        self.fpsLabel.setStyleSheet('color: rgb%s; background: transparent'%(white3,))
+        self.fpsLabel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.fpsLabel.move(8, 4)
+        self.fpsLabel.setMinimumWidth(300)
+        self.label_text = {}        # text each label was last set to
+        self.plot_requested = None  # log rows and view of the last frame asked for
+
+        # Main UI Timers: plots and labels #
         self.runTimer = QtCore.QTimer()
         self.runTimer.timeout.connect(self.run)
-        self.runTimer.start(20)
+        self.runTimer.start(plot_period)
+        self.labelTimer = QtCore.QTimer()
+        self.labelTimer.timeout.connect(self.updateLabels)
+        self.labelTimer.start(label_period)
 
         # Connect buttons #
         self.startButton.clicked.connect(self.startPressed)
@@ -106,21 +168,29 @@ class MainWindow(Ui_EspressoGUI):
         self.updateButtons()
 
         # Add modes to list #
-        for mode in custom_modes:
-            self.modeList.addItem(mode().title)
-
-        self.t_last = time.time()
+        for title in self.fsm.mode_list.titles():
+            self.modeList.addItem(title)
+
+        # Stage timing diagnostics, toggled with Ctrl+D #
+        self.diagnostics = diagnosticsPanel(stage_stats)
+        self.diagnosticsShortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Ctrl+D'), self.mw)
+        self.diagnosticsShortcut.activated.connect(self.diagnostics.toggle)
+        self.update_timer = stage_stats.stage('gui_update')
+        self.frame_timer = stage_stats.stage('gui_frame')
+
+        self.t_last = time.perf_counter()
+        self.t_frame = time.perf_counter()
+        self.frames_drawn = 0
+        self.frames_counted = 0     # frames_drawn at the last overlay update
+        self.draw_time = 0.0        # last drawFrame (s)
 
         
 
     def run(self):
         #self.fsm.run(self.machine, False)
+        self.t_frame = self.frame_timer.stop(self.t_frame)     # time between frames, including repaints
         self.updateGraphics()
-
-        t_now = time.time()
-        dt = t_now - self.t_last
-        self.t_last = t_now
-        print('FPS: ', 1.0/dt)
+        self.update_timer.stop(self.t_frame)
 
     def startPressed(self):
         if(self.fsm.mode_running):
@@ -141,7 +211,7 @@ class MainWindow(Ui_EspressoGUI):
 
     def tarePressed(self):
         self.textLog.appendPlainText('taring')
-        self.machine.cmd.tare(1)
+        self.machine.tare()
 
     def modeListPressed(self, item):
         self.textLog.appendPlainText(item.text())
@@ -177,75 +247,237 @@ class MainWindow(Ui_EspressoGUI):
         elif(self.fsm.active_mode.title == 'Flush'):
             self.flushButton.setStyleSheet(on_button_style)
         '''
-    def updateGraphics(self):
+    def close(self):
+        # Stop every thread the window started: plot worker, FSM, machine IO #
+        self.runTimer.stop()
+        self.labelTimer.stop()
+        self.plot_worker.stop()
+        self.fsm.stop()
+        self.machine.stopIO()
+
+    def stopFollowing(self, *args):
+        self.plot_follow = False
+
+    def plotClicked(self, event):
+        if(event.double()):
+            self.plot_follow = True
+
+    def setLabels(self, texts):
+        # [(label, text)]: setText only where the text changed #
+        for label, text in texts:
+            if(self.label_text.get(label) != text):
+                label.setText(text)
+                self.label_text[label] = text
+
+    def updateLabels(self):
         ### text ###
-        t1 = time.time()
-        self.pLabel.setText('Pressure:\n%02.2f'%self.machine.state.pressure())
-        self.fLabel.setText('Flow:\n%02.2f'%self.machine.state.flow())
-        self.wtLabel.setText('Water Temp:\n%02.2f'%self.machine.state.waterTemp())
-        self.gtLabel.setText('Group Temp:\n%02.2f'%self.machine.state.groupTemp())
-        self.htLabel.setText('Heater Temp:\n%02.2f'%self.machine.state.heaterTemp())
-        self.psLabel.setText('Pump Speed:\n%03.1f'%(self.machine.state.pumpVel()*60/(2*np.pi)))
-        self.ptLabel.setText('Pump Torque:\n%02.5f'%self.machine.state.pumpTorque())
-        self.wLabel.setText('Weight:\n%02.2f'%self.machine.state.weight())
-        self.whpLabel.setText('WH Power:\n%03.1f'%self.machine.state.waterHeaterPower())
-        self.ghpLabel.setText('GH Power:\n%03.1f'%self.machine.state.groupHeaterPower())
-
-        t3 = time.time()
+        cmd, state = self.machine.snapshot()
+        t_now = time.perf_counter()
+        fps = (self.frames_drawn - self.frames_counted)/(t_now - self.t_last)
+        self.frames_counted = self.frames_drawn
+        self.t_last = t_now
+        self.setLabels([
+            (self.pLabel, 'Pressure:\n%02.2f'%state.pressure()),
+            (self.fLabel, 'Flow:\n%02.2f'%state.flow()),
+            (self.wtLabel, 'Water Temp:\n%02.2f'%state.waterTemp()),
+            (self.gtLabel, 'Group Temp:\n%02.2f'%state.groupTemp()),
+            (self.htLabel, 'Heater Temp:\n%02.2f'%state.heaterTemp()),
+            (self.psLabel, 'Pump Speed:\n%03.1f'%(state.pumpVel()*60/(2*np.pi))),
+            (self.ptLabel, 'Pump Torque:\n%02.5f'%state.pumpTorque()),
+            (self.wLabel, 'Weight:\n%02.2f'%state.weight()),
+            (self.whpLabel, 'WH Power:\n%03.1f'%state.waterHeaterPower()),
+            (self.ghpLabel, 'GH Power:\n%03.1f'%state.groupHeaterPower()),
+            (self.fpsLabel, '%4.1f fps  draw %5.2f ms  prep %5.2f ms'%(fps, 1e3*self.draw_time, 1e3*self.plot_worker.prep_time)
+                + ('  log rows dropped: %d'%self.machine.log_writer.dropped if self.machine.log_writer.dropped else '')),
+            ])
 
-        
-        
-        max_points = 500
-
-        if(len(self.machine.log.shape)>1):
-
-            #self.plot1.disableAutoRange()
-            #self.plot3.disableAutoRange()
-            
-            ### Format plot data ###
-            data = self.machine.log # copy data to avoid it changing size while manipulating
-            data_length = data.shape[0]
-            inds = np.arange(0, data_length, 1)
-            if(data_length > max_points):
-                inds = np.linspace(0, data_length-1, max_points, dtype=int)
-            plot_time = data[inds,6] - data[0,6]
-            p0 = signal.medfilt(data[inds, 3], 3)
-            p1 = data[inds, 0]
-            p3 = signal.medfilt(data[inds, 7])
-            p4 = signal.medfilt(data[inds, 8])
-            p5 = data[inds, 1]
-            p6 = data[inds, 2]
-            p7 = signal.medfilt(data[inds, 9])
-            p8 = signal.medfilt(data[inds, 10])
-            p9 = signal.medfilt(data[inds, 11])
-
-            xmax = np.max(plot_time)
-            ymax1 = np.max((data[:,7:9]).flatten())+ 1
-            ymax2 = np.max((data[:,9:12]).flatten())+ 1
-            ymin2 = np.min((data[:,9:12]).flatten())- 1
-
-            ### Plot 1 ###
-            ds = 1
-            ind_p = np.nonzero(p0 == 1)      # log points where command type is pressure
-            ind_f = np.nonzero(p0 == 2)      # log points where command type is flow
-            self.c1.setData(plot_time[ind_p], p1[ind_p])
-            self.c2.setData(plot_time[ind_f], p1[ind_f])
-            self.c3.setData(plot_time, p3)
-            self.c4.setData(plot_time, p4)
-            self.c5.setData(plot_time, p5)
-            self.c6.setData(plot_time, p6)
-            self.c7.setData(plot_time, p7)
-            self.c8.setData(plot_time, p8)
-            self.c9.setData(plot_time, p9)
-            
-            self.plot1.setYRange(0, ymax1)
-            self.plot1.setXRange(0, xmax)
-            self.plot3.setYRange(ymin2, ymax2)
-            self.plot3.setXRange(0, xmax)
-
-            t2 = time.time()
-            #print('log length: ', len(self.machine.log[:,1]), '  text time: ', t3-t1, ' plot time: ', t2-t1)
+    def updateGraphics(self):
+        # Ask for the visible range, drawn when the worker has it ready #
+        if(self.plot_follow):
+            x0, x1 = None, None
+        else:
+            x0, x1 = self.plot1.getViewBox().viewRange()[0]
+        # Points drawn go with the plot width, up to max_points (drawing the thick #
+        # pens costs more than the data prep)
+        max_points = self.plot_data.max_points
+        pixels = min(int(self.plot1.getViewBox().width()) or max_points, max_points)
+        # Only when there are new log rows or the view changed #
+        rows, first, clears = self.machine.log_buffer.indexedView()
+        requested = (clears, first + len(rows), x0, x1, pixels)
+        if(requested == self.plot_requested):
+            return
+        self.plot_requested = requested
+        self.plot_worker.request((x0, x1, pixels))
+
+    def drawFrame(self):
+        # Draw the worker's newest frame.  Older ones were replaced before they got here #
+        t_start = time.perf_counter()
+        frame = self.plot_worker.take()
+        if(frame is None):
+            return
+        if(frame['cleared']):
+            self.plot_follow = True
+        envelope = frame['envelope'] is not None
+        if(envelope != self.envelope):
+            for curve, max_curve, pens in zip(self.curves, self.max_curves, self.pens):
+                curve.setPen(pens[envelope])
+                if(not envelope):
+                    max_curve.setData([], [])
+            self.envelope = envelope
+        for curve, (x, y) in zip(self.curves, frame['curves']):
+            curve.setData(x, y)
+        if(envelope):
+            for curve, (x, y) in zip(self.max_curves, frame['envelope']):
+                curve.setData(x, y)
+        if(self.plot_follow):
+            self.plot1.setYRange(*frame['y_range1'])
+            self.plot1.setXRange(*frame['x_range'])
+            self.plot3.setYRange(*frame['y_range3'])
+        self.frames_drawn += 1
+        self.draw_time = time.perf_counter() - t_start
+
+
+
+class plotWorker(QThread):
+    # Prepares ready to draw plot frames from the machine log #
+    # request() hands over the latest view (x0, x1, pixels) and wakes the
+    # worker, which updates the pipeline with the new log rows and shapes a
+    # frame: a list of (x, y) per curve, c1 to c9, and the axis ranges.  There
+    # is one slot for the newest frame; take() empties it, and a frame the GUI
+    # hasn't taken yet is replaced by the next, so stale frames are dropped
+    # (keeping their cleared flag)
+    frame_ready = pyqtSignal()
+
+    def __init__(self, machine, pipeline):
+        QThread.__init__(self)
+        self.machine = machine
+        self.pipeline = pipeline
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.view = None            # latest requested view
+        self.view_drawn = None      # view of the last frame prepared
+        self.frame = None
+        self.frames = 0             # frames prepared
+        self.prep_time = 0.0        # last frame's prep (s)
+        self.dropped = 0            # frames replaced before they were taken
+        self.running = True
+        self.prep_timer = stage_stats.stage('plot_prep')
+
+    def request(self, view):
+        with self.lock:
+            self.view = view
+        self.wake.set()
+
+    def take(self):
+        with self.lock:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        self.wait()
+
+    def run(self):
+        while(self.running):
+            if(not self.wake.wait(.1)):
+                continue
+            self.wake.clear()
+            with self.lock:
+                view = self.view
+            t_start = time.perf_counter()
+            frame = self.prepare(view)
+            if(frame is None):
+                continue
+            self.prep_time = self.prep_timer.stop(t_start) - t_start
+            with self.lock:
+                if(self.frame is not None):
+                    # A clear in the dropped frame still has to reach the GUI #
+                    frame['cleared'] = frame['cleared'] or self.frame['cleared']
+                    self.dropped += 1
+                self.frame = frame
+                self.frames += 1
+            self.frame_ready.emit()
+
+    def prepare(self, view):
+        # Frame for view, None if nothing changed since the last one #
+        p = self.pipeline
+        log = self.machine.log_buffer
+        clears = p.clears
+        changed = p.update(log)
+        if(((not changed) and (view == self.view_drawn)) or (p.origin is None)):
+            return None
+        self.view_drawn = view
+        x0, x1, pixels = view
+        data = p.view(log, x0, x1, pixels)
+
+        ### Format plot data ###
+        plot_time = data['time']
+        p0 = data['pump_cmd_type']
+        ind_p = np.nonzero(p0 == 1)      # log points where command type is pressure
+        ind_f = np.nonzero(p0 == 2)      # log points where command type is flow
+        names = ('pressure', 'flow', 'water_temp_cmd', 'group_temp_cmd', 'water_temp', 'heater_temp', 'group_temp')
+        def split(series):
+            # One set of curve points from series ({name: points}) #
+            p1 = series['pump_cmd']
+            curves = [(plot_time[ind_p], p1[ind_p]), (plot_time[ind_f], p1[ind_f])]
+            for name in names:
+                curves.append((plot_time, series[name]))
+            return curves
+        curves = split(data)
+        envelope = split(data['envelope']) if data['envelope'] is not None else None
+
+        ymax1 = p.range('pressure_flow')[1] + 1
+        ymin2, ymax2 = p.range('temps')
+        return {
+            'cleared':  p.clears != clears,
+            'curves':   curves,
+            'envelope': envelope,
+            'x_range':  (0, p.t_last - p.t0),
+            'y_range1': (0, ymax1),
+            'y_range3': (ymin2 - 1, ymax2 + 1),
+            }
+
+class diagnosticsPanel(QtWidgets.QWidget):
+    # Window showing the stage timing histograms (see espressoStats) #
+    def __init__(self, stats, refresh = 500):
+        QtWidgets.QWidget.__init__(self)
+        self.stats = stats
+        self.setWindowTitle('Diagnostics')
+        self.text = QtWidgets.QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.resetButton = QtWidgets.QPushButton('Reset')
+        self.dumpButton = QtWidgets.QPushButton('Dump')
+        self.resetButton.clicked.connect(self.stats.reset)
+        self.dumpButton.clicked.connect(self.dump)
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.resetButton)
+        buttons.addWidget(self.dumpButton)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+        self.resize(520, 360)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.refresh_ms = refresh
+
+    def toggle(self):
+        if(self.isVisible()):
+            self.timer.stop()
+            self.hide()
+        else:
+            self.refresh()
+            self.show()
+            self.timer.start(self.refresh_ms)
+
+    def refresh(self):
+        self.text.setPlainText(self.stats.report())
 
+    def dump(self):
+        filename = logdir + 'stages-' + time.strftime("%Y%m%d-%H%M%S") + '.json'
+        self.stats.dump(filename)
+        self.text.appendPlainText('\nsaved ' + filename)
 
 class userInput():
     def __init__(self):
@@ -0,0 +1,110 @@
+### Espresso Machine Log Buffer ###
+# Preallocated row storage for the machine log.
+#   - Rows are written into a preallocated 2D array, which grows geometrically
+#     in chunks, so appends are amortized O(1)
+#   - Optionally bounded to max_rows: once full, the oldest rows are dropped
+#     and the buffer is compacted in one block copy every max_rows appends
+#   - view() returns a zero-copy view of the filled rows
+#   - Rows are never modified once written: growing and compacting copy into
+#     a new buffer.  So a view stays valid and torn-free while another thread
+#     keeps appending, it just doesn't see the newer rows.  generation is odd
+#     while the buffer is being swapped, and counts up on every swap and clear
+#   - indexedView() also gives the index of the view's first row counted from
+#     the last clear, and how many clears there have been, so a reader can
+#     pick up just the rows appended since it last looked
+
+import numpy as np
+
+class espressoLog():
+    def __init__(self, width, chunk_rows = 4096, max_rows = None, dtype = np.float64):
+        self.width = width
+        self.chunk_rows = chunk_rows
+        self.max_rows = max_rows
+        self.dtype = dtype
+        self.generation = 0
+        self.clears = 0
+        self.clear()
+
+    def clear(self):
+        # Drop all rows and release storage back to one chunk #
+        rows = self.chunk_rows
+        if(self.max_rows is not None):
+            rows = min(rows, self.max_rows)
+        self.generation += 1
+        self.buffer = np.zeros((rows, self.width), dtype = self.dtype)
+        self.start = 0      # first valid row in buffer
+        self.end = 0        # one past the last valid row in buffer
+        self.base = 0       # rows appended since the clear before buffer row 0
+        self.clears += 1
+        self.generation += 1
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, row):
+        # Append one row #
+        if(self.end == self.buffer.shape[0]):
+            self._makeRoom()
+        self.buffer[self.end] = row
+        self.end += 1
+        if((self.max_rows is not None) and (self.end - self.start > self.max_rows)):
+            self.start += 1
+
+    def appendJoined(self, parts):
+        # Append one row made of parts (1D arrays) end to end, written in place #
+        if(self.end == self.buffer.shape[0]):
+            self._makeRoom()
+        np.concatenate(parts, out = self.buffer[self.end])
+        self.end += 1
+        if((self.max_rows is not None) and (self.end - self.start > self.max_rows)):
+            self.start += 1
+
+    def appendRows(self, rows):
+        # Append a 2D block of rows #
+        rows = np.asarray(rows).reshape(-1, self.width)
+        if(self.max_rows is not None and rows.shape[0] > self.max_rows):
+            rows = rows[-self.max_rows:]
+        n = rows.shape[0]
+        while(self.end + n > self.buffer.shape[0]):
+            self._makeRoom()
+        self.buffer[self.end:self.end+n] = rows
+        self.end += n
+        if((self.max_rows is not None) and (self.end - self.start > self.max_rows)):
+            self.start = self.end - self.max_rows
+
+    def view(self):
+        # Zero-copy view of the filled part of the log #
+        while(True):
+            generation = self.generation
+            buffer, start, end = self.buffer, self.start, self.end
+            if((generation & 1) == 0 and generation == self.generation):
+                return buffer[start:end]
+
+    def indexedView(self):
+        # (view(), index of its first row since the last clear, clears) #
+        while(True):
+            generation = self.generation
+            buffer, start, end, base, clears = self.buffer, self.start, self.end, self.base, self.clears
+            if((generation & 1) == 0 and generation == self.generation):
+                return buffer[start:end], base + start, clears
+
+    def tail(self, n):
+        # Zero-copy view of the last n rows #
+        return self.view()[-n:] if n > 0 else self.view()[0:0]
+
+    def _makeRoom(self):
+        n = self.end - self.start
+        # Grow geometrically, in whole chunks, or move the live rows of a bounded #
+        # and fully grown log to the front of a fresh buffer
+        new_rows = max(2*self.buffer.shape[0], self.chunk_rows)
+        new_rows = self.chunk_rows*int(np.ceil(new_rows/self.chunk_rows))
+        if(self.max_rows is not None):
+            new_rows = min(new_rows, 2*self.max_rows)
+        new_buffer = np.zeros((new_rows, self.width), dtype = self.dtype)
+        new_buffer[0:n] = self.buffer[self.start:self.end]
+        self.generation += 1    # odd while buffer, start and end don't agree
+        self.buffer = new_buffer
+        self.base += self.start
+        self.start = 0
+        self.end = n
+        self.generation += 1
@@ -0,0 +1,230 @@
+### Espresso Machine Binary Log Files ###
+# Self-describing binary shot logs (.eslog)
+#
+# Layout:
+#   0. Magic b'ESPL'
+#   1. Header length in bytes (uint32, little endian)
+#   2. JSON header, space padded so the data starts on a 64 byte boundary:
+#        {"version": 1, "created": ..., "columns": [{"name", "unit", "dtype"}, ...]}
+#   3. Row-major packed records, one per log row, with the column dtypes above
+#
+# The row count is not stored, it is taken from the file size, so a file that
+# is still being written (or was cut off by a crash) reads back up to the last
+# complete row.
+#
+# logWriter streams rows to disk from a background thread while a shot runs.
+# The in-progress file is named <start time>.eslog.part (more of them when it
+# rotates by size).  Saving copies the whole session so far to a new
+# <save time>.eslog, like saving the in-memory log did, and the session goes
+# on; clearing the log or stopping the writer deletes the .part files, so only
+# saved sessions are kept.  After a crash the .part files are left to recover.
+
+import numpy as np
+import json
+import struct
+import time
+import threading
+import queue
+import shutil
+import os
+
+log_magic = b'ESPL'
+log_version = 1
+log_ext = '.eslog'
+log_align = 64
+
+def logDtype(columns):
+    # Packed record dtype for a list of {'name', 'unit', 'dtype'} columns #
+    return np.dtype([(c['name'], np.dtype(c['dtype']).newbyteorder('<')) for c in columns])
+
+def logHeader(columns):
+    # Encoded header bytes, padded so the data is aligned #
+    header = json.dumps({
+        'version': log_version,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'columns': [{'name': c['name'], 'unit': c['unit'], 'dtype': np.dtype(c['dtype']).str} for c in columns]
+        }).encode('utf-8')
+    pad = -(len(log_magic) + 4 + len(header)) % log_align
+    header += b' '*pad
+    return log_magic + struct.pack('<I', len(header)) + header
+
+def logRecords(rows, columns):
+    # Convert a 2D float array (one column per schema entry) to packed records #
+    rows = np.asarray(rows).reshape(-1, len(columns))
+    records = np.empty(rows.shape[0], dtype = logDtype(columns))
+    for i, c in enumerate(columns):
+        records[c['name']] = rows[:, i]
+    return records
+
+def writeLogFile(filename, rows, columns):
+    # Write a 2D log array to a new .eslog file #
+    with open(filename, 'wb') as f:
+        f.write(logHeader(columns))
+        f.write(logRecords(rows, columns).tobytes())
+
+class logFile():
+    # Memory-mapped reader.  Columns are zero-copy views into the file #
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if(f.read(len(log_magic)) != log_magic):
+                raise ValueError('%s is not an espresso log file'%filename)
+            header_len = struct.unpack('<I', f.read(4))[0]
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+        if(self.header['version'] > log_version):
+            raise ValueError('%s has unsupported log version %d'%(filename, self.header['version']))
+        self.columns = self.header['columns']
+        self.names = [c['name'] for c in self.columns]
+        self.units = {c['name']:c['unit'] for c in self.columns}
+        self.offset = len(log_magic) + 4 + header_len
+        self.dtype = logDtype(self.columns)
+        self.records = self._map()
+
+    def _map(self):
+        data_bytes = self._fileSize() - self.offset
+        rows = data_bytes//self.dtype.itemsize
+        if(rows == 0):
+            return np.zeros(0, dtype = self.dtype)
+        return np.memmap(self.filename, dtype = self.dtype, mode = 'r', offset = self.offset, shape = (rows,))
+
+    def _fileSize(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(0, 2)
+            return f.tell()
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def array(self):
+        # Copy of the log as a 2D float64 array, in the same layout as machine.log #
+        return np.column_stack([self.records[n].astype(np.float64) for n in self.names]) if len(self) else np.zeros((0, len(self.names)))
+
+class logWriter():
+    # Background log writer, fed rows through a bounded queue #
+    def __init__(self, directory, columns, flush_interval = 0.5, batch_rows = 4096, queue_rows = 65536, max_bytes = None):
+        self.directory = directory
+        self.columns = columns
+        self.flush_interval = flush_interval    # max time rows sit in memory before being written (s)
+        self.batch_rows = batch_rows            # write as soon as this many rows are pending
+        self.max_bytes = max_bytes              # rotate to a new .part file past this size, None to disable
+        self.queue = queue.Queue(maxsize = queue_rows)     # blocks of rows and requests
+        self.dropped = 0                        # rows lost because the queue was full
+        self.rows_written = 0
+
+        self.file = None
+        self.parts = []                         # (.part file name, header bytes) of this session, the last open
+
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    ### Producer side ###
+    def put(self, rows):
+        # Queue a block of rows.  Never blocks: rows are dropped if the writer falls behind #
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def save(self, done = None):
+        # Copy the session so far to a finished file.  Sets the done event when written #
+        self.queue.put(('save', done))
+
+    def discard(self):
+        # Delete the session's files and start a new one #
+        self.queue.put(('discard',))
+
+    def stop(self, timeout = 5.0):
+        # Act on what's queued, delete the session's files, and end the thread #
+        if(self.running()):
+            self.queue.put(('stop',))
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {'rows_written': self.rows_written, 'dropped': self.dropped}
+
+    ### Writer thread ###
+    def run(self):
+        pending = []
+        t_flush = time.monotonic() + self.flush_interval
+        while(True):
+            try:
+                item = self.queue.get(timeout = max(t_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if(isinstance(item, tuple)):
+                self._write(pending)
+                pending = []
+                if(item[0] == 'save'):
+                    self._save()
+                    if(item[1] is not None):
+                        item[1].set()
+                elif(item[0] == 'discard'):
+                    self._discard()
+                elif(item[0] == 'stop'):
+                    self._discard()
+                    return
+            elif(item is not None):
+                pending.append(item)
+            if((len(pending) >= self.batch_rows) or (time.monotonic() >= t_flush)):
+                self._write(pending)
+                pending = []
+                t_flush = time.monotonic() + self.flush_interval
+
+    def _write(self, rows):
+        if(len(rows) == 0):
+            return
+        if(self.file is None):
+            self._open()
+        self.file.write(logRecords(np.vstack(rows), self.columns).tobytes())
+        self.file.flush()
+        self.rows_written += len(rows)
+        if((self.max_bytes is not None) and (self.file.tell() >= self.max_bytes)):
+            self.file.close()
+            self.file = None
+
+    def _name(self):
+        # New file name, without extension, from the time #
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = os.path.join(self.directory, stamp)
+        n = 0
+        while(os.path.exists(name + log_ext) or os.path.exists(name + log_ext + '.part')):
+            n += 1
+            name = os.path.join(self.directory, '%s-%d'%(stamp, n))
+        return name
+
+    def _open(self):
+        header = logHeader(self.columns)
+        name = self._name() + log_ext + '.part'
+        self.file = open(name, 'wb')
+        self.file.write(header)
+        self.parts.append((name, len(header)))
+
+    def _save(self):
+        # The session's rows, from all its .part files, under one header #
+        if(self.file is not None):
+            self.file.flush()
+        final_name = self._name() + log_ext
+        with open(final_name + '.saving', 'wb') as f:
+            f.write(logHeader(self.columns))
+            for name, header_bytes in self.parts:
+                with open(name, 'rb') as part:
+                    part.seek(header_bytes)
+                    shutil.copyfileobj(part, f)
+        os.replace(final_name + '.saving', final_name)
+
+    def _discard(self):
+        if(self.file is not None):
+            self.file.close()
+            self.file = None
+        for name, header_bytes in self.parts:
+            os.remove(name)
+        self.parts = []
@@ -21,24 +21,66 @@
 # 9. Weight since scale tare   (g)
 # 10. Group heater power       (w)
 # 11. Water heater power       (w)
+# 12. Device timestamp          (s, firmware clock, see espressoComm)
 
 from espressoComm import *
+from espressoLog import *
+from espressoLogFile import *
+from espressoScheduler import *
+from espressoSnapshot import *
 
 import time
 import numpy as np 
 import scipy
 import threading
+import collections
 import random
+import sys
+import operator
 
 logdir = 'logs/'
 pID = 1155
 vID = 0xC1B0
+log_max_rows = None     # bound on in-memory log rows, None for unbounded
+io_rate = None          # IO loop rate (Hz), None to run as fast as the USB reads return
+fake_io_rate = 1000.0   # IO loop rate (Hz) of the simulated machine
+fake_noise_chunk = 1000 # samples of noise the simulated machine draws at a time
+usb_block = 1           # max USB packets per sample, >1 also drains queued packets (see espressoComm.readBlock)
+cmd_keepalive = 0.1     # resend unchanged commands this often (s), for the firmware watchdog
+usb_async = True        # read USB on a background thread (see espressoComm.usbReader)
+io_short_switch = False # while IO runs, shorten the interpreter's thread switch interval to period/4
+
+# Log columns: cmd_vec then state_vec, as saved by saveLog #
+cmd_columns = [
+    {'name':'pump_cmd',             'unit':'bar|mL/s|rad/s|N-m',    'dtype':'f4'},
+    {'name':'water_temp_cmd',       'unit':'C',                     'dtype':'f4'},
+    {'name':'group_temp_cmd',       'unit':'C',                     'dtype':'f4'},
+    {'name':'pump_cmd_type',        'unit':'',                      'dtype':'f4'},
+    {'name':'flow_dir',             'unit':'',                      'dtype':'f4'},
+    {'name':'tare',                 'unit':'',                      'dtype':'f4'},
+    ]
+state_columns = [
+    {'name':'time',                 'unit':'s',                     'dtype':'f8'},
+    {'name':'pressure',             'unit':'bar',                   'dtype':'f4'},
+    {'name':'flow',                 'unit':'mL/s',                  'dtype':'f4'},
+    {'name':'water_temp',           'unit':'C',                     'dtype':'f4'},
+    {'name':'heater_temp',          'unit':'C',                     'dtype':'f4'},
+    {'name':'group_temp',           'unit':'C',                     'dtype':'f4'},
+    {'name':'pump_vel',             'unit':'rad/s',                 'dtype':'f4'},
+    {'name':'pump_torque_cmd',      'unit':'N-m',                   'dtype':'f4'},
+    {'name':'pump_torque',          'unit':'N-m',                   'dtype':'f4'},
+    {'name':'weight',               'unit':'g',                     'dtype':'f4'},
+    {'name':'group_heater_power',   'unit':'W',                     'dtype':'f4'},
+    {'name':'water_heater_power',   'unit':'W',                     'dtype':'f4'},
+    {'name':'device_time',          'unit':'s',                     'dtype':'f8'},
+    ]
+log_columns = cmd_columns + state_columns
 
 class espressoMachineState():
     # Sensor measurements and estimates #
 
     def __init__(self):
-        self.state_vec = np.zeros([12])
+        self.state_vec = np.zeros([13])
     def time(self):
         return self.state_vec[0]
     def pressure(self):
@@ -63,14 +105,18 @@ class espressoMachineState():
         return self.state_vec[10]
     def waterHeaterPower(self):
         return self.state_vec[11]
+    def deviceTime(self):
+        return self.state_vec[12]
 
 class esspressoMachineCommands():
     # Commands #
     def __init__(self):
         self.cmd_vec = np.zeros([6])
 
-    def setCommands(pumpCmd, waterTempCmd, groupTempCmd, pumpCmdType, flowDir, tare):
-        self.cmd_vec = np.array([pumpCmd, waterTempCmd, groupTempCmd, pumpCmdType, flowDir, tare])
+    def setCommands(self, pumpCmd, waterTempCmd, groupTempCmd, pumpCmdType, flowDir, tare):
+        self.cmd_vec[:] = [pumpCmd, waterTempCmd, groupTempCmd, pumpCmdType, flowDir, tare]
+    def clear(self):
+        self.cmd_vec[:] = 0
     def setPumpCmd(self, cmd):
         self.cmd_vec[0] = cmd
     def setWaterTempCmd(self, cmd):
@@ -87,68 +133,279 @@ class esspressoMachineCommands():
 
 class espressoMachine():
     # Machine interface #
+    # Threads:
+    #   - The IO thread owns state, the log and the commands actually sent (cmd_out)
+    #   - Modes (the FSM thread) set commands in cmd, then publishCommands() hands
+    #     them to the IO thread as one consistent set
+    #   - Anything else reads the latest (commands, state) with snapshot(), and
+    #     the log through its views, neither of which can be torn by the IO thread
+    #   - Each ioStep ends by notifying sample_cond, so the FSM can wait for new
+    #     samples with waitSample() instead of polling
+    #   - After singleThread(), ioStep and the FSM run on one thread in turn
+    #     (see espressoSim), and none of the handoff above is done
 
-    def __init__(self):
-        self.comm = espressoComm(pID, vID)
+    def __init__(self, rate = io_rate):
+        self.comm = self.openComm()
+        self.usb_state_cols = np.r_[0:12, device_time_col]         # state_vec columns of a decoded USB packet
+        self.cmd_channel = commandChannel(self.comm, cmd_keepalive)
         self.state = espressoMachineState()
         self.cmd = esspressoMachineCommands()
-        self.log = np.zeros((np.hstack((self.cmd.cmd_vec, self.state.state_vec))).shape);
+        self.log_buffer = espressoLog(len(self.cmd.cmd_vec) + len(self.state.state_vec), max_rows = log_max_rows)
+        self.log_rows = np.zeros((usb_block, self.log_buffer.width))   # scratch rows for logState
+        self.state_row = self.state.state_vec.reshape(1, -1)            # view of state_vec as one row
+        self.samples = self.state_row                                   # state rows read by the last sample()
         self.log_enabled = False
+        self.log_writer = logWriter(logdir, log_columns)
+        self.clear_log = False                                          # clearLog/saveLog requests for the IO thread
+        self.save_requests = collections.deque()                        # done events, one per saveLog
+
+        # Thread handoff #
+        self.cmd_snapshot = snapshotBuffer(self.cmd.cmd_vec.shape)     # published by publishCommands
+        self.cmd_seq = 0
+        self.cmd_out = np.zeros(self.cmd.cmd_vec.shape)                 # commands being sent by the IO thread
+        self.single_thread = False                                      # see singleThread
+        self.cmd_published = False                                      # publishCommands since the last ioStep, single_thread only
+        self.tare_request = False
+        self.snapshot_row = np.zeros(self.log_buffer.width)
+        self.snapshot_buffer = snapshotBuffer(self.log_buffer.width)   # latest [cmd_out, state_vec]
+        self.sample_cond = threading.Condition()                        # notified after each ioStep
+        self.sample_count = 0
+        self.sample_times = np.zeros(256)                               # perf_counter when each sample_count was reached
+        self.sample_timer = stage_stats.stage('io_sample')             # time per IO loop stage, see espressoStats
+        self.send_timer = stage_stats.stage('io_send')
+        self.log_timer = stage_stats.stage('log_state')
+        self.step_timer = stage_stats.stage('io_step')
 
         # IO thread #
+        self.io_scheduler = periodicScheduler(rate)
         self.io_thread = threading.Thread(target = self.ioLoop)
         self.io_thread.daemon = True
+        self.io_running = False
+        self.switch_interval = None     # interpreter switch interval to restore, see startIO
+        self.delay_model = None         # see delayModel
         #self.io_thread.start()
 
-    def startIO(self):
-        # Start running the IO thread #
+    def openComm(self):
+        return espressoComm(pID, vID)
+
+    def delayModel(self):
+        # Shot stop delay learned from this machine's logs, see espressoPredict #
+        if(self.delay_model is None):
+            from espressoPredict import stopDelayModel
+            self.delay_model = stopDelayModel()
+        return self.delay_model
+
+    def startIO(self, short_switch = io_short_switch):
+        # Start running the IO and log writer threads #
+        # short_switch lets the IO thread take the GIL back well within one period
+        # from busy Python threads.  It's interpreter wide, so stopIO puts it back
+        if(short_switch and (self.io_scheduler.period is not None)):
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self.switch_interval, self.io_scheduler.period/4))
+        if(usb_async and self.comm):
+            self.comm.startReader()
+        self.log_writer.start()
+        self.io_running = True
         self.io_thread.start()
 
     def stopIO(self):
-        # Stop running IO thread #
-        self.io_thread.stop()
+        # Stop the IO thread after the sample it's on, then the USB reader and #
+        # log writer threads startIO started.  Saves still waiting for the IO
+        # thread are done first; the rest of the session isn't kept on disk
+        self.io_running = False
+        if(self.io_thread.is_alive()):
+            self.io_thread.join(1.0)
+        if(self.comm):
+            self.comm.stopReader()
+        self._saveRequests()
+        self.log_writer.stop()
+        if(self.switch_interval is not None):
+            sys.setswitchinterval(self.switch_interval)
+            self.switch_interval = None
 
     def sample(self):
         # Read data from USB, update machine.state #
-        self.comm.read()
-        self.state.state_vec = np.array(self.comm.in_floats[0:12])
+        # Returns the number of new samples, 0 if the read failed or timed out
+        if(usb_block > 1):
+            n = self.comm.readBlock(usb_block)
+            if(n > 0):
+                self.comm.rows[n-1].take(self.usb_state_cols, out = self.state.state_vec)
+            self.samples = self.comm.block[0:n, self.usb_state_cols] if n > 1 else self.state_row
+            return n
+        if(self.comm.read()):
+            self.comm.rows[0].take(self.usb_state_cols, out = self.state.state_vec)
+            return 1
+        return 0
 
     def sendCommands(self):
-        # Send cmds over USB #
-        self.comm.out_floats = self.cmd.cmd_vec
-        self.comm.write()
-        self.cmd.tare(0)    # reset tare to zero
+        # Send cmds over USB, when they have changed #
+        self.cmd_channel.send(self.cmd_out)
 
-    def logState(self):
-        # Append current state to log #
-        row = np.hstack((self.cmd.cmd_vec, self.state.state_vec))
-        if(np.all(self.log==0)):
-            self.log = row
+    def publishCommands(self):
+        # Hand the commands in self.cmd to the IO thread #
+        # Call from the thread that sets self.cmd (normally the FSM) after each update.
+        # Tare is one-shot: it is sent once per publish, and cleared here
+        if(self.single_thread):
+            np.copyto(self.cmd_out, self.cmd.cmd_vec)
+            self.cmd_published = True
         else:
-            self.log = np.vstack((self.log, row))
+            self.cmd_snapshot.publish(self.cmd.cmd_vec)
+        self.cmd.tare(0)
+
+    def singleThread(self):
+        # For ioStep and the FSM stepped in turn from one thread, e.g. a simulation #
+        # publishCommands writes cmd_out directly, and ioStep skips the snapshot,
+        # the sample_cond wakeup and the stage timers
+        self.single_thread = True
+        self.sample_timer = self.send_timer = self.log_timer = self.step_timer = null_timer
+
+    def tare(self):
+        # Tare the scale on the next sample, from any thread #
+        self.tare_request = True
+
+    def snapshot(self):
+        # Consistent copy of the latest (commands, state), from any thread #
+        row = self.snapshot_buffer.read()
+        cmd = esspressoMachineCommands()
+        cmd.cmd_vec = row[0:len(self.cmd_out)]
+        state = espressoMachineState()
+        state.state_vec = row[len(self.cmd_out):]
+        return cmd, state
+
+    @property
+    def log(self):
+        # Zero-copy view of the logged rows: [cmd_vec, state_vec] per row #
+        return self.log_buffer.view()
+
+    def logState(self):
+        # Append the last sample's rows to log, and stream them to disk #
+        if(self.samples is self.state_row):
+            # One sample, joined straight into the log #
+            self.log_buffer.appendJoined((self.cmd_out, self.state.state_vec))
+            if(self.log_writer.running()):
+                self.log_writer.put(self.log_buffer.tail(1).copy())
+            return
+        rows = self.log_rows[0:self.samples.shape[0]]
+        rows[:, 0:len(self.cmd_out)] = self.cmd_out
+        rows[:, len(self.cmd_out):] = self.samples
+        self.log_buffer.appendRows(rows)
+        if(self.log_writer.running()):
+            self.log_writer.put(rows.copy())
 
     def clearLog(self):
-        # Empties the log #
-        self.log = np.zeros((np.hstack((self.cmd.cmd_vec, self.state.state_vec))).shape);
+        # Empties the log, and deletes the in-progress log file #
+        if(self.io_thread.is_alive()):
+            self.clear_log = True       # done by the IO thread, between samples
+        else:
+            self._clearLog()
 
-    def saveLog(self):
-        # Save log data to CSV #
-        filename = logdir + time.strftime("%Y%m%d-%H%M%S") + '.csv'
-        np.savetxt(filename, self.log, delimiter=',')
+    def _clearLog(self):
+        if(len(self.log_buffer) > 0):
+            if(self.log_writer.running()):
+                self.log_writer.discard()
+            self.log_buffer.clear()
+
+    def saveLog(self, wait = False):
+        # Save the whole log to a new binary .eslog file (see espressoLogFile) #
+        # With wait, blocks until the file is complete
+        done = threading.Event()
+        if(self.io_thread.is_alive()):
+            self.save_requests.append(done)     # done by the IO thread, between samples
+        else:
+            self._saveLog(done)
+        if(wait):
+            done.wait(5.0)
+
+    def _saveRequests(self):
+        while(self.save_requests):
+            self._saveLog(self.save_requests.popleft())
+
+    def _saveLog(self, done):
+        if(self.log_writer.running()):
+            # Rows are already on disk, the writer copies them #
+            self.log_writer.save(done)
+        else:
+            writeLogFile(logdir + time.strftime("%Y%m%d-%H%M%S") + log_ext, self.log, log_columns)
+            done.set()
 
     def ioLoop(self):
-        while(True):
-            self.sample()
-            self.sendCommands()
-            if(self.log_enabled):
-                self.logState()
+        while(self.io_running):
+            self.io_scheduler.wait()
+            self.ioStep()
+
+    def ioStep(self):
+        # One IO loop iteration #
+        t_start = time.perf_counter()
+        if(self.single_thread):
+            if(not self.cmd_published):
+                self.cmd_out[5] = 0     # tare already sent for this publish
+            self.cmd_published = False
+        else:
+            seq = self.cmd_snapshot.seq
+            self.cmd_snapshot.read(self.cmd_out)
+            if(seq == self.cmd_seq):
+                self.cmd_out[5] = 0     # tare already sent for this publish
+            self.cmd_seq = seq
+        if(self.tare_request):
+            self.tare_request = False
+            self.cmd_out[5] = 1
+        n = self.sample()
+        t = self.sample_timer.stop(t_start)
+        self.sendCommands()
+        t = self.send_timer.stop(t)
+        if(self.save_requests):
+            self._saveRequests()
+        if(self.clear_log):
+            self.clear_log = False
+            self._clearLog()
+        if(n == 0):
+            return                      # nothing new to log, publish or wake the FSM for
+        if(self.log_enabled):
+            t = time.perf_counter()
+            self.logState()
+            self.log_timer.stop(t)
+        if(self.single_thread):
+            self.sample_count += 1
+            return
+        self.snapshot_row[0:len(self.cmd_out)] = self.cmd_out
+        self.snapshot_row[len(self.cmd_out):] = self.state.state_vec
+        self.snapshot_buffer.publish(self.snapshot_row)
+        t = self.step_timer.stop(t_start)
+        with self.sample_cond:
+            self.sample_count += 1
+            self.sample_times[self.sample_count % len(self.sample_times)] = t
+            self.sample_cond.notify_all()
+
+    def waitSample(self, last, timeout = None):
+        # Block until there is a sample newer than sample_count last, or timeout (s) #
+        # Returns the latest sample_count
+        with self.sample_cond:
+            self.sample_cond.wait_for(lambda: self.sample_count != last, timeout)
+            return self.sample_count
+
+    def sampleTime(self, count):
+        # perf_counter time sample_count reached count, for the last 256 samples #
+        return self.sample_times[count % len(self.sample_times)]
 
 class fakeEspressoMachine(espressoMachine):
-    def __init__(self):
-        espressoMachine.__init__(self)
-        self.comm = False
+    # Simulated machine #
+    # Samples are timestamped from clock.time() if a clock is given (e.g. a
+    # simulated clock, see espressoSim), otherwise from the IO scheduler
+    def __init__(self, rate = fake_io_rate, clock = None):
+        espressoMachine.__init__(self, rate)
+        self.clock = clock
         self.t_sample = 0
-        self.state.state_vec[0] = time.time()
+        self.t_offset = time.time() - time.perf_counter()   # scheduler time -> time.time()
+        self.state.state_vec[0] = clock.time() if clock is not None else time.time()
+        self.sim_state = self.state.state_vec.tolist()  # simulated state, copied to state_vec once complete
+        self.noise = iter(())                           # per sample noise, see drawNoise
+    def drawNoise(self):
+        # The next fake_noise_chunk samples' noise, as lists of 10 normal (state #
+        # 1-10) then the pump torque's uniform, already scaled
+        noise = np.hstack((.01*np.random.standard_normal((fake_noise_chunk, 10)),
+                           1e-3*(np.random.rand(fake_noise_chunk, 1) - .5)))
+        self.noise = iter(noise.tolist())
+        return next(self.noise)
     def sample(self):
         alpha = .1
         alpha2 = .06
@@ -156,42 +413,61 @@ class fakeEspressoMachine(espressoMachine):
         r = .2
         tm_g = 200
         tm_h = 200
-        old_group_temp = self.state.state_vec[5]
-        old_heater_temp = self.state.state_vec[4]
-        self.t_sample = time.time()
-        dt = self.t_sample - self.state.state_vec[0]
-        self.state.state_vec[0] = self.t_sample
+        # Simulate on plain floats, numpy scalar math is ~10x slower #
+        s = self.sim_state              # state being simulated
+        c = self.cmd_out.tolist()       # commands being sent
+        old_group_temp = s[5]
+        old_heater_temp = s[4]
+        if(self.clock is not None):
+            self.t_sample = self.clock.time()
+        elif((self.io_scheduler.period is not None) and (self.io_scheduler.deadline is not None)):
+            # Sample on the scheduler's grid, so wakeup jitter doesn't get into dt #
+            self.t_sample = self.io_scheduler.deadline + self.t_offset
+        else:
+            self.t_sample = time.time()
+        dt = self.t_sample - s[0]
+        s[0] = self.t_sample
+        s[12] = self.t_sample       # the simulated firmware runs on the same clock
 
-        if(self.cmd.cmd_vec[4] == 1):   # fluid resistance vs flow direction
+        if(c[4] == 1):   # fluid resistance vs flow direction
             r = 5
         else:
             r = .01
 
-        if(self.cmd.cmd_vec[3] == 0):   # pump off
-            self.state.state_vec[1] = 0
-            self.state.state_vec[2] = 0
-        elif(self.cmd.cmd_vec[3] ==1 ): # pressure control
-            self.state.state_vec[1] = (1-alpha3)*self.state.state_vec[1] + alpha3*self.cmd.cmd_vec[0]
-            self.state.state_vec[2] = self.state.state_vec[1]/r
-        elif(self.cmd.cmd_vec[3] == 2): # flow control
-            self.state.state_vec[2] = (1-alpha3)*self.state.state_vec[2] + alpha3*self.cmd.cmd_vec[0]
-            self.state.state_vec[1] = self.state.state_vec[2]*r
-        self.state.state_vec[3] = (1-alpha2)*self.state.state_vec[3] + alpha2*self.cmd.cmd_vec[1]   # water temp
-        self.state.state_vec[4] = (1-alpha)*self.state.state_vec[4] + alpha*self.cmd.cmd_vec[1]     # heater temp
-        self.state.state_vec[5] = (1-alpha)*self.state.state_vec[5] + alpha*self.cmd.cmd_vec[2]     # group temp
-        self.state.state_vec[6] = self.state.state_vec[2]*2*np.pi/.33
-        self.state.state_vec[7] = self.state.state_vec[1]*.33/(10*2*np.pi)
-        self.state.state_vec[8] = self.state.state_vec[7] + 1e-3*(np.random.rand()-.5)
-        if(self.cmd.cmd_vec[4]==1):
-            self.state.state_vec[9] = self.state.state_vec[9] + dt*self.state.state_vec[2]
-        self.state.state_vec[10] = (self.state.state_vec[5] - old_group_temp)*tm_g/dt + .02*self.state.state_vec[5]
-        self.state.state_vec[11] = self.state.state_vec[2]*self.state.state_vec[3]*4.2 + (self.state.state_vec[4] - old_heater_temp)*tm_h/dt
-
-        self.state.state_vec[1:11] += .01*(np.random.standard_normal(self.state.state_vec[1:11].shape))
-
-        if(self.cmd.cmd_vec[5]):    # Tare
-            self.state.state_vec[9] = 0
-            self.cmd.tare(0)
-        time.sleep(.001)
+        if(c[3] == 0):   # pump off
+            s[1] = 0
+            s[2] = 0
+        elif(c[3] ==1 ): # pressure control
+            s[1] = (1-alpha3)*s[1] + alpha3*c[0]
+            s[2] = s[1]/r
+        elif(c[3] == 2): # flow control
+            s[2] = (1-alpha3)*s[2] + alpha3*c[0]
+            s[1] = s[2]*r
+        s[3] = (1-alpha2)*s[3] + alpha2*c[1]   # water temp
+        s[4] = (1-alpha)*s[4] + alpha*c[1]     # heater temp
+        s[5] = (1-alpha)*s[5] + alpha*c[2]     # group temp
+        s[6] = s[2]*2*np.pi/.33
+        s[7] = s[1]*.33/(10*2*np.pi)
+        noise = next(self.noise, None) or self.drawNoise()
+        s[8] = s[7] + noise[10]
+        if(c[4]==1):
+            s[9] = s[9] + dt*s[2]
+        s[10] = (s[5] - old_group_temp)*tm_g/dt + .02*s[5]
+        s[11] = s[2]*s[3]*4.2 + (s[4] - old_heater_temp)*tm_h/dt
+
+        s[1:11] = map(operator.add, s[1:11], noise)     # noise[0:10], map stops with s[1:11]
+
+        if(c[5]):    # Tare
+            s[9] = 0
+        self.state.state_vec[:] = s
+        return 1
+    def openComm(self):
+        return False        # no USB device, so no libusb backend needed
+    def delayModel(self):
+        # A fixed delay, so simulations never read or write the shot catalog #
+        if(self.delay_model is None):
+            from espressoPredict import fixedStopDelay
+            self.delay_model = fixedStopDelay()
+        return self.delay_model
     def sendCommands(self):
         pass
\ No newline at end of file
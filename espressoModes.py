@@ -6,13 +6,38 @@
 #   espressoMachineCommands: commands to the macine - pressure, temperature, etc.
 
 from espressoMachine import *
+from espressoPredict import *
+
+class phaseTimer():
+    # Non-blocking timer for timed phases, in machine time (em.state.time()) #
+    # A phase calls hold(em, duration) every run: it returns True until duration
+    # seconds have passed since the first call, then False once and resets.  So
+    # the mode keeps running (and can be stopped) while the phase waits
+    def __init__(self):
+        self.deadline = None
+    def start(self, em, duration):
+        self.deadline = em.state.time() + duration
+    def cancel(self):
+        self.deadline = None
+    def running(self):
+        return self.deadline is not None
+    def expired(self, em):
+        return (self.deadline is not None) and (em.state.time() >= self.deadline)
+    def remaining(self, em):
+        return max(self.deadline - em.state.time(), 0.0) if self.deadline is not None else 0.0
+    def hold(self, em, duration):
+        if(self.deadline is None):
+            self.start(em, duration)
+        if(self.expired(em)):
+            self.cancel()
+            return False
+        return True
 
 class idleMode():
     # Idle mode does nothing #
-    def __init__(self):
-        self.title = 'Idle'
+    title = 'Idle'
     def run(self, em, ui):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         #print('running idle mode')
     def start(self):
         pass
@@ -23,8 +48,8 @@ class idleMode():
 
 class preheatMode():
     # Cycles water through tank and heats #
+    title = 'Preheat'
     def __init__(self):
-        self.title = 'Preheat'
         self.flowCmd = 2.0
         self.tempCmd = 0.0
     def run(self, em, ui):
@@ -36,15 +61,14 @@ class preheatMode():
     def start(self):
         pass
     def stop(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
     def exit(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         return True
 
 class flushMode():
     # Flushes water through group #
-    def __init__(self):
-        self.title = 'Flush'
+    title = 'Flush'
     def run(self, em, ui, flowCmd = 6.0):
         em.cmd.setFlowDir(1)      # flow to group
         em.cmd.setPumpCmdType(2)  # flow control
@@ -52,31 +76,30 @@ class flushMode():
     def start(self):
         pass
     def stop(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
     def exit(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         return True
 
 class manualMode():
     # Manual control from GUI #
+    title = 'Manual'
     def __init__(self):
-        self.title = 'Manual'
         self.cmds = esspressoMachineCommands()
     def run(self, em, ui):
-        em.cmd = self.cmds
+        np.copyto(em.cmd.cmd_vec, self.cmds.cmd_vec)
     def start(self):
         em.log_enabled = True
     def stop(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         em.log_enabled = False
     def exit(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         em.log_enabled = False
         return True
 
 class preheatPlot():
-    def __init__(self):
-        self.title = 'Plot Preheat'
+    title = 'Plot Preheat'
     def run(self, em, ui, flowCmd = 2.0, waterTempCmd = 90.0, groupTempCmd = 90.0):
         em.log_enabled = True
         em.cmd.setFlowDir(0)        # flow to tank
@@ -88,17 +111,17 @@ class preheatPlot():
         pass
     def stop(self, em):
         em.log_enabled = False
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
     def exit(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         em.log_enabled = False
         em.clearLog()
         return True
 
 class nineBarShot():
     # Standard 9-bar shot with 1-bar pre-infusion
-    def __init__(self):
-        self.title = 'Nine Bar - Flow Preinfusion'
+    title = 'Nine Bar - Flow Preinfusion'
+    def __init__(self, delay_model = None):
         self.started = False
         self.preheat_done = False
         self.pi_done = False
@@ -115,6 +138,13 @@ class nineBarShot():
         self.shot_pressure = 6.0
         self.shot_weight = 32.0
         self.temp_tol = 1.0
+        self.t_bleed = 2.0
+        self.bleed_timer = phaseTimer()
+        self.predict_stop = True            # end the shot on the predicted final weight (see espressoPredict)
+        self.stop_delay = None              # None to use delay_model's
+        self.delay_model = delay_model      # None for the machine's (em.delayModel())
+        self.predictor = weightPredictor()
+        self.delay_refitted = False        # delay_model refitted since start
 
     def run(self, em, ui):
         if(not self.started):
@@ -131,7 +161,7 @@ class nineBarShot():
             pass
 
     def stop(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         #self.pi_flow = 0.00
         em.log_enabled = False
 
@@ -141,12 +171,21 @@ class nineBarShot():
         self.shot_done = False
         self.done = False
         self.started = True
+        self.bleed_timer.cancel()
+        self.predictor.reset()
+        self.delay_refitted = False
 
     def exit(self, em):
-        em.cmd.cmd_vec = np.zeros(em.cmd.cmd_vec.shape)
+        em.cmd.clear()
         return True
 
     def preheat(self, em):
+        if(not self.delay_refitted):
+            # Picks up logs saved since the last shot, in the background while preheating #
+            if(self.delay_model is None):
+                self.delay_model = em.delayModel()
+            self.delay_model.refit()
+            self.delay_refitted = True
         em.clearLog()
         #print('preheating.  wt: ', em.state.waterTemp(), ' gt ', em.state.groupTemp())
         em.cmd.setFlowDir(0)                     # flow to tank during preheat
@@ -174,22 +213,34 @@ class nineBarShot():
         if(em.state.pressure() >= self.pi_end_pressure):
             em.cmd.tare(1)                       # tare scale after preinfusion
             self.pi_done = True
+            self.predictor.delay = self.stop_delay if self.stop_delay is not None else self.delay_model.delay()
         
     def shot(self, em):
         #print('shot.  flow: ', em.state.flow(), ' pr ', em.state.pressure(), ' w ', em.state.weight())
         em.cmd.setPumpCmdType(1)
         em.cmd.setPumpCmd(self.shot_pressure)    # shot pressure
-        if(em.state.weight()>self.shot_weight):
+        weight = em.state.weight()
+        if(self.predict_stop):
+            # Stop early by what will still land in the cup #
+            self.predictor.update(em.state.time(), weight)
+            weight = self.predictor.predict()
+        if(weight>self.shot_weight):
             self.shot_done = True
 
     def end(self, em):
-        print('done')
-        em.log_enabled = False
+        if(not self.bleed_timer.running()):
+            print('done')
         em.cmd.setFlowDir(2)                     # Bleed group to drip tray
         em.cmd.setPumpCmdType(2)
         em.cmd.setPumpCmd(0)                     # zero pressure command
-        #time.sleep(1.0)
-        time.sleep(2.0)
+        if(self.bleed_timer.hold(em, self.t_bleed)):
+            return
+        # Logging stops after the bleed, not when the pump does as it used to, so #
+        # saved logs end with t_bleed seconds of flow to the drip tray (flow_dir
+        # 2): stopDelay fits the weight still landing in the cup from them.  A
+        # log's duration in the catalog includes the bleed, and its final_weight
+        # is the settled weight in the cup
+        em.log_enabled = False
         em.cmd.setFlowDir(0)
         em.cmd.setPumpCmdType(0)
         #self.pi_flow = 0
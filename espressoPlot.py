@@ -0,0 +1,238 @@
+### Espresso Machine Plot Pipeline ###
+# Turns the machine log into the series the GUI plots, looking only at the
+# rows appended since the last frame, so keeping up costs the same however
+# long the log gets.
+#   - Median of 3 filtering of the filtered series (like signal.medfilt(x, 3)),
+#     run on every log row as it arrives.  A row's filtered value is final
+#     once the row after it arrives, so the newest row is held back a frame
+#   - A min/max level of detail pyramid (minMaxPyramid) of the filtered rows,
+#     so any time range can be drawn from about as many buckets as there are
+#     pixels across the plot, without losing short spikes between them
+#   - Running extrema of groups of columns over every log row, for the axis
+#     ranges
+#   - The log being cleared (espressoLog.clears changing) starts everything
+#     over
+# view(x0, x1, pixels) picks the finest level with at most pixels/2 buckets
+# between x0 and x1 (seconds from the first row), or the log rows themselves
+# when there are at most pixels of them.  Buckets come back as a point each,
+# at the bucket's min, with their maxes as a second set of points (the
+# envelope), so the GUI draws two thin curves instead of zig-zagging between
+# them.  Sampled series (e.g. modes) take each bucket's first row, not its
+# min and max, so they still pair up with the other series row by row.
+
+import numpy as np
+from espressoLog import *
+
+lod_base = 16       # log rows per level 1 bucket
+lod_factor = 4      # level k buckets per level k+1 bucket
+
+def median3(a, b, c):
+    # Elementwise median of three arrays #
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+class minMaxPyramid():
+    # Min/max buckets of a stream of rows at increasing sizes #
+    # Level k (from 0) has buckets of base*factor^k rows, each stored as one
+    # row of [time of its first row, min of each channel, max of each channel].
+    # Channels in first keep their first row's value as both min and max.
+    # Rows are appended to level 0 in blocks of base; each level is folded into
+    # the next in blocks of factor buckets
+    def __init__(self, channels, base = lod_base, factor = lod_factor, first = ()):
+        self.channels = channels
+        self.base = base
+        self.factor = factor
+        self.first = list(first)
+        self.width = 1 + 2*channels
+        self.clear()
+
+    def clear(self):
+        self.levels = []        # espressoLog of buckets, per level
+        self.folded = []        # buckets of each level already folded into the next
+        self.pending = np.zeros((self.base, 1 + self.channels))
+        self.n_pending = 0      # rows in pending, not yet in a level 0 bucket
+        self.rows = 0           # rows appended
+
+    def bucketRows(self, k):
+        return self.base*self.factor**k
+
+    def append(self, t, values):
+        # Append rows: times t (m,) and values (m, channels) #
+        m = len(t)
+        if(m == 0):
+            return
+        self.rows += m
+        rows = np.empty((self.n_pending + m, 1 + self.channels))
+        rows[0:self.n_pending] = self.pending[0:self.n_pending]
+        rows[self.n_pending:, 0] = t
+        rows[self.n_pending:, 1:] = values
+        n = len(rows)//self.base
+        self.n_pending = len(rows) - n*self.base
+        self.pending[0:self.n_pending] = rows[n*self.base:]
+        if(n > 0):
+            block = rows[0:n*self.base].reshape(n, self.base, -1)
+            self._add(0, block[:, 0, 0], block[:, :, 1:].min(axis = 1), block[:, :, 1:].max(axis = 1), block[:, 0, 1:])
+
+    def _add(self, k, t, mins, maxs, firsts):
+        # Append buckets to level k, then fold any complete groups into level k+1 #
+        if(self.first):
+            mins[:, self.first] = firsts[:, self.first]
+            maxs[:, self.first] = firsts[:, self.first]
+        if(k == len(self.levels)):
+            self.levels.append(espressoLog(self.width))
+            self.folded.append(0)
+        buckets = np.empty((len(t), self.width))
+        buckets[:, 0] = t
+        buckets[:, 1:1+self.channels] = mins
+        buckets[:, 1+self.channels:] = maxs
+        self.levels[k].appendRows(buckets)
+        n = (len(self.levels[k]) - self.folded[k])//self.factor
+        if(n > 0):
+            c = self.channels
+            block = self.levels[k].view()[self.folded[k]:self.folded[k] + n*self.factor].reshape(n, self.factor, -1)
+            self.folded[k] += n*self.factor
+            self._add(k + 1, block[:, 0, 0], block[:, :, 1:1+c].min(axis = 1), block[:, :, 1+c:].max(axis = 1), block[:, 0, 1:1+c])
+
+    def buckets(self, k, row0, row1):
+        # Buckets of level k covering rows row0 to row1, as one array of bucket rows #
+        # Past the last complete level k bucket, the rest is made up from smaller
+        # buckets and the pending rows
+        parts = []
+        size = self.bucketRows(k)
+        n = len(self.levels[k])
+        b0 = min(row0//size, n)
+        b1 = min(-(-row1//size), n)
+        if(b1 > b0):
+            parts.append(self.levels[k].view()[b0:b1])
+        row = max(n*size, row0)
+        for j in range(k - 1, -1, -1):
+            if(row >= row1):
+                break
+            size = self.bucketRows(j)
+            n = len(self.levels[j])
+            b0 = min(row//size, n)
+            b1 = min(-(-row1//size), n)
+            if(b1 > b0):
+                parts.append(self.levels[j].view()[b0:b1])
+            row = max(n*size, row)
+        p0 = row - (self.rows - self.n_pending)
+        if((row < row1) and (p0 < self.n_pending)):
+            p = self.pending[max(p0, 0):min(self.n_pending, row1 - (self.rows - self.n_pending))]
+            parts.append(np.hstack((p, p[:, 1:])))
+        return np.vstack(parts) if parts else np.zeros((0, self.width))
+
+class plotPipeline():
+    # series: {name: (log column, median filtered)}, the first must be time
+    # ranges: {name: (first log column, one past the last)}
+    # sampled: names of series whose buckets take their first row, not min/max
+    def __init__(self, series, ranges, max_points = 500, sampled = ()):
+        self.names = list(series)
+        self.columns = [series[n][0] for n in self.names]
+        self.filtered = np.array([series[n][1] for n in self.names])
+        self.sampled = [n for n in self.names if n in sampled]
+        self.range_columns = ranges
+        self.max_points = max_points        # pixels for view() when none are given
+        self.pyramid = minMaxPyramid(len(self.names) - 1, first = [self.names.index(n) - 1 for n in self.sampled])
+        self.reset(None)
+
+    def reset(self, clears):
+        self.clears = clears
+        self.seen = 0           # log rows (since the clear) processed
+        self.origin = None      # log row of the first row
+        self.t0 = 0.0
+        self.t_last = 0.0
+        self.prev = None        # last filtered row's raw values
+        self.hold = None        # newest row's raw values, filtered when the next arrives
+        self.ranges = {name:[np.inf, -np.inf] for name in self.range_columns}
+        self.pyramid.clear()
+
+    def update(self, log):
+        # Process the rows appended to log (an espressoLog) since the last update #
+        # Returns True if there are new rows or the log was cleared
+        rows, first, clears = log.indexedView()
+        if(clears != self.clears):
+            self.reset(clears)
+            changed = True
+        else:
+            changed = False
+        new = rows[max(self.seen - first, 0):]
+        if(len(new) == 0):
+            return changed
+        self.seen = first + len(rows)
+        if(self.origin is None):
+            self.origin = first + len(rows) - len(new)
+            self.t0 = new[0, self.columns[0]]
+        self.t_last = new[-1, self.columns[0]]
+        for name, (c0, c1) in self.range_columns.items():
+            r = self.ranges[name]
+            r[0] = min(r[0], new[:, c0:c1].min())
+            r[1] = max(r[1], new[:, c0:c1].max())
+        # Running median of 3 over prev, hold and the new rows.  Out are hold #
+        # and the new rows but the newest, which is held for the next update
+        x = new[:, self.columns]
+        held = [r for r in (self.prev, self.hold) if r is not None]
+        if(held):
+            x = np.vstack(held + [x])
+        i0 = len(held) - (1 if self.hold is not None else 0)         # index in x of out[0]
+        out = x[i0:-1].copy()
+        lo = max(i0, 1)                 # the log's first row stays as it is
+        if(len(x) - 1 > lo):
+            f = self.filtered
+            out[lo - i0:, f] = median3(x[lo-1:-2, f], x[lo:-1, f], x[lo+1:, f])
+        if(len(x) > 1):
+            self.prev = x[-2]
+        self.hold = x[-1]
+        self.pyramid.append(out[:, 0], out[:, 1:])
+        return True
+
+    def _logRows(self, log, r0, r1):
+        # Log rows r0 to r1 (from origin), filtered like update() does #
+        rows, first, clears = log.indexedView()
+        a = min(max(self.origin + r0 - first, 0), len(rows))
+        b = min(max(self.origin + r1 - first, a), len(rows))
+        e0 = max(a - 1, 0)
+        x = rows[e0:min(b + 1, len(rows)), self.columns]
+        out = x[a - e0:a - e0 + b - a].copy()
+        lo = max(a - e0, 1)
+        hi = min(a - e0 + b - a, len(x) - 1)    # the log's last row stays as it is
+        if(hi > lo):
+            f = self.filtered
+            out[lo - (a - e0):hi - (a - e0), f] = median3(x[lo-1:hi-1, f], x[lo:hi, f], x[lo+1:hi+1, f])
+        return out
+
+    def view(self, log, x0 = None, x1 = None, pixels = None):
+        # {series name: points} for times x0 to x1 (s from the first row), time as 'time' #
+        # For buckets, the points are their mins, and 'envelope' is {series name:
+        # maxes} (but for sampled series).  For log rows it's None
+        if(self.origin is None):
+            return None
+        pixels = pixels or self.max_points
+        x0 = 0.0 if x0 is None else x0
+        x1 = self.t_last - self.t0 if x1 is None else x1
+        rows, first, clears = log.indexedView()
+        t = rows[:, self.columns[0]]
+        r0 = max(int(np.searchsorted(t, self.t0 + x0)) - 1, 0) + first - self.origin
+        r1 = min(int(np.searchsorted(t, self.t0 + x1)) + 1, len(rows)) + first - self.origin
+        if(r0 <= first - self.origin):
+            r0 = 0                  # from the start, even if a bounded log has dropped it
+        if((r1 - r0 <= pixels) or (len(self.pyramid.levels) == 0)):
+            points = self._logRows(log, r0, r1)
+            frame = {n:points[:, i] for i, n in enumerate(self.names)}
+            frame['envelope'] = None
+        else:
+            k = 0
+            while((k + 1 < len(self.pyramid.levels)) and ((r1 - r0)/self.pyramid.bucketRows(k) > pixels/2)):
+                k += 1
+            b = self.pyramid.buckets(k, r0, r1)
+            c = self.pyramid.channels
+            frame = {self.names[0]:b[:, 0]}
+            frame['envelope'] = {}
+            for i, n in enumerate(self.names[1:]):
+                frame[n] = b[:, 1 + i]
+                if(n not in self.sampled):
+                    frame['envelope'][n] = b[:, 1 + c + i]
+        frame[self.names[0]] = frame[self.names[0]] - self.t0
+        return frame
+
+    def range(self, name):
+        # (min, max) of a range's columns over the whole log #
+        return tuple(self.ranges[name])
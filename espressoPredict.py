@@ -0,0 +1,187 @@
+### Espresso Machine Shot End Prediction ###
+# Ends shots early enough that the final weight lands on target.
+#   - After the pump is told to stop, the scale keeps rising for a while: the
+#     FSM and USB delays, and the liquid already on its way to the cup.  At
+#     a steady weight rate that's rate*stop_delay grams
+#   - weightPredictor keeps a least squares fit of weight against time over
+#     the last n samples, updated in O(1) per sample, and predicts the final
+#     weight if the shot were stopped now.  The shot stops the first time the
+#     prediction crosses the target, so a noisy rate stops it early: n is
+#     half a second at 1 kHz, over which the scale's drift is small
+#   - stop_delay is learned from past logs: for each shot whose log goes on
+#     through the bleed, how long the weight keeps rising at the stop's rate.
+#     The scale reading drifts (its noise adds up sample to sample, like a
+#     random walk), so the fit is to the changes in weight, each weighted by
+#     its time step, not to the weights.  The catalog (espressoCatalog) keeps
+#     it per log, and stopDelayModel takes the median of the most recent ones.
+#     Single fits are still noisy, so at least min_fits are needed
+#   - Only the real machine learns it (espressoMachine.delayModel()).  The
+#     simulated machine uses a fixedStopDelay, so simulations and sweeps
+#     never read or write the catalog
+# Until enough logs have been fitted the delay is default_stop_delay, 0,
+# which stops on the weight itself, as before.
+
+from espressoMachine import *
+
+default_stop_delay = 0.0    # used until min_fits logs have been fitted (s)
+min_fits = 5                # logs needed before the learned delay is used
+recent_fits = 20            # learned delay is the median of this many recent logs
+fit_window = 0.5            # weight rate at the stop is fitted over this long (s)
+settle_time = 0.2           # final weight is the median of the log's last settle_time (s)
+min_fit_rate = 0.2          # shots stopped slower than this aren't fitted (g/s)
+max_stop_delay = 10.0       # fits longer than this are discarded (s)
+max_fit_weight = 1000.0     # logs weighing more than this have a bad scale reading (g)
+refit_interval = 60.0       # min time between refits (s)
+
+class weightPredictor():
+    # Running least squares weight rate over the last n samples #
+    def __init__(self, n = 500, delay = default_stop_delay):
+        self.n = n
+        self.delay = delay
+        self.t = [0.0]*n
+        self.w = [0.0]*n
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.t0 = None          # times are kept relative to the first sample
+        self.st = 0.0           # sums over the window: t, w, t*t, t*w
+        self.sw = 0.0
+        self.stt = 0.0
+        self.stw = 0.0
+        self.last = 0.0
+
+    def update(self, t, w):
+        t = float(t)            # plain floats, numpy scalar math is several times slower
+        w = float(w)
+        if(self.t0 is None):
+            self.t0 = t
+        t -= self.t0
+        i = self.count % self.n
+        if(self.count >= self.n):
+            to = self.t[i]
+            wo = self.w[i]
+            self.st -= to
+            self.sw -= wo
+            self.stt -= to*to
+            self.stw -= to*wo
+        self.t[i] = t
+        self.w[i] = w
+        self.st += t
+        self.sw += w
+        self.stt += t*t
+        self.stw += t*w
+        self.count += 1
+        self.last = w
+
+    def rate(self):
+        # Weight rate (g/s), 0 until there are two samples #
+        m = min(self.count, self.n)
+        d = m*self.stt - self.st*self.st
+        if((m < 2) or (d <= 0)):
+            return 0.0
+        return (m*self.stw - self.st*self.sw)/d
+
+    def predict(self):
+        # Final weight if the shot were stopped now #
+        return self.last + max(self.rate(), 0.0)*self.delay
+
+def stopDelay(columns):
+    # Learned delay (s) from one log ({column name: array}), None if it can't be fitted #
+    # The stop is the last sample with flow to the group.  From fit_window
+    # before it, the weight rises at a fitted rate up to a knee, delay after
+    # the stop, then stays level.  With the noise in the changes, the least
+    # squares knee is the sample j after the stop that maximizes
+    # (w[j] - w[start])^2/(t[j] - t[start]), and the rate is that slope.
+    # The weight has to be level for the last settle_time of the log
+    if(not all(n in columns for n in ('time', 'weight', 'flow_dir'))):
+        return None
+    t = columns['time']
+    w = columns['weight']
+    group = np.flatnonzero(columns['flow_dir'] == 1)
+    if(len(group) == 0):
+        return None
+    stop = group[-1]
+    if(t[-1] - t[stop] < settle_time):
+        return None
+    start = np.searchsorted(t, t[stop] - fit_window, side = 'right')
+    if(stop - start < 2):
+        return None
+    last = np.searchsorted(t, t[-1] - settle_time, side = 'right')     # knees up to, not including
+    rise = w[stop:last] - w[start]
+    span = t[stop:last] - t[start]
+    knee = stop + int(np.argmax(rise*rise/span))
+    rate = (w[knee] - w[start])/(t[knee] - t[start])
+    if(rate < min_fit_rate):
+        return None
+    final = np.median(w[t >= t[-1] - settle_time])
+    if(not (0 < final < max_fit_weight)):
+        return None
+    delay = t[knee] - t[stop]
+    return float(delay) if delay <= max_stop_delay else None
+
+def learnedDelay(delays):
+    # Stop delay from the fits of several logs, None until there are min_fits #
+    if(len(delays) < min_fits):
+        return None
+    return float(np.median(delays))
+
+class fixedStopDelay():
+    # Stop delay that isn't learned, same interface as stopDelayModel #
+    def __init__(self, delay = default_stop_delay):
+        self.value = delay
+    def delay(self):
+        return self.value
+    def refit(self, wait = False):
+        pass
+
+class stopDelayModel():
+    # Learned stop delay, refitted from the catalog in the background #
+    # refit() indexes the logs saved since the newest one the catalog had
+    # when the model was made (or since then, for a new catalog), then takes
+    # the median stop_delay of the recent_fits newest fitted ones, at most
+    # once every refit_interval.  It runs while the IO thread does, so older
+    # logs it never parses in bulk: run espressoCatalog.py to index an
+    # archive.  delay() never waits for it
+    def __init__(self, directory = logdir, default = default_stop_delay):
+        self.directory = directory
+        self.default = default
+        self.learned = None
+        self.fits = 0
+        self.since = None       # logs modified before this are left to espressoCatalog.py
+        self.lock = threading.Lock()
+        self.thread = None
+        self.t_refit = None
+
+    def delay(self):
+        return self.learned if self.learned is not None else self.default
+
+    def refit(self, wait = False):
+        with self.lock:
+            now = time.monotonic()
+            if((self.t_refit is None) or (wait and not self.thread.is_alive()) or (now - self.t_refit >= refit_interval)):
+                self.t_refit = now
+                self.thread = threading.Thread(target = self._refit)
+                self.thread.daemon = True
+                self.thread.start()
+            thread = self.thread
+        if(wait):
+            thread.join()
+
+    def _refit(self):
+        from espressoCatalog import shotCatalog
+        try:
+            catalog = shotCatalog(self.directory)
+            if(self.since is None):
+                newest = catalog.lastModified()
+                self.since = newest if newest is not None else time.time()
+            catalog.update(since = self.since)
+            rows = catalog.query('stop_delay is not null', order_by = 'start_time desc limit %d'%recent_fits)
+            catalog.close()
+        except Exception as e:
+            print('Stop delay fit failed: ', e)
+            return
+        self.fits = len(rows)
+        learned = learnedDelay([r['stop_delay'] for r in rows])
+        if(learned is not None):
+            self.learned = learned
@@ -0,0 +1,301 @@
+### Espresso Machine Shot Profiles ###
+# A shot is declared as a list of shotPhases, each with:
+#   - pump: 'off', 'pressure' or 'flow' control, and its setpoint: a constant,
+#     or a list of (time into the phase (s), value) points
+#   - water_temp, group_temp: constants or points like the setpoint.  None
+#     keeps the previous phase's
+#   - flow_dir, tare (sent every tick of the phase), log (enable or disable
+#     logging on entry) and clear_log (on entry)
+#   - exit conditions on time, pressure, weight and temperatures (both within
+#     temp_tol of their commands), any one of which ends the phase
+# shotProfile compiles the phases once into tables of command vectors, one
+# every table_dt seconds, interpolated linearly or with a cubic spline between
+# the points.  So running a profile each sample is one table lookup and a few
+# comparisons, however the setpoints were declared, and the commands are only
+# written when the table row changes.
+
+from espressoMachine import *
+
+pump_types = {'off':0, 'pressure':1, 'flow':2}
+table_dt = 1e-3         # setpoint table resolution (s)
+table_rate = 1.0/table_dt
+
+class shotPhase():
+    def __init__(self, name, pump = 'flow', setpoint = 0.0, water_temp = None, group_temp = None,
+                 flow_dir = 1, interp = 'linear', tare = False, log = None, clear_log = False,
+                 max_time = None, exit_pressure = None, exit_weight = None, temp_tol = None):
+        self.name = name
+        self.pump = pump
+        self.setpoint = setpoint
+        self.water_temp = water_temp
+        self.group_temp = group_temp
+        self.flow_dir = flow_dir
+        self.interp = interp            # 'linear' or 'spline'
+        self.tare = tare
+        self.log = log
+        self.clear_log = clear_log
+        self.max_time = max_time
+        self.exit_pressure = exit_pressure
+        self.exit_weight = exit_weight
+        self.temp_tol = temp_tol
+
+def pointsSpan(points):
+    # Time of the last point of a setpoint, 0 for a constant #
+    return 0.0 if np.isscalar(points) else float(np.asarray(points, dtype = float)[-1, 0])
+
+def setpointTable(points, interp, n):
+    # Sample a setpoint (a constant, or [(t, value), ...]) at n steps of table_dt #
+    if(np.isscalar(points)):
+        return np.full(n, float(points))
+    points = np.asarray(points, dtype = float)
+    t = np.arange(n)*table_dt
+    if((interp == 'spline') and (len(points) > 2)):
+        from scipy.interpolate import CubicSpline      # slow to import, only spline profiles need it
+        spline = CubicSpline(points[:, 0], points[:, 1], bc_type = 'clamped')
+        return spline(np.clip(t, points[0, 0], points[-1, 0]))
+    return np.interp(t, points[:, 0], points[:, 1])
+
+class compiledPhase():
+    # A shotPhase as a table of command vectors and a list of exit checks #
+    def __init__(self, phase, water_temp, group_temp):
+        self.name = phase.name
+        self.tare = phase.tare
+        self.log = phase.log
+        self.clear_log = phase.clear_log
+        span = max(pointsSpan(phase.setpoint), pointsSpan(water_temp), pointsSpan(group_temp),
+                   phase.max_time if phase.max_time is not None else 0.0)
+        n = int(np.ceil(span/table_dt)) + 1
+        self.table = np.zeros((n, 6))       # cmd_vec for each step of table_dt
+        self.table[:, 0] = setpointTable(phase.setpoint, phase.interp, n)
+        self.table[:, 1] = setpointTable(water_temp, phase.interp, n)
+        self.table[:, 2] = setpointTable(group_temp, phase.interp, n)
+        self.table[:, 3] = pump_types[phase.pump]
+        self.table[:, 4] = phase.flow_dir
+        self.table[:, 5] = 1 if phase.tare else 0
+        # Runs of identical rows share one row object, so run() can tell when #
+        # the commands actually change
+        self.rows = [self.table[0]]
+        for i in range(1, n):
+            self.rows.append(self.rows[-1] if np.array_equal(self.table[i], self.table[i-1]) else self.table[i])
+        self.last = n - 1
+        self.max_time = phase.max_time if phase.max_time is not None else np.inf
+        self.exits = []                     # (state_vec index, threshold) pairs, exit when above
+        if(phase.exit_pressure is not None):
+            self.exits.append((1, phase.exit_pressure))
+        if(phase.exit_weight is not None):
+            self.exits.append((9, phase.exit_weight))
+        self.temp_tol = phase.temp_tol
+        self.check_temps = phase.temp_tol is not None
+
+    def tempsReached(self, s, row):
+        # Water and group temps within temp_tol of their commands in row #
+        return (abs(s[3] - row[1]) < self.temp_tol) and (abs(s[5] - row[2]) < self.temp_tol)
+
+class shotProfile():
+    # A list of shotPhases, compiled #
+    def __init__(self, phases):
+        self.phases = []
+        water_temp = 0.0
+        group_temp = 0.0
+        for phase in phases:
+            if(phase.water_temp is not None):
+                water_temp = phase.water_temp
+            if(phase.group_temp is not None):
+                group_temp = phase.group_temp
+            self.phases.append(compiledPhase(phase, water_temp, group_temp))
+            # Following phases hold where this one ended #
+            water_temp = self.phases[-1].table[-1, 1]
+            group_temp = self.phases[-1].table[-1, 2]
+
+    def __len__(self):
+        return len(self.phases)
+
+class profileMode():
+    # Runs a shotProfile, one table lookup per sample #
+    # Phase times are in machine time (em.state.time()).  When the last phase
+    # exits the pump is turned off, the flow valve returned to the tank and
+    # logging stopped, with the temperature commands left as they were
+    def __init__(self, profile, title = None):
+        if(title is not None):
+            self.title = title
+        self.profile = profile
+        self.started = False
+        self.done = False
+        self.index = 0
+        self.t_phase = None
+        self.phase_data = None  # compiledPhase being run
+        self.written = None     # table row last copied to em.cmd
+
+    def run(self, em, ui):
+        if((not self.started) or self.done):
+            return
+        s = em.state.state_vec
+        t = float(s[0])
+        if(self.t_phase is None):
+            self.enter(em, t)
+        p = self.phase_data
+        dt = t - self.t_phase
+        if(p.last == 0):
+            row = p.rows[0]
+        else:
+            i = int(dt*table_rate)
+            row = p.rows[i if 0 <= i <= p.last else (p.last if i > 0 else 0)]
+        # Exit checks, inline since this runs every sample #
+        leave = dt >= p.max_time
+        for j, threshold in p.exits:
+            if(s[j] >= threshold):
+                leave = True
+        if(p.check_temps and p.tempsReached(s, row)):
+            leave = True
+        if(leave):
+            self.index += 1
+            if(self.index == len(self.profile)):
+                self.finish(em)
+                return
+            self.enter(em, t)
+            p = self.phase_data
+            row = p.rows[0]
+        # Commands only change when the table row does, apart from tare, #
+        # which publishCommands clears every time
+        if(row is not self.written):
+            np.copyto(em.cmd.cmd_vec, row)
+            self.written = row
+        elif(p.tare):
+            em.cmd.cmd_vec[5] = 1
+
+    def enter(self, em, t):
+        p = self.profile.phases[self.index]
+        self.phase_data = p
+        self.t_phase = t
+        if(p.log is not None):
+            em.log_enabled = p.log
+        if(p.clear_log):
+            em.clearLog()
+
+    def finish(self, em):
+        em.cmd.setPumpCmd(0)
+        em.cmd.setPumpCmdType(0)
+        em.cmd.setFlowDir(0)
+        em.cmd.tare(0)
+        em.log_enabled = False
+        self.done = True
+        self.started = False
+
+    def phase(self):
+        # Name of the phase being run #
+        return self.profile.phases[self.index].name if self.started else None
+
+    def start(self):
+        self.index = 0
+        self.t_phase = None
+        self.written = None
+        self.done = False
+        self.started = True
+
+    def stop(self, em):
+        em.cmd.clear()
+        em.log_enabled = False
+        self.written = None
+
+    def exit(self, em):
+        em.cmd.clear()
+        self.written = None
+        return True
+
+done_cmd_cols = [0, 3, 4, 5]        # commands zeroed once a machine is done
+
+class batchProfile():
+    # Evaluates a shotProfile for n machines at once, as array operations #
+    # The phase tables are stacked into one, so each step is one gather of
+    # command rows and one vectorized pass over the exit checks, however many
+    # machines there are.  Same phase logic as profileMode, minus logging
+    def __init__(self, profile, n):
+        self.profile = profile
+        self.n = n
+        phases = profile.phases
+        self.n_phases = len(phases)
+        self.table = np.vstack([p.table for p in phases])
+        self.offsets = np.cumsum([0] + [len(p.table) for p in phases[:-1]])
+        self.last = np.array([p.last for p in phases])
+        self.max_time = np.array([p.max_time for p in phases], dtype = float)
+        self.exit_pressure = np.array([dict(p.exits).get(1, np.inf) for p in phases], dtype = float)
+        self.exit_weight = np.array([dict(p.exits).get(9, np.inf) for p in phases], dtype = float)
+        self.temp_tol = np.array([p.temp_tol if p.check_temps else -1.0 for p in phases], dtype = float)
+        self.machines = np.arange(n)
+        self.start(0.0)
+
+    def start(self, t):
+        self.phase = np.zeros(self.n, dtype = int)
+        self.t_phase = np.full(self.n, float(t))
+        self.t_enter = np.full((self.n, self.n_phases + 1), np.nan)    # entry time of each phase, then of done
+        self.t_enter[:, 0] = t
+        self.done = np.zeros(self.n, dtype = bool)
+        self._phasesChanged()
+
+    def keep(self, machines):
+        # Drop all but machines (a boolean mask or indices) #
+        self.phase = self.phase[machines]
+        self.t_phase = self.t_phase[machines]
+        self.t_enter = self.t_enter[machines]
+        self.done = self.done[machines]
+        self.n = len(self.phase)
+        self.machines = np.arange(self.n)
+        self._phasesChanged()
+
+    def _phasesChanged(self):
+        # Each machine's phase constants, looked up again only when a phase changes #
+        k = np.minimum(self.phase, self.n_phases - 1)
+        self.k = k
+        self.offset = self.offsets[k]
+        self.row_last = self.last[k]
+        self.phase_max_time = self.max_time[k]
+        self.phase_exit_pressure = self.exit_pressure[k]
+        self.phase_exit_weight = self.exit_weight[k]
+        self.phase_temp_tol = self.temp_tol[k]
+        self.check_temps = (self.phase_temp_tol >= 0).any()
+        self.done_rows = np.flatnonzero(self.done)
+
+    def run(self, state, cmd, t):
+        # Fill cmd (n, 6) from state (n, 13) at time t #
+        dt = t - self.t_phase
+        i = (dt*table_rate).astype(int)
+        np.minimum(i, self.row_last, out = i)
+        i += self.offset
+        rows = self.table[i]
+        leave = (dt >= self.phase_max_time)
+        leave |= (state[:, 1] >= self.phase_exit_pressure)
+        leave |= (state[:, 9] >= self.phase_exit_weight)
+        if(self.check_temps):
+            tol = self.phase_temp_tol
+            leave |= ((np.abs(state[:, 3] - rows[:, 1]) < tol) & (np.abs(state[:, 5] - rows[:, 2]) < tol))
+        leave &= ~self.done
+        if(leave.any()):
+            self.phase[leave] += 1
+            self.t_phase[leave] = t
+            self.t_enter[self.machines[leave], self.phase[leave]] = t
+            self.done |= (self.phase == self.n_phases)
+            moved = leave & ~self.done
+            rows[moved] = self.table[self.offsets[self.phase[moved]]]
+            self._phasesChanged()
+        cmd[:] = rows
+        if(len(self.done_rows)):
+            # Pump off, flow to tank, temperatures held #
+            cmd[np.ix_(self.done_rows, done_cmd_cols)] = 0
+
+### Profiles ###
+
+# nineBarShot, as a profile #
+nine_bar = [
+    shotPhase('preheat', pump = 'flow', setpoint = 2.0, water_temp = 88.0, group_temp = 88.0, flow_dir = 0,
+              tare = True, clear_log = True, temp_tol = 1.0),
+    shotPhase('purge', pump = 'flow', setpoint = 2.0, flow_dir = 2, tare = True, max_time = 1.0, exit_pressure = 6.0),
+    shotPhase('preinfuse', pump = 'flow', setpoint = 2.0, flow_dir = 1, tare = True, log = True, exit_pressure = 6.0),
+    shotPhase('shot', pump = 'pressure', setpoint = 6.0, flow_dir = 1, exit_weight = 32.0),
+    shotPhase('bleed', pump = 'flow', setpoint = 0.0, flow_dir = 2, max_time = 2.0),     # still logged, see nineBarShot.end
+    ]
+nine_bar_profile = shotProfile(nine_bar)
+
+class nineBarProfile(profileMode):
+    title = 'Nine Bar - Profile'
+    def __init__(self):
+        profileMode.__init__(self, nine_bar_profile)
@@ -0,0 +1,86 @@
+### Espresso Machine Mode Registry ###
+# Finds modes without importing or instantiating them.
+#   - A mode is any top level class with a class level title = '...' string,
+#     in one of the source modules or a .py file in the plugin directory
+#   - Sources are found by parsing their files with ast, which gives a
+#     title -> (module, class name) index in source order
+#   - A mode's module is imported the first time the mode is asked for, and
+#     its class is cached from then on
+
+import ast
+import os
+import importlib
+import importlib.util
+
+# extraModes (the temperature Bode plot) drives the heaters well past their
+# normal range, so it isn't listed.  Pass it in sources to use it.
+mode_sources = ('espressoModes', 'espressoProfiles')
+plugin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plugins')
+
+def classTitles(filename):
+    # (class name, title) for each top level class with a class level title string #
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read(), filename)
+    titles = []
+    for node in tree.body:
+        if(not isinstance(node, ast.ClassDef)):
+            continue
+        for item in node.body:
+            if(isinstance(item, ast.Assign) and (len(item.targets) == 1) and isinstance(item.targets[0], ast.Name)
+               and (item.targets[0].id == 'title') and isinstance(item.value, ast.Constant)
+               and isinstance(item.value.value, str)):
+                titles.append((node.name, item.value.value))
+                break
+    return titles
+
+class modeRegistry():
+    def __init__(self, sources = mode_sources, plugins = plugin_dir):
+        self.index = {}         # title -> (module name, file name, class name)
+        self.classes = {}       # title -> class, once imported
+        self.plugins = {}       # plugin module name -> module, once imported
+        for module in sources:
+            spec = importlib.util.find_spec(module)
+            if((spec is None) or (spec.origin is None)):
+                print('Mode source not found: ', module)
+                continue
+            self._add(module, spec.origin)
+        if((plugins is not None) and os.path.isdir(plugins)):
+            for filename in sorted(os.listdir(plugins)):
+                if(filename.endswith('.py') and not filename.startswith('_')):
+                    self._add('plugins.' + filename[:-3], os.path.join(plugins, filename))
+
+    def _add(self, module, filename):
+        for name, title in classTitles(filename):
+            if(title not in self.index):
+                self.index[title] = (module, filename, name)
+
+    def titles(self):
+        return list(self.index)
+
+    def __contains__(self, title):
+        return title in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, title):
+        # Mode class for title, importing its module the first time #
+        mode = self.classes.get(title)
+        if(mode is None):
+            module, filename, name = self.index[title]
+            mode = getattr(self._import(module, filename), name)
+            self.classes[title] = mode
+        return mode
+
+    def get(self, title, default = None):
+        return self[title] if title in self.index else default
+
+    def _import(self, module, filename):
+        if(not module.startswith('plugins.')):
+            return importlib.import_module(module)
+        if(module not in self.plugins):
+            spec = importlib.util.spec_from_file_location(module, filename)
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            self.plugins[module] = plugin
+        return self.plugins[module]
@@ -0,0 +1,93 @@
+### Espresso Machine Loop Scheduler ###
+# Paces a loop at a fixed rate and measures how well it holds it.
+#   - Deadlines are on a fixed grid (t0 + k*period), so timing errors don't
+#     accumulate into drift
+#   - Waits sleep until just before the deadline and spin the rest of the way,
+#     since time.sleep alone overshoots by tens of microseconds or more.  The
+#     spin is only as long as sleeps have recently been overshooting (up to
+#     max_spin), so the loop doesn't burn a core busy-waiting
+#   - An iteration that runs past its deadline counts as a missed deadline.
+#     overrun = 'skip' moves on to the next grid point still in the future,
+#     overrun = 'catchup' runs the late iterations back to back
+#   - With rate = None the loop free-runs (e.g. paced by a blocking USB read)
+#     and only the statistics are kept
+
+from espressoStats import *
+import time
+
+class periodicScheduler():
+    def __init__(self, rate = None, overrun = 'skip', spin = 5e-5, max_spin = 1e-3):
+        self.overrun = overrun
+        self.spin = spin                    # busy-wait this long before each deadline (s), adapted to the sleep overshoot
+        self.max_spin = max_spin
+        self.setRate(rate)
+
+    def setRate(self, rate):
+        self.rate = rate
+        self.period = 1.0/rate if rate else None
+        self.deadline = None
+        self.overshoot = 0.0                    # average time.sleep overshoot (s)
+        self.period_hist = latencyHistogram()   # time between loop wakeups
+        self.jitter_hist = latencyHistogram()   # wakeup time - deadline
+        self.reset()
+
+    def reset(self):
+        # Clear the statistics, can be called from any thread #
+        self.period_hist.reset()
+        self.jitter_hist.reset()
+        self.iterations = 0
+        self.missed = 0
+        self.t_first = None
+        self.t_last = None
+
+    def wait(self):
+        # Call once per loop iteration.  Blocks until the next deadline #
+        now = time.perf_counter()
+        if(self.deadline is None):
+            self.deadline = now
+        elif(self.period is not None):
+            self.deadline += self.period
+            if(now > self.deadline):
+                if(self.overrun == 'skip'):
+                    late = int((now - self.deadline)/self.period) + 1
+                    self.missed += late
+                    self.deadline += late*self.period
+                else:
+                    self.missed += 1
+            if(now < self.deadline):
+                if(self.deadline - now > self.spin):
+                    wake = self.deadline - self.spin
+                    time.sleep(wake - now)
+                    # Spin about 1.5x the typical overshoot, tracked as a running average #
+                    over = time.perf_counter() - wake
+                    self.overshoot += .05*(over - self.overshoot)
+                    self.spin = min(max(1.5*self.overshoot, 1e-5), self.max_spin)
+                while(time.perf_counter() < self.deadline):
+                    pass
+            now = time.perf_counter()
+            self.jitter_hist.record(abs(now - self.deadline))
+        else:
+            self.deadline = now
+        if(self.t_last is not None):
+            self.period_hist.record(now - self.t_last)
+        else:
+            self.t_first = now
+        self.t_last = now
+        self.iterations += 1
+
+    def stats(self):
+        elapsed = (self.t_last - self.t_first) if self.iterations > 1 else 0.0
+        period = self.period_hist.summary()
+        jitter = self.jitter_hist.summary()
+        return {
+            'target_rate': self.rate,
+            'rate': (self.iterations - 1)/elapsed if elapsed > 0 else 0.0,
+            'iterations': self.iterations,
+            'missed_deadlines': self.missed,
+            'period_p50': period['p50'],
+            'period_p99': period['p99'],
+            'period_max': period['max'],
+            'jitter_p50': jitter['p50'],
+            'jitter_p99': jitter['p99'],
+            'jitter_max': jitter['max'],
+            }
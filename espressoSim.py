@@ -0,0 +1,292 @@
+### Espresso Machine Headless Simulator ###
+# Runs a mode on fakeEspressoMachine as fast as the CPU allows:
+#   - The machine is timestamped from a simClock, which the loop advances by
+#     one IO period per step instead of waiting for it
+#   - Each step is one machine.ioStep() then one fsm.step(), the same order
+#     as the IO and FSM threads, just without the threads, so the machine
+#     runs singleThread() and the stage timers are off
+#   - The log is saved in the same .eslog format as saveLog
+# batchShotSimulator runs a profile on many simulated machines at once, each
+# with its own puck resistance and noise, as (n, 12) array operations.
+# Usage:
+#   python espressoSim.py "Nine Bar - Flow Preinfusion" -p shot_weight=36 -o logs/sim.eslog
+# Modes are looked up by title or class name, -p sets attributes on the mode.
+
+from espressoFSM import *
+from espressoModes import *
+from espressoProfiles import *
+import argparse
+
+class simClock():
+    # Simulated clock, only moves when advanced #
+    def __init__(self, t = 0.0):
+        self.t = t
+    def time(self):
+        return self.t
+    def advance(self, dt):
+        self.t += dt
+
+class shotSimulator():
+    def __init__(self, mode, params = None, rate = fake_io_rate, seed = None, log_all = False):
+        self.clock = simClock(time.time())
+        self.machine = fakeEspressoMachine(rate, clock = self.clock)
+        self.machine.singleThread()
+        self.fsm = espressoFSM(self.machine)
+        self.fsm.run_timer = null_timer
+        self.period = 1.0/rate
+        self.log_all = log_all              # log every step, not just when the mode enables it
+        self.steps = 0
+        if(seed is not None):
+            np.random.seed(seed)
+        mode_class = self.fsm.mode_list.get(mode)
+        if(mode_class is None):
+            mode_class = findMode(self.fsm.mode_list, mode)
+        self.fsm.transition(self.machine, mode_class)
+        for name, value in (params or {}).items():
+            if(not hasattr(self.fsm.active_mode, name)):
+                raise AttributeError('%s has no parameter %s'%(mode_class.__name__, name))
+            setattr(self.fsm.active_mode, name, value)
+
+    def step(self):
+        self.clock.advance(self.period)
+        if(self.log_all):
+            self.machine.log_enabled = True
+        self.machine.ioStep()
+        self.fsm.step()
+        self.steps += 1
+
+    def run(self, max_time = 120.0):
+        # Run the mode until it is done, or for max_time simulated seconds #
+        self.fsm.start_mode()
+        self.fsm.mode_running = True
+        mode = self.fsm.active_mode
+        max_steps = int(max_time/self.period)
+        while(self.steps < max_steps):
+            self.step()
+            if(getattr(mode, 'done', False)):
+                break
+        self.fsm.mode_running = False
+        self.fsm.step()
+        return self.steps*self.period
+
+    def save(self, filename):
+        writeLogFile(filename, self.machine.log, log_columns)
+
+temp_cmd_cols = [1, 1, 2]                   # command of each of state 3-5
+temp_alpha = np.array([.06, .1, .1])
+
+class batchFakeMachine():
+    # n fakeEspressoMachines stepped together #
+    # Same model as fakeEspressoMachine.sample, on an (n, 13) state array and
+    # (n, 6) commands, both stored column major so each field is contiguous.
+    # Each machine has its own puck resistance (the group side resistance, 5
+    # in fakeEspressoMachine) and noise seed.  Noise is drawn from each
+    # machine's generators, in float32, for chunk_values values at a time.
+    # Normal and uniform noise come from separate generators, so a machine
+    # sees the same noise whatever the chunk size, i.e. in any size batch
+    def __init__(self, n, resistance = 5.0, seeds = None, noise = .01, chunk_values = 4000000):
+        self.n = n
+        self.resistance = np.broadcast_to(np.asarray(resistance, dtype = float), (n,)).copy()
+        seeds = seeds if seeds is not None else np.arange(n)
+        self.generators = [[np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(2)] for seed in seeds]
+        self.noise = noise
+        self.chunk_steps = max(chunk_values//(11*n), 1)
+        self.state = np.zeros((n, 13), order = 'F')
+        self.cmd = np.zeros((n, 6), order = 'F')
+        self.chunk = np.zeros((self.chunk_steps, n, 11), dtype = np.float32)   # contiguous per step
+        self.chunk_step = self.chunk_steps
+
+    def _noise(self):
+        # Next step's noise: (n, 10) normal for state 1-10, (n,) uniform for pump torque #
+        if(self.chunk_step == self.chunk_steps):
+            for i, (normal, uniform) in enumerate(self.generators):
+                self.chunk[:, i, 0:10] = normal.standard_normal((self.chunk_steps, 10), dtype = np.float32)
+                self.chunk[:, i, 10] = uniform.random(self.chunk_steps, dtype = np.float32)
+            self.chunk_step = 0
+        noise = self.chunk[self.chunk_step]
+        self.chunk_step += 1
+        return noise[:, 0:10], noise[:, 10]
+
+    def start(self, t):
+        self.state[:] = 0
+        self.state[:, 0] = t
+        self.cmd[:] = 0
+        self._modesChanged()
+
+    def keep(self, machines):
+        # Drop all but machines (a boolean mask or indices) #
+        self.resistance = self.resistance[machines]
+        self.generators = [self.generators[i] for i in np.arange(self.n)[machines]]
+        self.state = np.asfortranarray(self.state[machines])
+        self.cmd = np.asfortranarray(self.cmd[machines])
+        self.chunk = np.ascontiguousarray(self.chunk[:, machines])
+        self.n = self.state.shape[0]
+        self._modesChanged()
+
+    def _modesChanged(self):
+        # Per machine coefficients of the pump type, flow direction and tare commands #
+        # These only change between profile phases, so they are worked out again
+        # when the commands do, instead of every step.  The pressure or flow
+        # being controlled, x, follows the pump command, then
+        #   pressure = gain_p*x + hold*pressure,  flow = gain_f*x + hold*flow
+        c = self.cmd
+        self.modes = c[:, 3:6].copy()
+        pressure_control = (c[:, 3] == 1)
+        flow_control = (c[:, 3] == 2)
+        other = (c[:, 3] > 2)                           # not simulated, left as they were
+        self.to_group = (c[:, 4] == 1)
+        r = np.where(self.to_group, self.resistance, .01)     # fluid resistance vs flow direction
+        self.select_p = pressure_control.astype(float)
+        self.select_f = flow_control.astype(float)
+        self.drive = .2*(pressure_control | flow_control)      # alpha3 where the pump is controlled
+        self.gain_p = pressure_control + flow_control*r
+        self.gain_f = pressure_control/r + flow_control
+        self.hold = other.astype(float)
+        self.tare = np.flatnonzero(c[:, 5] != 0)
+
+    def sample(self, t):
+        tm_g = 200
+        tm_h = 200
+        s = self.state
+        c = self.cmd
+        if((c[:, 3:6] != self.modes).any()):
+            self._modesChanged()
+        normal, uniform = self._noise()
+        pressure, flow, water_temp, group_temp = s[:, 1], s[:, 2], s[:, 3], s[:, 5]
+        dt = t - s[0, 0]        # one clock for all machines
+        s[:, 0] = t
+        s[:, 12] = t
+
+        x = pressure*self.select_p
+        x += flow*self.select_f
+        x *= .8
+        x += self.drive*c[:, 0]
+        pressure *= self.hold
+        pressure += self.gain_p*x
+        flow *= self.hold
+        flow += self.gain_f*x
+        # Water, heater and group temps step alpha2, alpha, alpha of the way to their commands #
+        step = c[:, temp_cmd_cols] - s[:, 3:6]
+        step *= temp_alpha
+        s[:, 3:6] += step
+        np.multiply(flow, 2*np.pi/.33, out = s[:, 6])
+        np.multiply(pressure, .33/(10*2*np.pi), out = s[:, 7])
+        np.multiply(uniform, 1e-3, out = s[:, 8])
+        s[:, 8] += s[:, 7] - .5e-3
+        s[:, 9] += (dt*flow)*self.to_group
+        np.multiply(group_temp, .02, out = s[:, 10])
+        s[:, 10] += step[:, 2]*(tm_g/dt)
+        np.multiply(flow, water_temp*4.2, out = s[:, 11])
+        s[:, 11] += step[:, 1]*(tm_h/dt)
+
+        s[:, 1:11] += self.noise*normal
+        if(len(self.tare)):
+            s[self.tare, 9] = 0
+
+class batchShotSimulator():
+    # Runs a shotProfile on n batchFakeMachines, for Monte Carlo runs #
+    # Finished machines are dropped from the batch every time an eighth of it
+    # has finished, so a few long shots don't keep the rest stepping.  Per
+    # machine results: the time each phase was entered (and the shot
+    # finished), peak pressure in each phase, and weight when finished
+    def __init__(self, profile, n, resistance = 5.0, seeds = None, rate = fake_io_rate, noise = .01):
+        self.machine = batchFakeMachine(n, resistance, seeds, noise)
+        self.profile = batchProfile(profile, n)
+        self.period = 1.0/rate
+        self.n = n
+        self.steps = 0
+
+    def run(self, max_time = 120.0, t0 = 0.0):
+        # Run until every machine is done, or for max_time simulated seconds #
+        machine = self.machine
+        profile = self.profile
+        n_phases = profile.n_phases
+        resistance = machine.resistance.copy()
+        t_enter = np.full((self.n, n_phases + 1), np.nan)
+        peak_pressure = np.full((self.n, n_phases), np.nan)
+        final_weight = np.full(self.n, np.nan)
+        index = np.arange(self.n)                       # machine number of each row still running
+        rows = np.arange(self.n)
+        peak = np.full((self.n, n_phases), np.nan)      # peak_pressure of the rows still running
+        weight = np.full(self.n, np.nan)                # final_weight of the rows still running
+        n_done = 0
+        machine.start(t0)
+        profile.start(t0)
+        self.steps = 0
+        max_steps = int(max_time/self.period)
+        while((self.steps < max_steps) and (len(index) > 0)):
+            t = t0 + (self.steps + 1)*self.period
+            machine.sample(t)
+            k = profile.k
+            peak[rows, k] = np.fmax(peak[rows, k], machine.state[:, 1])
+            profile.run(machine.state, machine.cmd, t)
+            self.steps += 1
+            if(len(profile.done_rows) == n_done):
+                continue
+            # Weight on the step each machine finished, as shotSimulator sees it #
+            finished = profile.done
+            new = profile.done_rows[np.isnan(weight[profile.done_rows])]
+            weight[new] = machine.state[new, 9]
+            n_done = len(profile.done_rows)
+            if(n_done >= max(len(index)//8, 1)):
+                final_weight[index[finished]] = weight[finished]
+                t_enter[index[finished]] = profile.t_enter[finished]
+                peak_pressure[index[finished]] = peak[finished]
+                running = ~finished
+                machine.keep(running)
+                profile.keep(running)
+                peak = peak[running]
+                weight = weight[running]
+                index = index[running]
+                rows = np.arange(len(index))
+                n_done = 0
+        # Rows still in the batch: finished since the last drop, or out of time #
+        final_weight[index] = weight
+        t_enter[index] = profile.t_enter
+        peak_pressure[index] = peak
+        return {
+            't_enter': t_enter - t0,
+            'done': ~np.isnan(t_enter[:, -1]),
+            'shot_time': t_enter[:, -1] - t0,
+            'peak_pressure': peak_pressure,
+            'final_weight': final_weight,
+            'resistance': resistance,
+            }
+
+def findMode(registry, name):
+    # Mode class by class name, for names that aren't titles #
+    for title in registry.titles():
+        if(registry.index[title][2] == name):
+            return registry[title]
+    raise KeyError('no mode %s, modes are: %s'%(name, ', '.join(registry.titles())))
+
+def parseParam(text):
+    name, value = text.split('=', 1)
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return name, value
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Simulate a mode on fakeEspressoMachine, faster than real time')
+    parser.add_argument('mode', help = 'mode title or class name')
+    parser.add_argument('-p', '--param', action = 'append', default = [], help = 'mode attribute, name=value')
+    parser.add_argument('-t', '--max-time', type = float, default = 120.0, help = 'simulated seconds to stop after')
+    parser.add_argument('-r', '--rate', type = float, default = fake_io_rate, help = 'IO rate (Hz)')
+    parser.add_argument('-s', '--seed', type = int, default = None, help = 'noise seed')
+    parser.add_argument('-a', '--log-all', action = 'store_true', help = 'log every sample')
+    parser.add_argument('-o', '--output', default = None, help = 'log file (default: logs/sim-<time>.eslog)')
+    args = parser.parse_args()
+
+    sim = shotSimulator(args.mode, dict(parseParam(p) for p in args.param), args.rate, args.seed, args.log_all)
+    t1 = time.perf_counter()
+    sim_time = sim.run(args.max_time)
+    t2 = time.perf_counter()
+    filename = args.output or logdir + 'sim-' + time.strftime("%Y%m%d-%H%M%S") + log_ext
+    sim.save(filename)
+    print('%s: %.1f s simulated in %.2f s (%.0fx real time), %d log rows -> %s'%(
+        sim.fsm.active_mode.title, sim_time, t2 - t1, sim_time/(t2 - t1), len(sim.machine.log_buffer), filename))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+### Espresso Machine Snapshots ###
+# Single-writer, many-reader snapshot of a small array, without locks.
+#   - Double buffered: publish() writes the inactive slot, then flips to it
+#     by bumping a sequence number (odd while a write is in progress)
+#   - read() copies the active slot and checks the sequence number after: if
+#     the writer has started on the slot being copied (more than one publish
+#     since the read began) the copy may be torn and is retried
+# The writer never waits on readers, and readers only retry if they are
+# preempted for longer than a whole publish period.
+
+import numpy as np
+
+class snapshotBuffer():
+    def __init__(self, shape):
+        self.slots = [np.zeros(shape), np.zeros(shape)]
+        self.seq = 0            # even: slot (seq//2)%2 is current.  odd: write in progress
+        self.retries = 0        # reads that had to be retried
+
+    def publish(self, values):
+        # Writer: store a new snapshot.  Only one thread may publish #
+        self.seq += 1
+        np.copyto(self.slots[((self.seq + 1)//2) % 2], values)
+        self.seq += 1
+
+    def read(self, out = None):
+        # Reader: copy of the latest complete snapshot #
+        if(out is None):
+            out = np.empty_like(self.slots[0])
+        while(True):
+            seq = self.seq
+            np.copyto(out, self.slots[(seq//2) % 2])
+            if(self.seq - (seq & ~1) <= 2):
+                return out
+            self.retries += 1
@@ -0,0 +1,190 @@
+### Espresso Machine Timing Statistics ###
+# HDR-style latency histogram: log-linear buckets, so every recorded value
+# is kept to within 1/64 (~1.5%) of its size from 1 us up to ~100 s, in a
+# fixed ~1.5k bucket array.  Recording is O(1) and never allocates.  Counts
+# are a plain list, since record() is called in the IO loop and a python int
+# increment is several times cheaper than a numpy element's.
+#
+# stage_stats keeps one histogram per named stage of the IO loop, FSM and GUI
+# (usb read, decode, sample, logState, mode run, redraw...), in rolling
+# windows, to see where the time goes when the machine feels slow.
+
+import numpy as np
+import time
+import json
+import threading
+
+class latencyHistogram():
+    def __init__(self, sub_bits = 7, unit = 1e-6, max_value = 100.0):
+        self.sub_bits = sub_bits                # 2^sub_bits linear sub-buckets per octave
+        self.sub_count = 1 << sub_bits
+        self.half = self.sub_count >> 1
+        self.unit = unit                        # smallest resolvable value (s)
+        self.scale = 1.0/unit
+        self.max_units = int(max_value/unit)
+        self.counts = [0]*(self._index(self.max_units) + 1)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = [0]*len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, v):
+        if(v < self.sub_count):
+            return v
+        e = v.bit_length() - self.sub_bits
+        return self.sub_count + (e - 1)*self.half + ((v >> e) - self.half)
+
+    def _value(self, i):
+        # Lower edge of bucket i, in units #
+        if(i < self.sub_count):
+            return i
+        e = (i - self.sub_count)//self.half + 1
+        return (((i - self.sub_count) % self.half) + self.half) << e
+
+    def record(self, value):
+        # Record one value (s), with _index inlined #
+        v = int(value*self.scale)
+        if(v < self.sub_count):
+            i = v if v > 0 else 0
+        else:
+            if(v > self.max_units):
+                v = self.max_units
+            e = v.bit_length() - self.sub_bits
+            i = self.sub_count + (e - 1)*self.half + ((v >> e) - self.half)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if((self.max is None) or (value > self.max)):
+            self.max = value
+        if((self.min is None) or (value < self.min)):
+            self.min = value
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def percentile(self, p):
+        # Value (s) below which p percent of the recorded values fall #
+        if(self.count == 0):
+            return 0.0
+        target = max(int(np.ceil(p/100.0*self.count)), 1)
+        i = int(np.searchsorted(np.cumsum(self.counts), target))
+        return min(self._value(i)*self.unit, self.max)
+
+    def buckets(self):
+        # (lower edge (s), count) for each non-empty bucket #
+        return [(self._value(i)*self.unit, c) for i, c in enumerate(self.counts) if c]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'min': self.min if self.min is not None else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max if self.max is not None else 0.0,
+            }
+
+class stageTimer():
+    # Time spent in one stage of a loop, in rolling windows #
+    #   - t = stage.stop(t_start) records perf_counter() - t_start into the
+    #     current window's histogram and returns perf_counter(), so stages
+    #     done one after another can be chained
+    #   - rotate() starts a new window.  It's called by whatever reads the
+    #     stats (see stageRegistry), never on the recording thread
+    def __init__(self, name):
+        self.name = name
+        self.enabled = True
+        self.current = latencyHistogram()
+        self.last = latencyHistogram()          # the window before current
+        self.t_window = time.perf_counter()     # start of current
+
+    def stop(self, t_start):
+        now = time.perf_counter()
+        if(self.enabled):
+            self.current.record(now - t_start)
+        return now
+
+    def rotate(self):
+        spare = self.last
+        spare.reset()
+        self.last = self.current
+        self.current = spare
+        self.t_window = time.perf_counter()
+
+    def reset(self):
+        self.current.reset()
+        self.last.reset()
+        self.t_window = time.perf_counter()
+
+    def recent(self):
+        # The last complete window, or the current one until there is one #
+        return self.last if self.last.count else self.current
+
+class nullTimer():
+    # Stands in for a stageTimer where nothing reads the stats, e.g. a simulation #
+    # stop() doesn't even read the clock, so chained stages all get t_start
+    def stop(self, t_start):
+        return t_start
+
+null_timer = nullTimer()
+
+class stageRegistry():
+    # Named stageTimers, shared by the comm, machine, FSM and GUI #
+    # summary(), report() and dump() rotate every timer's window once it is
+    # window seconds old, so they show the last window seconds or so
+    def __init__(self, window = 10.0):
+        self.window = window
+        self.enabled = True
+        self.stages = {}        # name -> stageTimer, in order of creation
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        # The timer for name, created the first time #
+        with self.lock:
+            if(name not in self.stages):
+                self.stages[name] = stageTimer(name)
+                self.stages[name].enabled = self.enabled
+            return self.stages[name]
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+        for stage in self.stages.values():
+            stage.enabled = enabled
+
+    def reset(self):
+        for stage in self.stages.values():
+            stage.reset()
+
+    def _rotate(self):
+        now = time.perf_counter()
+        for stage in list(self.stages.values()):
+            if(now - stage.t_window >= self.window):
+                stage.rotate()
+
+    def summary(self):
+        # {stage name: latencyHistogram.summary()} of each stage's recent window #
+        self._rotate()
+        return {name:stage.recent().summary() for name, stage in list(self.stages.items())}
+
+    def report(self):
+        # summary() as a text table, times in ms #
+        lines = ['%-14s %8s %8s %8s %8s %8s'%('stage', 'count', 'mean', 'p50', 'p99', 'max')]
+        for name, s in self.summary().items():
+            lines.append('%-14s %8d %8.3f %8.3f %8.3f %8.3f'%(
+                name, s['count'], 1e3*s['mean'], 1e3*s['p50'], 1e3*s['p99'], 1e3*s['max']))
+        return '\n'.join(lines)
+
+    def dump(self, filename):
+        # Write summary() and each stage's histogram buckets to a JSON file #
+        summary = self.summary()
+        stages = {name:dict(summary[name], buckets = stage.recent().buckets())
+                  for name, stage in list(self.stages.items()) if name in summary}
+        with open(filename, 'w') as f:
+            json.dump({'time': time.time(), 'window': self.window, 'stages': stages}, f, indent = 1, default = float)
+
+stage_stats = stageRegistry()   # the process wide registry
@@ -0,0 +1,126 @@
+### Espresso Machine Parameter Sweep ###
+# Runs a mode on the simulated machine for every combination of a parameter
+# grid, or for random samples of parameter ranges, across a process pool.
+#   - Each point is one shotSimulator run (see espressoSim), with the point's
+#     parameters set on the mode and every sample logged
+#   - Points are independent, so they're handed out to one worker per core
+#     and throughput scales with the number of cores
+#   - Results are written as a CSV table, one row per point: the parameters,
+#     then the shot metrics (see shotMetrics)
+# Usage:
+#   python espressoSweep.py -g pi_flow=1,2,3 -g shot_pressure=6,8,9 -o sweep.csv
+#   python espressoSweep.py -r pi_flow=1:3 -r shot_pressure=6:9 -n 200 -o sweep.csv
+# Times are from the start of preinfusion (the end of preheat).
+
+from espressoSim import *
+import os
+import csv
+import io
+import itertools
+import contextlib
+import multiprocessing
+
+sweep_mode = 'nineBarShot'
+pressure_tol = .05          # time to pressure is to within this fraction of shot_pressure
+metric_names = ['done', 'shot_time', 'time_to_pressure', 'overshoot', 'final_weight', 'yield_error']
+
+def gridPoints(grid):
+    # Every combination of {name: [values]} #
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def randomPoints(ranges, n, seed = None):
+    # n points drawn uniformly from {name: (low, high)} #
+    rng = np.random.default_rng(seed)
+    samples = {name:rng.uniform(low, high, n) for name, (low, high) in ranges.items()}
+    return [{name:float(samples[name][i]) for name in ranges} for i in range(n)]
+
+def shotMetrics(log, mode):
+    # Shot metrics from a log of every sample, for a nineBarShot-like mode #
+    #   shot_time: preinfusion start to the end of the pressure controlled shot
+    #   time_to_pressure: preinfusion start to pressure within pressure_tol of shot_pressure
+    #   overshoot: peak pressure during the shot above shot_pressure (bar)
+    #   yield_error: final weight - shot_weight (g)
+    nc = len(cmd_columns)
+    t = log[:, nc + 0]
+    pressure = log[:, nc + 1]
+    shot = np.flatnonzero(log[:, 3] == 1)            # pump in pressure control
+    metrics = dict.fromkeys(metric_names, np.nan)
+    metrics['done'] = int(getattr(mode, 'done', False))
+    if(len(log) == 0):
+        return metrics
+    reached = np.flatnonzero(pressure >= (1 - pressure_tol)*mode.shot_pressure)
+    if(len(reached) > 0):
+        metrics['time_to_pressure'] = t[reached[0]] - t[0]
+    if(len(shot) > 0):
+        metrics['shot_time'] = t[shot[-1]] - t[0]
+        metrics['overshoot'] = max(pressure[shot].max() - mode.shot_pressure, 0.0)
+    metrics['final_weight'] = log[-1, nc + 9]
+    metrics['yield_error'] = metrics['final_weight'] - mode.shot_weight
+    return metrics
+
+def runPoint(args):
+    # Worker: simulate one point, return its parameters and metrics #
+    mode, params, seed, max_time = args
+    with contextlib.redirect_stdout(io.StringIO()):     # modes print progress
+        sim = shotSimulator(mode, params, seed = seed, log_all = True)
+        sim.run(max_time)
+    row = dict(params)
+    row.update(shotMetrics(sim.machine.log, sim.fsm.active_mode))
+    return row
+
+def sweep(points, mode = sweep_mode, processes = None, seed = 0, max_time = 120.0):
+    # Simulate every point on a pool of processes (default: one per core) #
+    # Point i is seeded with seed + i, so results don't depend on the pool size
+    jobs = [(mode, p, None if seed is None else seed + i, max_time) for i, p in enumerate(points)]
+    if(processes == 1):
+        return [runPoint(j) for j in jobs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(runPoint, jobs, chunksize = max(len(jobs)//(8*(processes or os.cpu_count() or 1)), 1))
+
+def writeResults(filename, rows):
+    names = list(rows[0]) if rows else metric_names
+    with open(filename, 'w', newline = '') as f:
+        writer = csv.DictWriter(f, fieldnames = names)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def parseValues(text):
+    # name=v1,v2,... #
+    name, values = text.split('=', 1)
+    return name, [float(v) for v in values.split(',')]
+
+def parseRange(text):
+    # name=low:high #
+    name, values = text.split('=', 1)
+    low, high = values.split(':')
+    return name, (float(low), float(high))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Sweep mode parameters on the simulated machine')
+    parser.add_argument('-m', '--mode', default = sweep_mode, help = 'mode title or class name')
+    parser.add_argument('-g', '--grid', action = 'append', default = [], help = 'grid values, name=v1,v2,...')
+    parser.add_argument('-r', '--range', action = 'append', default = [], help = 'random sample range, name=low:high')
+    parser.add_argument('-n', '--samples', type = int, default = 100, help = 'number of random samples')
+    parser.add_argument('-j', '--processes', type = int, default = None, help = 'worker processes (default: one per core)')
+    parser.add_argument('-s', '--seed', type = int, default = 0, help = 'noise and sampling seed')
+    parser.add_argument('-t', '--max-time', type = float, default = 120.0, help = 'simulated seconds per shot')
+    parser.add_argument('-o', '--output', default = 'sweep.csv', help = 'results CSV')
+    args = parser.parse_args()
+
+    if(args.range):
+        points = randomPoints(dict(parseRange(r) for r in args.range), args.samples, args.seed)
+        if(args.grid):
+            grid = gridPoints(dict(parseValues(g) for g in args.grid))
+            points = [dict(g, **p) for g in grid for p in points]
+    else:
+        points = gridPoints(dict(parseValues(g) for g in args.grid))
+    t1 = time.perf_counter()
+    rows = sweep(points, args.mode, args.processes, args.seed, args.max_time)
+    t2 = time.perf_counter()
+    writeResults(args.output, rows)
+    print('%d points in %.1f s (%.1f points/s, %d processes) -> %s'%(
+        len(rows), t2 - t1, len(rows)/(t2 - t1), args.processes or os.cpu_count(), args.output))
+
+if __name__ == '__main__':
+    main()
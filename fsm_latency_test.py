@@ -0,0 +1,33 @@
+### FSM latency test ###
+# Runs a simulated machine at 1 kHz with the FSM in its sample driven mode
+# and in the original 10 ms polling mode.  For each, reports how long after
+# a sample arrives the commands computed from it are published, and how
+# often a stopped mode gets woken up.
+
+from espressoFSM import *
+from espressoModes import *
+
+def measure(poll):
+    machine = fakeEspressoMachine()
+    fsm = espressoFSM(machine, poll = poll)
+    machine.startIO()
+    fsm.start()
+    fsm.transition(machine, flushMode)
+    fsm.mode_running = True
+    time.sleep(3.0)
+    fsm.mode_running = False
+    time.sleep(0.2)
+    stops = fsm.stops
+    time.sleep(1.0)
+    stats = fsm.stats()
+    samples = machine.sample_count
+    print('%-14s runs: %5d (%d samples)   latency p50: %6.3f ms   p99: %6.3f ms   max: %6.3f ms   stopped wakeups/s: %d'%(
+        'sample driven' if poll is None else 'poll %g ms'%(1e3*poll), stats['runs'], samples,
+        1e3*stats['latency_p50'], 1e3*stats['latency_p99'], 1e3*stats['latency_max'], fsm.stops - stops))
+    return stats, fsm.stops - stops
+
+event, event_wakeups = measure(None)
+poll, poll_wakeups = measure(.01)
+assert event['latency_p99'] < poll['latency_p99']
+assert event_wakeups == 0
+print('ok')
@@ -0,0 +1,64 @@
+### IO loop rate test ###
+# Runs the simulated machine's IO loop with logging on, first alone and then
+# with busy threads competing for the interpreter, and checks the loop holds
+# its target rate.  The busy threads run with the short thread switch
+# interval (startIO(short_switch = True)).  The busy thread part needs a core
+# for each thread, so is skipped on smaller hosts.  Logs go to a temporary
+# directory.
+
+from espressoMachine import *
+import threading
+import tempfile
+import time
+import os
+
+def load():
+    x = 0
+    while(True):
+        x += 1
+
+def report(name, stats):
+    print(name)
+    print('  rate: %7.1f Hz (target %.1f)   iterations: %d   missed deadlines: %d'%(stats['rate'], stats['target_rate'], stats['iterations'], stats['missed_deadlines']))
+    print('  period  p50: %7.1f us   p99: %7.1f us   max: %7.1f us'%(1e6*stats['period_p50'], 1e6*stats['period_p99'], 1e6*stats['period_max']))
+    print('  jitter  p50: %7.1f us   p99: %7.1f us   max: %7.1f us'%(1e6*stats['jitter_p50'], 1e6*stats['jitter_p99'], 1e6*stats['jitter_max']))
+
+switch_interval = sys.getswitchinterval()
+x = fakeEspressoMachine()
+x.log_writer.directory = tempfile.mkdtemp()
+x.startIO(short_switch = True)
+x.cmd.setPumpCmdType(1)
+x.cmd.setPumpCmd(6)
+x.cmd.setFlowDir(1)
+x.publishCommands()
+x.log_enabled = True
+
+time.sleep(0.5)
+x.io_scheduler.reset()
+time.sleep(3)
+idle = x.io_scheduler.stats()
+report('idle', idle)
+
+def holds(stats):
+    return abs(stats['rate'] - stats['target_rate']) < 0.05*stats['target_rate']
+
+if((not holds(idle)) or ((os.cpu_count() or 1) < 3)):
+    x.stopIO()
+    assert holds(idle), 'IO loop did not hold its rate alone'
+    assert sys.getswitchinterval() == switch_interval
+    print('ok (busy thread part skipped: needs 3 cores, this host has %d)'%(os.cpu_count() or 1))
+    sys.exit(0)
+
+for i in range(2):
+    t = threading.Thread(target = load)
+    t.daemon = True
+    t.start()
+x.io_scheduler.reset()
+time.sleep(3)
+loaded = x.io_scheduler.stats()
+report('2 busy threads', loaded)
+
+x.stopIO()
+assert sys.getswitchinterval() == switch_interval
+assert holds(loaded), 'IO loop did not hold its rate with busy threads'
+print('ok')
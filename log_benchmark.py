@@ -0,0 +1,51 @@
+### Log append benchmark ###
+# Times espressoLog.append in blocks as the log grows, to show the per-row
+# cost stays flat out to millions of rows.  The old np.vstack log is timed
+# for comparison until it gets too slow to be worth waiting for.
+
+from espressoLog import *
+import numpy as np
+import time
+import sys
+
+width = 19
+block = 100000
+total_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 4000000
+
+def vstackAppend(log, row):
+    # Original espressoMachine.logState #
+    if(np.all(log==0)):
+        return row
+    return np.vstack((log, row))
+
+row = np.random.rand(width)
+
+print('espressoLog (unbounded)')
+log = espressoLog(width)
+while(len(log) < total_rows):
+    t1 = time.perf_counter()
+    for i in range(block):
+        log.append(row)
+    t2 = time.perf_counter()
+    print('  rows: %8d   append: %6.3f us/row'%(len(log), 1e6*(t2-t1)/block))
+
+print('espressoLog (bounded to 1M rows)')
+log = espressoLog(width, max_rows = 1000000)
+for j in range(total_rows//block):
+    t1 = time.perf_counter()
+    for i in range(block):
+        log.append(row)
+    t2 = time.perf_counter()
+    print('  appended: %8d   rows: %8d   append: %6.3f us/row'%((j+1)*block, len(log), 1e6*(t2-t1)/block))
+
+print('np.vstack (original)')
+log = np.zeros(width)
+vstack_block = 2000
+n = 0
+while(n < 20000):
+    t1 = time.perf_counter()
+    for i in range(vstack_block):
+        log = vstackAppend(log, row)
+    t2 = time.perf_counter()
+    n += vstack_block
+    print('  rows: %8d   append: %6.3f us/row'%(n, 1e6*(t2-t1)/vstack_block))
@@ -0,0 +1,118 @@
+### Plot pipeline test ###
+# Feeds copies of a simulated shot log into an espressoLog in uneven blocks
+# and checks plotPipeline's min/max pyramid against the same median filter
+# and buckets computed over the whole log (sampled series take each bucket's
+# first row), and that a short pressure spike still shows in a zoomed out
+# view's envelope.  Then times an update with 20 new rows (one 50 Hz frame
+# at 1 kHz) and a whole log view as the log grows, next to the original
+# whole-log updateGraphics data prep.
+
+from espressoPlot import *
+from espressoLog import *
+from benchmark_suite import shotRows
+from espressoGui import plot_series, plot_ranges, plot_sampled
+import scipy.signal as signal
+import time
+
+def filteredRows(data):
+    # Whole log filtering, without the newest row (still held back) #
+    x = data[:, [column for column, filtered in plot_series.values()]]
+    for i, (column, filtered) in enumerate(plot_series.values()):
+        if(filtered and len(x) > 2):
+            x[1:-1, i] = signal.medfilt(x[:, i], 3)[1:-1]
+    return x[0:-1]
+
+def check(pipeline, data):
+    # Compare to a whole log computation #
+    x = filteredRows(data)
+    pyramid = pipeline.pyramid
+    first = [list(plot_series).index(n) - 1 for n in plot_sampled]
+    other = [i for i in range(pyramid.channels) if i not in first]
+    assert pyramid.rows == len(x), (pyramid.rows, len(x))
+    for k in range(len(pyramid.levels)):
+        size = pyramid.bucketRows(k)
+        n = len(x)//size
+        block = x[0:n*size].reshape(n, size, -1)
+        mins = block[:, :, 1:].min(axis = 1)
+        maxs = block[:, :, 1:].max(axis = 1)
+        mins[:, first] = maxs[:, first] = block[:, 0, 1:][:, first]
+        expected = np.hstack((block[:, 0, 0:1], mins, maxs))
+        assert np.array_equal(pyramid.levels[k].view(), expected), k
+        b = pyramid.buckets(k, 0, len(x))
+        c = pyramid.channels
+        assert np.array_equal(b[:, 1:1+c].min(axis = 0)[other], x[:, 1:].min(axis = 0)[other]), k
+        assert np.array_equal(b[:, 1+c:].max(axis = 0)[other], x[:, 1:].max(axis = 0)[other]), k
+    for name, (c0, c1) in plot_ranges.items():
+        assert pipeline.range(name) == (data[:, c0:c1].min(), data[:, c0:c1].max()), name
+    frame = pipeline.view(log)
+    assert frame['time'][0] == 0
+    for name in plot_sampled:
+        assert np.all(np.isin(frame[name], x[:, list(plot_series).index(name)])), name
+
+def oldPrep(data, max_points = 500):
+    # Original updateGraphics data prep #
+    data_length = data.shape[0]
+    inds = np.arange(0, data_length, 1)
+    if(data_length > max_points):
+        inds = np.linspace(0, data_length-1, max_points, dtype=int)
+    plot_time = data[inds,6] - data[0,6]
+    out = [signal.medfilt(data[inds, c], 3) for c in (3, 7, 8, 9, 10, 11)]
+    np.max((data[:,7:9]).flatten())
+    np.max((data[:,9:12]).flatten())
+    np.min((data[:,9:12]).flatten())
+    return plot_time, out
+
+rows = shotRows(1000000)
+rng = np.random.default_rng(0)
+log = espressoLog(rows.shape[1])
+pipeline = plotPipeline(plot_series, plot_ranges, sampled = plot_sampled)
+n = 0
+while(n < 200000):
+    block = int(rng.integers(1, 3000))
+    log.appendRows(rows[n:n+block])
+    n += block
+    pipeline.update(log)
+    if(rng.random() < .05):
+        check(pipeline, log.view())
+check(pipeline, log.view())
+print('incremental matches whole log: %d rows, %d levels'%(len(log), len(pipeline.pyramid.levels)))
+
+# Two sample spike (one would be median filtered away) #
+spike = rows[200000:300000].copy()
+spike[54321:54323, 7] = 50.0
+log.appendRows(spike)
+pipeline.update(log)
+log.appendRows(rows[300000:300010])
+pipeline.update(log)
+frame = pipeline.view(log, pixels = 400)
+assert len(frame['time']) <= 400 + 8, len(frame['time'])
+assert frame['envelope']['pressure'].max() == 50.0
+assert 'pump_cmd_type' not in frame['envelope']
+linspace = np.linspace(0, len(log) - 1, 800, dtype = int)
+print('spike kept: %d points, max pressure %.1f (%.1f at evenly spaced rows)'%(len(frame['time']), frame['envelope']['pressure'].max(), log.view()[linspace, 7].max()))
+
+log.clear()
+log.appendRows(rows[0:1234])
+assert pipeline.update(log)
+check(pipeline, log.view())
+print('reset on clear: ok')
+
+print('%10s %12s %12s %14s'%('log rows', 'update (us)', 'view (us)', 'original (us)'))
+log.clear()
+pipeline.update(log)
+n = 0
+for length in (1000, 10000, 100000, 1000000):
+    log.appendRows(rows[n:length - 20])
+    pipeline.update(log)
+    n = length - 20
+    log.appendRows(rows[n:length])
+    t1 = time.perf_counter()
+    pipeline.update(log)
+    t2 = time.perf_counter()
+    pipeline.view(log, pixels = 500)
+    t3 = time.perf_counter()
+    oldPrep(log.view())
+    t4 = time.perf_counter()
+    n = length
+    print('%10d %12.1f %12.1f %14.1f'%(length, 1e6*(t2 - t1), 1e6*(t3 - t2), 1e6*(t4 - t3)))
+print('ok')
@@ -0,0 +1,86 @@
+### Plot worker test ###
+# Runs MainWindow's plot worker on a simulated shot log repeated to 1M rows.
+#   - Main thread time per frame (updateGraphics() then drawFrame()) next to
+#     the worker's prep time, with the log cleared and refilled every few
+#     frames, which makes the worker filter the whole log again
+#   - Frames the GUI doesn't get to in time are dropped: with the main thread
+#     busy while the log grows, only the newest frame is drawn
+
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from benchmark_suite import *
+from espressoGui import MainWindow, QtWidgets, QtCore
+
+def waitFrame(gui, drawn, timeout = 5.0):
+    t_end = time.perf_counter() + timeout
+    while((gui.frames_drawn == drawn) and (time.perf_counter() < t_end)):
+        time.sleep(.001)
+        app.processEvents()
+    return gui.frames_drawn > drawn
+
+rows = shotRows(1002000)
+app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+machine = fakeEspressoMachine()
+gui = MainWindow(machine)
+gui.runTimer.stop()
+gui.labelTimer.stop()
+machine.stopIO()
+gui.mw.show()
+app.processEvents()
+
+# Main thread time, timing updateGraphics() and drawFrame() separately #
+draw_times = []
+def timedDraw(draw = gui.drawFrame):
+    t1 = time.perf_counter()
+    draw()
+    draw_times.append(time.perf_counter() - t1)
+gui.plot_worker.frame_ready.disconnect()
+gui.plot_worker.frame_ready.connect(timedDraw, QtCore.Qt.QueuedConnection)
+update_times = []
+prep = gui.plot_worker.prep_timer
+prep.reset()
+n = 1000000
+for i in range(40):
+    if(i % 10 == 0):
+        fillLog(machine, rows, n)
+    machine.log_buffer.appendRows(rows[n:n + frame_rows])
+    n += frame_rows
+    drawn = gui.frames_drawn
+    t1 = time.perf_counter()
+    gui.updateGraphics()
+    update_times.append(time.perf_counter() - t1)
+    assert waitFrame(gui, drawn)
+    if(i % 10 == 0):
+        n = 1000000
+prep_summary = prep.current.summary()
+print('main thread: updateGraphics %.2f ms, drawFrame %.2f ms (max %.2f)   worker prep: %.2f ms (max %.2f)'%(
+    1e3*np.mean(update_times), 1e3*np.mean(draw_times), 1e3*max(update_times + draw_times),
+    1e3*prep_summary['mean'], 1e3*prep_summary['max']))
+assert max(update_times) < prep_summary['max']
+
+# Stale frames are dropped #
+worker = gui.plot_worker
+frames = worker.frames
+dropped = worker.dropped
+drawn = gui.frames_drawn
+gui.plot_follow = False         # zoomed in, until the log is cleared
+machine.log_buffer.clear()
+for i in range(10):
+    machine.log_buffer.appendRows(rows[n:n + frame_rows])
+    n += frame_rows
+    gui.updateGraphics()
+    time.sleep(.05)             # the main thread is busy, the worker isn't
+assert waitFrame(gui, drawn)
+app.processEvents()
+t_last = machine.log_buffer.view()[-2, 6] - machine.log_buffer.view()[0, 6]     # newest row is held back
+x_range = gui.plot1.getViewBox().viewRange()[0]
+print('stale frames: %d prepared, %d dropped, %d drawn'%(worker.frames - frames, worker.dropped - dropped, gui.frames_drawn - drawn))
+assert gui.frames_drawn - drawn == 1
+assert worker.dropped - dropped >= 5
+assert gui.plot_follow, 'log clear lost with a dropped frame'
+assert abs(x_range[1] - t_last) < .1*t_last, (x_range, t_last)
+
+worker.stop()
+gui.mw.close()
+print('ok')
@@ -7,20 +7,24 @@ x.startIO()
 x.cmd.setFlowDir(2)     # flow to drip tray
 x.cmd.setPumpCmdType(1)    # pressure
 x.cmd.setPumpCmd(1)
+x.publishCommands()
 x.log_enabled = True
 time.sleep(.5)
 x.cmd.setFlowDir(1)
+x.publishCommands()
 p_des = 6
 cmd = 1
 alpha = .8
 while(cmd<(p_des-.03)):
     cmd = alpha*cmd + (1-alpha)*p_des
     x.cmd.setPumpCmd(cmd)
+    x.publishCommands()
     time.sleep(.001)
 time.sleep(1.5)
-x.saveLog()
+x.saveLog(wait = True)
 x.log_enabled = False
 x.cmd.setPumpCmd(0)
 x.cmd.setPumpCmdType(0)
 x.cmd.setFlowDir(0)
+x.publishCommands()
 time.sleep(1)
\ No newline at end of file
@@ -0,0 +1,62 @@
+### Shot profile benchmark ###
+# Runs nineBarShot and the nine_bar profile (espressoProfiles) through a whole
+# shot on a simulated machine, stepped at 1 kHz in simulated time, and
+# reports the cost of the mode's run() per tick in each phase, and how
+# closely the commands the profile sends match the original mode's.
+
+from espressoProfiles import *
+from espressoModes import *
+import time
+
+phases = [p.name for p in nine_bar]
+
+class steppedMachine(fakeEspressoMachine):
+    # Simulated machine on a 1 kHz clock of its own, not the wall clock #
+    def __init__(self):
+        fakeEspressoMachine.__init__(self)
+        self.t_offset = 0.0
+        self.ticks = 0
+    def step(self):
+        self.ticks += 1
+        self.io_scheduler.deadline = self.ticks*self.io_scheduler.period
+        self.ioStep()
+
+def oldPhase(mode, machine):
+    if(not mode.preheat_done):
+        return 0
+    if(not mode.pi_done):
+        return 1 if machine.state.time() - mode.t_start < 1.0 else 2
+    return 3 if not mode.shot_done else 4
+
+def newPhase(mode, machine):
+    return mode.index
+
+def runShot(mode, phase, max_ticks = 200000):
+    np.random.seed(0)
+    machine = steppedMachine()
+    mode.start()
+    cmds = []
+    costs = [[] for p in phases]
+    while((not mode.done) and (machine.ticks < max_ticks)):
+        machine.step()
+        cmds.append(machine.cmd_out.copy())
+        i = phase(mode, machine)
+        t = time.perf_counter()
+        mode.run(machine, False)
+        costs[i].append(time.perf_counter() - t)
+        machine.publishCommands()
+    return np.array(cmds), costs
+
+old_cmds, old_costs = runShot(nineBarShot(), oldPhase)
+new_cmds, new_costs = runShot(nineBarProfile(), newPhase)
+print('%-10s %8s %22s %22s'%('phase', 'ticks', 'nineBarShot (us/tick)', 'profile (us/tick)'))
+for i, name in enumerate(phases):
+    print('%-10s %8d %22.2f %22.2f'%(name, len(new_costs[i]), 1e6*np.median(old_costs[i]), 1e6*np.median(new_costs[i])))
+print('%-10s %8d %22.2f %22.2f'%('all', len(new_cmds), 1e6*np.median(np.concatenate(old_costs)), 1e6*np.median(np.concatenate(new_costs))))
+n = min(len(old_cmds), len(new_cmds))
+same = np.all(old_cmds[0:n] == new_cmds[0:n], axis = 1)
+print('ticks with identical commands: %d of %d'%(np.sum(same), n))
+for name, column in (('pump_cmd_type', 3), ('flow_dir', 4)):
+    old_changes = np.nonzero(np.diff(old_cmds[:, column]))[0]
+    new_changes = np.nonzero(np.diff(new_cmds[:, column]))[0]
+    print('%-14s changes at tick   nineBarShot: %s   profile: %s'%(name, old_changes + 1, new_changes + 1))
@@ -0,0 +1,31 @@
+### Shot bleed test ###
+# Runs nineBarShot on the headless simulator, logging every step, and checks
+# the bleed at the end of the shot actually reaches the machine: the commands
+# sent (cmd_out, the log's command columns) go from flow to the group to the
+# drip tray with the pump at zero for t_bleed, then to the tank with the pump
+# off.
+
+from espressoSim import *
+import contextlib
+import io
+
+sim = shotSimulator('Nine Bar - Flow Preinfusion', seed = 0, log_all = True)
+with contextlib.redirect_stdout(io.StringIO()):
+    sim.run()
+mode = sim.fsm.active_mode
+assert mode.done
+
+names = [c['name'] for c in log_columns]
+log = {n:sim.machine.log[:, i] for i, n in enumerate(names)}
+stop = np.flatnonzero(log['flow_dir'] == 1)[-1] + 1         # first row after the shot
+bleed = np.flatnonzero(log['flow_dir'][stop:] != 2)
+bleed_end = stop + (bleed[0] if len(bleed) else len(log['flow_dir']) - stop)
+t_bleed = log['time'][bleed_end - 1] - log['time'][stop]
+print('bleed: %d rows, %.3f s (t_bleed %.1f s)'%(bleed_end - stop, t_bleed, mode.t_bleed))
+assert np.all(log['pump_cmd'][stop:bleed_end] == 0)
+assert np.all(log['pump_cmd_type'][stop:bleed_end] == 2)
+assert abs(t_bleed - mode.t_bleed) < 0.01
+sim.clock.advance(sim.period)
+sim.machine.ioStep()                        # sends the commands published after the last step
+assert sim.machine.cmd_out[4] == 0 and sim.machine.cmd_out[3] == 0
+print('ok')
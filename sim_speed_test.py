@@ -0,0 +1,24 @@
+### Simulation speed test ###
+# Simulates whole Nine Bar shots (about 30 s of machine time at 1 kHz) with
+# shotSimulator, and checks they take well under a second: the best of three
+# runs has to simulate at least min_speedup times faster than real time.
+
+from espressoSim import *
+import contextlib
+import io
+
+min_speedup = 50.0      # simulated s per wall s, 0.6 s for a 30 s shot
+runs = 3
+
+speedups = []
+for i in range(runs):
+    sim = shotSimulator('Nine Bar - Flow Preinfusion', seed = i)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t = time.perf_counter()
+        shot_time = sim.run()
+        t = time.perf_counter() - t
+    assert sim.fsm.active_mode.done, 'shot did not finish'
+    speedups.append(shot_time/t)
+    print('%5.1f s shot simulated in %.3f s (%3.0fx real time)'%(shot_time, t, speedups[-1]))
+assert max(speedups) >= min_speedup, 'simulation slower than %.0fx real time'%min_speedup
+print('ok')
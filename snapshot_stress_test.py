@@ -0,0 +1,92 @@
+### Snapshot stress test ###
+# Runs a simulated machine's IO loop flat out (no rate limit) while other
+# threads play the FSM and the GUI:
+#   - the FSM thread sets all six commands to a counter value, one field at a
+#     time, then publishes them
+#   - the machine writes every state field with the sample counter, one field
+#     at a time
+#   - reader threads check that every snapshot, every log row and every log
+#     tail has all its commands equal and all its state fields equal
+# Raw reads of state_vec are checked the same way, to show they do tear.
+
+from espressoMachine import *
+import threading
+import time
+import sys
+
+duration = 5.0
+
+class counterMachine(fakeEspressoMachine):
+    # Every state field is the sample count, written one field at a time #
+    def __init__(self):
+        fakeEspressoMachine.__init__(self, rate = None)
+        self.n = 0
+    def sample(self):
+        self.n += 1
+        for i in range(len(self.state.state_vec)):
+            self.state.state_vec[i] = self.n
+        return 1
+
+def consistent(cmd_vec, state_vec):
+    return np.all(cmd_vec[0:5] == cmd_vec[0]) and np.all(state_vec == state_vec[0])
+
+class fsmThread(threading.Thread):
+    def __init__(self, machine):
+        threading.Thread.__init__(self, daemon = True)
+        self.machine = machine
+        self.published = 0
+    def run(self):
+        while(running):
+            self.published += 1
+            for i in range(5):
+                self.machine.cmd.cmd_vec[i] = self.published
+            self.machine.publishCommands()
+
+class readerThread(threading.Thread):
+    def __init__(self, machine):
+        threading.Thread.__init__(self, daemon = True)
+        self.machine = machine
+        self.reads = 0
+        self.torn_snapshots = 0
+        self.torn_log_rows = 0
+        self.torn_raw = 0
+        self.log_rows_checked = 0
+    def run(self):
+        while(running):
+            self.reads += 1
+            cmd, state = self.machine.snapshot()
+            if(not consistent(cmd.cmd_vec, state.state_vec)):
+                self.torn_snapshots += 1
+            raw = np.array([self.machine.state.state_vec[i] for i in range(len(self.machine.state.state_vec))])
+            if(not np.all(raw == raw[0])):
+                self.torn_raw += 1
+            tail = self.machine.log_buffer.tail(500)
+            ok = np.all(tail[:, 0:5] == tail[:, 0:1]) and np.all(tail[:, 6:] == tail[:, 6:7])
+            ok = ok and np.all(np.diff(tail[:, 6]) > 0)
+            if(not ok):
+                self.torn_log_rows += 1
+            self.log_rows_checked += len(tail)
+
+sys.setswitchinterval(1e-5)     # switch threads as often as possible
+machine = counterMachine()
+machine.log_buffer = espressoLog(machine.log_buffer.width, chunk_rows = 1024, max_rows = 20000)   # grow and compact often
+machine.log_enabled = True
+machine.log_writer.put = lambda rows: None      # no files
+running = True
+machine.startIO()
+fsm = fsmThread(machine)
+fsm.start()
+readers = [readerThread(machine) for i in range(3)]
+for r in readers:
+    r.start()
+time.sleep(duration)
+running = False
+time.sleep(0.1)
+
+print('samples: %d   commands published: %d   log rows: %d'%(machine.n, fsm.published, len(machine.log_buffer)))
+print('snapshot read retries: %d'%machine.snapshot_buffer.retries)
+for i, r in enumerate(readers):
+    print('reader %d:  reads: %7d   torn snapshots: %d   torn log tails: %d (%d rows checked)   torn raw state_vec reads: %d'%(
+        i, r.reads, r.torn_snapshots, r.torn_log_rows, r.log_rows_checked, r.torn_raw))
+assert sum(r.torn_snapshots + r.torn_log_rows for r in readers) == 0
+print('ok')
@@ -0,0 +1,68 @@
+### Mode startup benchmark ###
+# Compares what the FSM and GUI did at startup to build their mode lists from
+# the baseline mode set (espressoModes and extraModes): import every mode
+# module and instantiate every mode class (once for the FSM's title index,
+# again for the GUI list, and again in each transition), with the lazy
+# modeRegistry, which parses the mode sources with ast and only imports a
+# mode's module when it is first selected.  Then the whole GUI and FSM
+# startup path, before (scipy.signal imported for the plots and the modes
+# loaded eagerly) and now.  Each case runs in a fresh interpreter, after
+# espressoMachine (which all of them need) is imported.
+
+import subprocess
+import sys
+import os
+
+runs = 5
+
+common = '''
+import time
+import espressoMachine
+t0 = time.perf_counter()
+'''
+
+eager_modes = '''
+import inspect
+import espressoModes, extraModes
+modes = [c for m in (espressoModes, extraModes) for n, c in vars(m).items()
+         if inspect.isclass(c) and c.__module__ == m.__name__ and 'title' in vars(c)]
+mode_list = {mode().title: mode for mode in modes}          # FSM
+titles = [mode().title for mode in modes]                   # GUI list
+mode = mode_list['Idle']
+mode().title                                                # transition
+'''
+
+lazy_modes = '''
+from espressoRegistry import *
+mode_list = modeRegistry(sources = ('espressoModes', 'extraModes'))     # FSM
+titles = mode_list.titles()                                 # GUI list
+mode = mode_list['Idle']
+mode.title                                                  # transition
+'''
+
+gui = '''
+import espressoGui
+fsm = espressoGui.espressoFSM(espressoMachine.fakeEspressoMachine())
+titles = fsm.mode_list.titles()
+'''
+
+done = '''
+print(time.perf_counter() - t0)
+'''
+
+cases = (
+    ('modes: import and instantiate', common + eager_modes + done),
+    ('modes: lazy registry', common + lazy_modes + done),
+    ('GUI and FSM: before', common + 'import scipy.signal\n' + eager_modes + gui + done),
+    ('GUI and FSM: now', common + gui + done),
+    )
+
+def measure(code):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = [float(subprocess.check_output([sys.executable, '-c', code], cwd = directory).split()[-1])
+             for i in range(runs)]
+    return min(times), sorted(times)[len(times)//2]
+
+for name, code in cases:
+    best, median = measure(code)
+    print('%-32s best: %7.1f ms   median: %7.1f ms'%(name, 1e3*best, 1e3*median))
@@ -0,0 +1,89 @@
+### Stop prediction test ###
+# Runs nineBarShot on a simulated machine whose scale lags the flow by
+# in_flight seconds, like liquid on its way to the cup.  Shots stopped on the
+# weight itself overshoot by about rate*in_flight.  The stop delay fitted
+# from those shots' logs (stopDelay) then lets weightPredictor stop early
+# enough that the weight lands on target.  The landed weight is taken once
+# the liquid in flight is in, since the simulated scale drifts through the
+# rest of the bleed.  The simulated shots must
+# not learn from (or write) the shot catalog.  Then a stopDelayModel on a
+# directory of those logs must only read the logs saved after the catalog's
+# newest one, not the older archive.
+
+from espressoSim import *
+from espressoCatalog import shotCatalog
+import collections
+import contextlib
+import io
+import os
+import tempfile
+
+in_flight = 0.6         # scale lag (s)
+
+class inFlightMachine(fakeEspressoMachine):
+    # fakeEspressoMachine with the weight delayed by in_flight #
+    def __init__(self, clock):
+        fakeEspressoMachine.__init__(self, clock = clock)
+        self.weights = collections.deque([0.0]*int(in_flight*fake_io_rate), maxlen = int(in_flight*fake_io_rate))
+    def sample(self):
+        n = fakeEspressoMachine.sample(self)
+        delayed = self.weights[0]
+        self.weights.append(self.state.state_vec[9])
+        self.state.state_vec[9] = delayed
+        return n
+
+def runShot(predict_stop, stop_delay = None, seed = 0):
+    np.random.seed(seed)
+    clock = simClock(1000.0)
+    machine = inFlightMachine(clock)
+    fsm = espressoFSM(machine, modes = modeRegistry(plugins = None))
+    with contextlib.redirect_stdout(io.StringIO()):
+        fsm.transition(machine, nineBarShot)
+    mode = fsm.active_mode
+    mode.predict_stop = predict_stop
+    mode.stop_delay = stop_delay if stop_delay is not None else 0.0
+    mode.start()
+    fsm.mode_running = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        while((not mode.done) and (clock.time() < 1120.0)):
+            clock.advance(1.0/fake_io_rate)
+            machine.ioStep()
+            fsm.step()
+    assert isinstance(mode.delay_model, fixedStopDelay), 'simulated shot used the shot catalog'
+    log = machine.log
+    names = [c['name'] for c in log_columns]
+    columns = {n:log[:, i] for i, n in enumerate(names)}
+    t = columns['time']
+    stop = np.flatnonzero(columns['flow_dir'] == 1)[-1]
+    landed = (t >= t[stop] + in_flight + .05) & (t < t[stop] + in_flight + .05 + settle_time)
+    return np.median(columns['weight'][landed]) - mode.shot_weight, stopDelay(columns), log
+
+errors = []
+delays = []
+for seed in range(7):
+    error, delay, log = runShot(False, seed = seed)
+    errors.append(error)
+    delays.append(delay)
+learned = learnedDelay(delays)
+print('stop on weight:      landed weight error %5.2f g   fitted stop delay %s s'%(np.mean(errors), ', '.join('%.3f'%d for d in delays)))
+
+predicted = [runShot(True, learned, seed = seed + 10)[0] for seed in range(20)]
+print('stop on prediction:  landed weight error %5.2f g   (delay %.3f s)'%(np.mean(predicted), learned))
+assert sum(abs(d - in_flight) < .15 for d in delays) >= 5, 'stop delay fits too spread out'
+assert abs(learned - in_flight) < .05
+assert abs(np.mean(predicted)) < .25*abs(np.mean(errors))
+
+directory = tempfile.mkdtemp()
+writeLogFile(os.path.join(directory, 'archive' + log_ext), log, log_columns)
+os.utime(os.path.join(directory, 'archive' + log_ext), (1e9, 1e9))
+model = stopDelayModel(directory)
+model.refit(wait = True)
+time.sleep(.1)      # file times come from a coarser clock than time.time()
+writeLogFile(os.path.join(directory, 'new' + log_ext), log, log_columns)
+model.refit(wait = True)
+catalog = shotCatalog(directory)
+indexed = [r['filename'] for r in catalog.query()]
+catalog.close()
+print('refit indexed: %s   fits: %d'%(', '.join(indexed), model.fits))
+assert indexed == ['new' + log_ext] and model.fits == 1, 'refit read logs from before the catalog'
+print('ok')
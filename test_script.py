@@ -30,10 +30,12 @@ x.startIO()
 y = nineBarShot()
 #y = idleMode()
 x.log_enabled = True
+y.start()
 while(not y.done):
     #print(x.state.pressure(), x.state.flow(),x.state.waterTemp(), x.state.groupTemp(), x.state.weight())
-    y.run(x.state, x.cmd)
+    y.run(x, False)
+    x.publishCommands()
     time.sleep(.1)
-x.saveLog()
+x.saveLog(wait = True)
 x.clearLog()
 x.log_enabled = False
@@ -0,0 +1,62 @@
+### Thread shutdown test ###
+# Starts a machine on a fake pyusb device with its IO, USB reader and log
+# writer threads, and an FSM running a mode on it, then stops them all and
+# checks no thread is left running.  Two saves asked for back to back must
+# both be written, each with the whole log so far, a third asked for just
+# before stopping is written too, and the unsaved session files are gone.
+
+import usb.core
+from espressoFSM import *
+from espressoModes import *
+import struct
+import tempfile
+import contextlib
+import io
+
+class fakeUsbDevice():
+    # Packets at about 1 kHz #
+    def __init__(self):
+        self.sent = 0
+    def set_configuration(self):
+        pass
+    def read(self, endpoint, buffer, timeout = None):
+        time.sleep(.001)
+        memoryview(buffer)[0:packet_bytes] = struct.pack('20f', .001*self.sent, *range(19))
+        self.sent += 1
+        return packet_bytes
+    def write(self, endpoint, data):
+        return len(data)
+
+threads = threading.active_count()
+find = usb.core.find
+usb.core.find = lambda **kwargs: fakeUsbDevice()
+machine = espressoMachine()
+usb.core.find = find
+machine.log_writer.directory = tempfile.mkdtemp()
+fsm = espressoFSM(machine)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    machine.startIO()
+    fsm.start()
+    fsm.transition(machine, flushMode)
+    fsm.mode_running = True
+    machine.log_enabled = True
+    time.sleep(1.0)
+    print('threads running: %d'%(threading.active_count() - threads), file = sys.stderr)
+    assert threading.active_count() - threads == 4      # IO, USB reader, log writer, FSM
+    machine.saveLog()
+    machine.saveLog(wait = True)
+    time.sleep(0.2)
+    machine.saveLog()
+    fsm.stop()
+    machine.stopIO()
+print('threads left: %d'%(threading.active_count() - threads))
+assert threading.active_count() == threads, 'threads left running: %s'%threading.enumerate()
+
+files = sorted(os.listdir(machine.log_writer.directory), key = lambda f: os.path.getmtime(os.path.join(machine.log_writer.directory, f)))
+assert (len(files) == 3) and all(f.endswith(log_ext) for f in files), files
+logged = [logFile(os.path.join(machine.log_writer.directory, f)) for f in files]
+print('rows logged: %d   saved: %s'%(len(machine.log_buffer), ', '.join(str(len(l)) for l in logged)))
+assert 0 < len(logged[0]) <= len(logged[1]) < len(logged[2]) <= len(machine.log_buffer)
+assert np.array_equal(logged[1].array(), machine.log[0:len(logged[1])])
+print('ok')
@@ -0,0 +1,108 @@
+### USB reader test ###
+# Drives espressoComm's background usbReader with a fake pyusb device, no
+# hardware needed.  The device sends numbered packets at 1 kHz, with
+# injected read errors and stalls, while the consumer keeps up for a while
+# and then falls behind.  Checks every packet is accounted for as received,
+# dropped or skipped, that received packets arrive in order, and that the
+# stalls show up as late packets, and that the device timestamps are kept.
+# Then checks a machine on a device that only times out logs nothing and
+# never wakes the FSM.
+# Late packets are bounded by the gaps the device actually left, since the
+# host can hold the device thread up on top of the injected stalls.
+
+import usb.core
+from espressoMachine import *
+import contextlib
+import struct
+import time
+import io
+
+class fakeUsbDevice():
+    # Numbered packets at a fixed rate.  Every error_every'th read fails, every #
+    # stall_every'th packet is held back for stall seconds
+    def __init__(self, rate = 1000.0, error_every = 1500, stall_every = 700, stall = 0.02):
+        self.period = 1.0/rate
+        self.error_every = error_every
+        self.stall_every = stall_every
+        self.stall = stall
+        self.reads = 0
+        self.sent = 0
+        self.stalls = 0
+        self.times = []                         # when each packet was handed over
+        self.t_next = time.perf_counter()
+    def set_configuration(self):
+        pass
+    def read(self, endpoint, buffer, timeout = None):
+        self.reads += 1
+        if(self.reads % self.error_every == 0):
+            raise usb.core.USBError('injected error')
+        self.t_next += self.period
+        if(self.sent % self.stall_every == self.stall_every - 1):
+            self.stalls += 1
+            self.t_next += self.stall
+        while(time.perf_counter() < self.t_next):
+            time.sleep(self.period/4)
+        memoryview(buffer)[0:packet_bytes] = struct.pack('20f', self.sent*self.period, self.sent, *range(18))
+        self.sent += 1
+        self.times.append(time.perf_counter())
+        return packet_bytes
+    def write(self, endpoint, data):
+        return len(data)
+
+class timeoutUsbDevice(fakeUsbDevice):
+    def read(self, endpoint, buffer, timeout = None):
+        raise usb.core.USBTimeoutError('injected timeout')
+
+find = usb.core.find
+usb.core.find = lambda **kwargs: fakeUsbDevice()
+comm = espressoComm(0, 0)
+usb.core.find = find
+comm.startReader(n_buffers = 64)
+
+received = []
+device_times = []
+t_end = time.perf_counter() + 3.0
+while(time.perf_counter() < t_end):
+    # Keep up: drain everything queued #
+    n = comm.readBlock()
+    received += list(comm.block[0:n, 1])
+    device_times += list(comm.block[0:n, device_time_col])
+t_end = time.perf_counter() + 2.0
+while(time.perf_counter() < t_end):
+    # Fall behind: only the newest packet, every 50 ms #
+    if(comm.read()):
+        received.append(comm.in_floats[1])
+        device_times.append(comm.in_floats[device_time_col])
+    time.sleep(0.05)
+comm.reader.stop()
+time.sleep(0.2)
+while(True):
+    n = comm.readBlock()
+    if(n == 0):
+        break
+    received += list(comm.block[0:n, 1])
+    device_times += list(comm.block[0:n, device_time_col])
+
+stats = comm.reader.stats()
+print(stats)
+print('received: %d   device sent: %d   stalls: %d'%(len(received), comm.dev.sent, comm.dev.stalls))
+gaps = np.diff(comm.dev.times)/comm.dev.period
+print('late: %d   device gaps over 1.5 periods: %d'%(stats['late'], np.sum(gaps > 1.5)))
+assert np.all(np.diff(received) > 0), 'packets out of order'
+assert len(received) + stats['dropped'] + stats['skipped'] == stats['packets'] == comm.dev.sent, 'packets unaccounted for'
+assert stats['late'] >= comm.dev.stalls - 1, 'stalls not reported as late'
+assert stats['late'] <= np.sum(gaps > 1.5), 'on time packets reported as late'
+assert stats['errors'] > 0
+assert np.allclose(device_times, np.float32(np.array(received)*comm.dev.period)), 'device timestamps lost'
+
+# No new packets, no samples #
+usb.core.find = lambda **kwargs: timeoutUsbDevice()
+machine = espressoMachine()
+usb.core.find = find
+machine.log_enabled = True
+with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(5):
+        machine.ioStep()
+print('stale steps: %d rows logged, sample count %d'%(len(machine.log_buffer), machine.sample_count))
+assert len(machine.log_buffer) == 0 and machine.sample_count == 0, 'stale samples logged'
+print('ok')
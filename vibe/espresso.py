@@ -15,6 +15,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
                              QHeaderView, QFileDialog, QGroupBox, QGridLayout, QMessageBox)
 from PyQt6.QtGui import QAction
 import pyqtgraph as pg
+from sample_ring import SampleRing
 
 # --- CONFIGURATION & PROTOCOL ---
 # Must match STM32 C code exactly
@@ -95,11 +96,12 @@ class MockEspressoMachine:
 
 # --- 2. BACKEND WORKER THREAD ---
 class SerialWorker(QThread):
-    data_available = pyqtSignal(np.ndarray) # Emits chunk of data (N, 3)
+    rows_available = pyqtSignal(int) # New rows in self.ring up to this count, at most at the display rate
     
     def __init__(self, port_name=None):
         super().__init__()
         self.running = True
+        self.ring = SampleRing(3)
         self.port_name = port_name
         self.mock_mode = (port_name is None)
         self.connection = None
@@ -139,14 +141,10 @@ class SerialWorker(QThread):
                 raw_data = self.connection.read(PACKET_SIZE)
                 
                 if len(raw_data) == PACKET_SIZE:
-                    # Unpack
-                    unpacked = struct.unpack(PACKET_STRUCT_FMT, raw_data)
-                    header = unpacked[0]
-                    
-                    if header == PACKET_HEADER:
-                        # Convert tuple to numpy array (reshape to N x 3)
-                        # unpacked[1:] contains the flats, length = SAMPLES * 3
-                        chunk = np.array(unpacked[1:], dtype=np.float32).reshape(-1, 3)
+                    if raw_data[:len(PACKET_HEADER)] == PACKET_HEADER:
+                        # Decode the floats straight into the ring (N x 3)
+                        count = self.ring.write_packet(raw_data, len(PACKET_HEADER))
+                        chunk = self.ring.read(count - SAMPLES_PER_PACKET, count)
                         
                         # Log to Disk (Append mode)
                         with open(filename, 'a', newline='') as f:
@@ -159,11 +157,13 @@ class SerialWorker(QThread):
                             # Combine time and data for CSV
                             rows = np.column_stack((times, chunk))
                             writer.writerows(rows)
-
-                        # Send to GUI
-                        self.data_available.emit(chunk)
                     else:
                         print("Sync Error: Bad Header")
+
+                # Tell the GUI, coalesced to the display rate (right away if the stream went quiet)
+                count = self.ring.notify_due(force=len(raw_data) < PACKET_SIZE)
+                if count is not None:
+                    self.rows_available.emit(count)
             except Exception as e:
                 print(f"Serial Loop Error: {e}")
                 time.sleep(1)
@@ -230,7 +230,8 @@ class EspressoGUI(QMainWindow):
         # -- Threads --
         # Pass None to force Simulator Mode. Pass '/dev/ttyUSB0' for real hardware.
         self.worker = SerialWorker(port_name=None) 
-        self.worker.data_available.connect(self.update_data)
+        self.rows_seen = 0
+        self.worker.rows_available.connect(self.update_data)
         self.worker.start()
         
         # -- Profile Logic Timer --
@@ -323,9 +324,12 @@ class EspressoGUI(QMainWindow):
         
         layout.addWidget(right_panel)
 
-    def update_data(self, chunk):
-        """Receives new data chunk from Worker Thread (10-50 samples)"""
+    def update_data(self, count):
+        """Takes the rows the Worker Thread added to its ring since the last call (one display frame's worth)"""
+        chunk = self.worker.ring.read(self.rows_seen, count)
+        self.rows_seen = count
         num = len(chunk)
+        if num == 0: return
         p_data = chunk[:, 0]
         f_data = chunk[:, 1]
         t_last = chunk[-1, 2] # Latest temp
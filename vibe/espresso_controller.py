@@ -11,6 +11,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
                              QFrame, QInputDialog, QMessageBox, QStyledItemDelegate, QComboBox, 
                              QAbstractItemView, QTabWidget, QListWidget)
 import pyqtgraph as pg
+from sample_ring import SampleRing
 
 # --- CONFIGURATION ---
 SAMPLES_PER_PACKET = 10   
@@ -103,11 +104,12 @@ class MockEspressoMachine:
 
 # --- 2. SERIAL WORKER ---
 class SerialWorker(QThread):
-    data_available = pyqtSignal(np.ndarray) 
+    rows_available = pyqtSignal(int) # new rows in self.ring up to this count
     def __init__(self):
         super().__init__()
         self.running = True
         self.connection = MockEspressoMachine() 
+        self.ring = SampleRing(5)
         self.last_p = 0.0; self.last_f = 0.0; self.last_w = 0.0; self.last_tw = 0.0; self.last_tg = 0.0
 
     def send_command(self, cmd): self.connection.write(cmd.encode('utf-8'))
@@ -115,13 +117,11 @@ class SerialWorker(QThread):
         while self.running:
             try:
                 raw = self.connection.read(PACKET_SIZE)
-                if len(raw) == PACKET_SIZE:
-                    unpacked = struct.unpack(PACKET_STRUCT_FMT, raw)
-                    if unpacked[0] == PACKET_HEADER:
-                        chunk = np.array(unpacked[1:], dtype=np.float32).reshape(-1, 5)
-                        self.last_p = chunk[-1, 0]; self.last_f = chunk[-1, 1]; self.last_w = chunk[-1, 2]
-                        self.last_tw = chunk[-1, 3]; self.last_tg = chunk[-1, 4]
-                        self.data_available.emit(chunk)
+                if len(raw) == PACKET_SIZE and raw[:len(PACKET_HEADER)] == PACKET_HEADER:
+                    self.ring.write_packet(raw, len(PACKET_HEADER))
+                    self.last_p, self.last_f, self.last_w, self.last_tw, self.last_tg = self.ring.last()
+                count = self.ring.notify_due(force=len(raw) < PACKET_SIZE)
+                if count is not None: self.rows_available.emit(count)
             except: time.sleep(0.01)
     def stop(self): self.running = False; self.wait()
 
@@ -195,7 +195,8 @@ class EspressoApp(QMainWindow):
         self.load_profiles_from_disk()
 
         self.worker = SerialWorker()
-        self.worker.data_available.connect(self.update_data)
+        self.rows_seen = 0
+        self.worker.rows_available.connect(self.update_data)
         self.worker.start()
         
         self.timer = QTimer()
@@ -368,7 +369,9 @@ class EspressoApp(QMainWindow):
     def start_session(self): self.ptr = 0; self.paused = False 
 
     # --- UPDATES ---
-    def update_data(self, chunk):
+    def update_data(self, count):
+        chunk = self.worker.ring.read(self.rows_seen, count); self.rows_seen = count
+        if not len(chunk): return
         self.lbl_p.setText(f"{chunk[-1,0]:.1f}"); self.lbl_w_val.setText(f"{chunk[-1,2]:.1f}")
         if self.paused: return
         n = len(chunk)
@@ -16,6 +16,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
                              QSplitter)
 from PyQt6.QtGui import QColor, QFont
 import pyqtgraph as pg
+from sample_ring import SampleRing
 
 # --- CONFIGURATION ---
 SAMPLES_PER_PACKET = 50   
@@ -134,11 +135,12 @@ class MockEspressoMachine:
 
 # --- 2. WORKER THREAD ---
 class SerialWorker(QThread):
-    data_available = pyqtSignal(np.ndarray) 
+    rows_available = pyqtSignal(int) # new rows in self.ring up to this count
     
     def __init__(self, port_name=None):
         super().__init__()
         self.running = True
+        self.ring = SampleRing(3)
         self.port_name = port_name
         self.connection = None
 
@@ -156,12 +158,11 @@ class SerialWorker(QThread):
 
         while self.running:
             try:
-                raw_data = self.connection.read(PACKET_SIZE)
-                if len(raw_data) == PACKET_SIZE:
-                    unpacked = struct.unpack(PACKET_STRUCT_FMT, raw_data)
-                    if unpacked[0] == PACKET_HEADER:
-                        chunk = np.array(unpacked[1:], dtype=np.float32).reshape(-1, 3)
-                        self.data_available.emit(chunk)
+                raw = self.connection.read(PACKET_SIZE)
+                if len(raw) == PACKET_SIZE and raw[:len(PACKET_HEADER)] == PACKET_HEADER:
+                    self.ring.write_packet(raw, len(PACKET_HEADER))
+                count = self.ring.notify_due(force=len(raw) < PACKET_SIZE)
+                if count is not None: self.rows_available.emit(count)
             except: time.sleep(0.1)
 
     def stop(self):
@@ -232,7 +233,8 @@ class EspressoModernGUI(QMainWindow):
         
         # -- Workers --
         self.worker = SerialWorker(port_name=None)
-        self.worker.data_available.connect(self.update_data)
+        self.rows_seen = 0
+        self.worker.rows_available.connect(self.update_data)
         self.worker.start()
         
         self.timer = QTimer()
@@ -380,7 +382,9 @@ class EspressoModernGUI(QMainWindow):
         return lbl_val
 
     # --- LOGIC & DATA ---
-    def update_data(self, chunk):
+    def update_data(self, count):
+        chunk = self.worker.ring.read(self.rows_seen, count); self.rows_seen = count
+        if not len(chunk): return
         num = len(chunk)
         # Unpack chunk
         p_act = chunk[:, 0]
@@ -16,6 +16,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
                              QComboBox, QStyledItemDelegate)
 from PyQt6.QtGui import QColor, QFont
 import pyqtgraph as pg
+from sample_ring import SampleRing
 
 # --- CONFIGURATION ---
 SAMPLES_PER_PACKET = 50   
@@ -127,10 +128,11 @@ class MockEspressoMachine:
 
 # --- 2. WORKER THREAD ---
 class SerialWorker(QThread):
-    data_available = pyqtSignal(np.ndarray) 
+    rows_available = pyqtSignal(int) # new rows in self.ring up to this count
     def __init__(self):
         super().__init__()
         self.running = True
+        self.ring = SampleRing(4)
         self.connection = MockEspressoMachine() # Directly using mock for now
 
     def send_command(self, cmd_str):
@@ -140,12 +142,11 @@ class SerialWorker(QThread):
         while self.running:
             try:
                 raw = self.connection.read(PACKET_SIZE)
-                if len(raw) == PACKET_SIZE:
-                    unpacked = struct.unpack(PACKET_STRUCT_FMT, raw)
-                    if unpacked[0] == PACKET_HEADER:
-                        # Reshape: [P, F, Tw, Tg]
-                        chunk = np.array(unpacked[1:], dtype=np.float32).reshape(-1, 4)
-                        self.data_available.emit(chunk)
+                if len(raw) == PACKET_SIZE and raw[:len(PACKET_HEADER)] == PACKET_HEADER:
+                    # Rows: [P, F, Tw, Tg]
+                    self.ring.write_packet(raw, len(PACKET_HEADER))
+                count = self.ring.notify_due(force=len(raw) < PACKET_SIZE)
+                if count is not None: self.rows_available.emit(count)
             except: time.sleep(0.01)
 
     def stop(self):
@@ -213,7 +214,8 @@ class EspressoFinalGUI(QMainWindow):
         
         self.init_ui()
         self.worker = SerialWorker()
-        self.worker.data_available.connect(self.update_data)
+        self.rows_seen = 0
+        self.worker.rows_available.connect(self.update_data)
         self.worker.start()
         
         self.timer = QTimer()
@@ -341,7 +343,9 @@ class EspressoFinalGUI(QMainWindow):
         return lbl_v
 
     # --- LOGIC ---
-    def update_data(self, chunk):
+    def update_data(self, count):
+        chunk = self.worker.ring.read(self.rows_seen, count); self.rows_seen = count
+        if not len(chunk): return
         # Chunk: [Pressure, Flow, WaterTemp, GroupTemp]
         n = len(chunk)
         if self.ptr + n >= self.history: self.ptr = 0 # Simple reset
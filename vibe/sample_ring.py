@@ -0,0 +1,54 @@
+import time
+import numpy as np
+
+RING_ROWS = 1 << 14         # ~16 s @ 1kHz, less than any GUI's plot history
+NOTIFY_INTERVAL = 1 / 30.0  # s between "new rows" signals (display rate)
+
+class SampleRing:
+    """Preallocated ring of float32 sample rows, shared by a SerialWorker and the GUI.
+
+    The worker decodes each packet's payload with np.frombuffer straight into
+    the ring; nothing is built per sample. `count` is the number of rows ever
+    written and only moves on once they are in place, so the GUI can read any
+    rows below it. Views returned by read() are overwritten RING_ROWS rows
+    later, so copy anything kept longer than a frame."""
+
+    def __init__(self, width, rows=RING_ROWS):
+        self.width = width
+        self.rows = rows
+        self.data = np.zeros((rows, width), dtype=np.float32)
+        self.count = 0
+        self.notified = 0       # count at the last notification
+        self.t_notify = 0.0
+
+    def write_packet(self, raw, offset=0):
+        """Append the little-endian float32 payload of a packet (after `offset` header bytes)."""
+        chunk = np.frombuffer(raw, dtype='<f4', offset=offset).reshape(-1, self.width)
+        n = len(chunk)
+        i = self.count % self.rows
+        k = min(n, self.rows - i)
+        self.data[i:i + k] = chunk[:k]
+        self.data[:n - k] = chunk[k:]
+        self.count += n
+        return self.count
+
+    def read(self, start, end):
+        """Rows [start, end), oldest first. A view unless they wrap around the end of the ring.
+        Rows already overwritten are skipped."""
+        start = max(start, end - self.rows, 0)
+        i = start % self.rows
+        j = i + (end - start)
+        if j <= self.rows: return self.data[i:j]
+        return np.concatenate((self.data[i:], self.data[:j - self.rows]))
+
+    def last(self):
+        return self.data[(self.count - 1) % self.rows]
+
+    def notify_due(self, force=False):
+        """Count to announce, or None: there are new rows and NOTIFY_INTERVAL has passed
+        since the last announcement (or `force`, e.g. when the stream goes quiet)."""
+        if self.count == self.notified: return None
+        now = time.monotonic()
+        if not force and now - self.t_notify < NOTIFY_INTERVAL: return None
+        self.notified = self.count; self.t_notify = now
+        return self.count
@@ -0,0 +1,52 @@
+# Checks SampleRing against the old struct.unpack decode, across wrap-arounds,
+# and times both for a 1kHz stream of 10 and 50 sample packets.
+import struct
+import time
+import numpy as np
+from sample_ring import SampleRing
+
+def packets(n_packets, samples, width, seed=0):
+    rng = np.random.default_rng(seed)
+    fmt = f'<2s{samples * width}f'
+    data = rng.normal(size=(n_packets, samples * width)).astype(np.float32)
+    return fmt, data, [struct.pack(fmt, b'ES', *row) for row in data]
+
+def old_decode(fmt, raw, width):
+    unpacked = struct.unpack(fmt, raw)
+    return np.array(unpacked[1:], dtype=np.float32).reshape(-1, width)
+
+# Decode and wrap-around #
+fmt, data, raws = packets(1000, 10, 5)
+ring = SampleRing(5, rows=1024)
+expected = data.reshape(-1, 5)
+seen = 0
+for i, raw in enumerate(raws):
+    count = ring.write_packet(raw, 2)
+    if i % 7 == 0:
+        rows = ring.read(seen, count)
+        assert np.array_equal(rows, expected[max(seen, count - 1024):count])
+        seen = count
+assert np.array_equal(ring.last(), expected[-1])
+assert np.array_equal(ring.read(0, ring.count), expected[-1024:])   # overwritten rows skipped
+assert np.array_equal(old_decode(fmt, raws[-1], 5), expected[-10:])
+print('decode and wrap-around: ok')
+
+# Coalescing #
+ring = SampleRing(5)
+notices = sum(ring.notify_due() is not None for raw in raws[:100] if ring.write_packet(raw, 2))
+assert notices <= 2, notices
+assert ring.notify_due(force=True) == ring.count
+print('100 packets back to back: %d notifications'%notices)
+
+# Per packet cost #
+for samples, width in ((10, 5), (50, 4)):
+    fmt, data, raws = packets(2000, samples, width)
+    ring = SampleRing(width)
+    t1 = time.perf_counter()
+    for raw in raws: old_decode(fmt, raw, width)
+    t2 = time.perf_counter()
+    for raw in raws: ring.write_packet(raw, 2)
+    t3 = time.perf_counter()
+    print('%2d samples x %d: struct.unpack %6.1f us/packet   SampleRing %5.1f us/packet'%(
+        samples, width, 1e6*(t2 - t1)/len(raws), 1e6*(t3 - t2)/len(raws)))
+print('ok')